@@ -0,0 +1,137 @@
+"""
+Compares the single download_file call previously used by AthenaClient.__download_from_s3 with the parallel ranged-GET
+download_s3_object_in_parts, both going through botocore against a local S3 stand-in.
+
+The stand-in is a threaded HTTP server answering HEAD and (ranged) GET object requests from memory, with every
+connection throttled to --bandwidth bytes/s to mimic S3's per-connection throughput.
+
+Usage:
+    python benchmarks/bench_athena_download.py --size-mb 256 --bandwidth-mb 40
+"""
+import argparse
+import os
+import re
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+from qa_python_utils.aws.s3 import download_s3_object_in_parts
+
+BUCKET = 'bench-bucket'
+KEY = 'query_results/bench.csv'
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class S3StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # closes idle keep-alive connections so the handler threads end with the benchmark
+    timeout = 1
+    body = b''
+    bandwidth = None
+
+    def log_message(self, *args):
+        pass
+
+    def __range(self):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if match is None:
+            return 0, len(self.body) - 1, False
+        end = int(match.group(2)) if match.group(2) else len(self.body) - 1
+        return int(match.group(1)), min(end, len(self.body) - 1), True
+
+    def __send_headers(self, start, end, partial):
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('ETag', '"bench"')
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2018 00:00:00 GMT')
+        if partial:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(self.body)))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.__send_headers(0, len(self.body) - 1, False)
+
+    def do_GET(self):
+        start, end, partial = self.__range()
+        self.__send_headers(start, end, partial)
+        started_at = time.time()
+        for offset in range(start, end + 1, SEND_BLOCK_SIZE):
+            block = self.body[offset:min(offset + SEND_BLOCK_SIZE, end + 1)]
+            self.wfile.write(block)
+            if self.bandwidth:
+                # throttle to the configured per-connection bandwidth
+                expected = float(offset - start + len(block)) / self.bandwidth
+                time.sleep(max(0, expected - (time.time() - started_at)))
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+def start_s3_stand_in(body, bandwidth):
+    S3StandInHandler.body = body
+    S3StandInHandler.bandwidth = bandwidth
+    server = ThreadedHTTPServer(('127.0.0.1', 0), S3StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def timed(func):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        started_at = time.time()
+        func(path)
+        elapsed = time.time() - started_at
+        size = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--bandwidth-mb', type=float, default=40, help='per-connection bandwidth, 0 disables it')
+    parser.add_argument('--part-size-mb', type=int, default=16)
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--single-stream', action='store_true',
+                        help='disable s3transfer multipart in the baseline, as a plain GET would be')
+    args = parser.parse_args()
+
+    body = os.urandom(args.size_mb * 1024 * 1024)
+    server = start_s3_stand_in(body, args.bandwidth_mb * 1024 * 1024)
+    endpoint_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    session = boto3.session.Session(aws_access_key_id='bench', aws_secret_access_key='bench',
+                                    region_name='us-east-1')
+    s3_resource = session.resource('s3', endpoint_url=endpoint_url)
+    s3_client = session.client('s3', endpoint_url=endpoint_url)
+
+    config = TransferConfig(multipart_threshold=len(body) + 1) if args.single_stream else None
+    baseline, baseline_size = timed(
+        lambda path: s3_resource.Bucket(BUCKET).download_file(KEY, path, Config=config))
+    parallel, parallel_size = timed(
+        lambda path: download_s3_object_in_parts(s3_client, BUCKET, KEY, path,
+                                                 part_size=args.part_size_mb * 1024 * 1024,
+                                                 max_concurrency=args.max_concurrency))
+    server.shutdown()
+    server.server_close()
+
+    assert baseline_size == parallel_size == len(body)
+    print('size={}MB bandwidth_per_connection={}MB/s part_size={}MB max_concurrency={}'.format(
+        args.size_mb, args.bandwidth_mb, args.part_size_mb, args.max_concurrency))
+    print('Bucket.download_file:        {:8.2f}s {:8.1f}MB/s'.format(baseline, args.size_mb / baseline))
+    print('download_s3_object_in_parts: {:8.2f}s {:8.1f}MB/s'.format(parallel, args.size_mb / parallel))
+    print('speedup: {:.2f}x'.format(baseline / parallel))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares the per-cell column formatting previously done by AthenaClient.create_parquet_from_df with the column-wise
+format_dataframe_columns, checking both produce the same dataframe.
+
+Usage:
+    python benchmarks/bench_create_parquet_from_df.py --rows 1000000
+"""
+import argparse
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from qa_python_utils.aws.athena import format_dataframe_columns
+
+
+def legacy_format_entry(entry, clean_columns, column_index):
+    if entry is None or clean_columns is None:
+        return entry
+
+    list_clean_columns = list(clean_columns.keys())
+    new_type = clean_columns[list_clean_columns[column_index]]
+    if type(new_type) != list:
+        return new_type(entry)
+
+    regex_from = clean_columns[list_clean_columns[column_index]][1]
+    regex_to = clean_columns[list_clean_columns[column_index]][2]
+
+    return new_type[0](re.sub(regex_from, regex_to, entry))
+
+
+def legacy_format_dataframe_columns(df, raw_columns, clean_columns):
+    df = df.astype(object).where(pd.notnull(df), None)
+    new_df = pd.DataFrame()
+    for index, col_key in enumerate(raw_columns):
+        col, _type = col_key, raw_columns[col_key]
+
+        new_col = col if not clean_columns else list(clean_columns.keys())[index]
+        new_df[new_col] = pd.Series([legacy_format_entry(_type(entry), clean_columns,
+                                                         index) if entry is not None and entry != '' else None
+                                     for entry in df.loc[:, col]])
+    return new_df
+
+
+def make_dataframe(rows):
+    random = np.random.RandomState(0)
+    ids = random.randint(0, 10 ** 9, rows).astype(str).astype(object)
+    ids[::97] = ''
+    prices = (random.rand(rows) * 1000).round(2).astype(str).astype(object)
+    prices[::89] = None
+    documents = np.array(['{:03d}.{:03d}.{:03d}-{:02d}'.format(i % 1000, i % 999, i % 998, i % 97)
+                          for i in range(rows)], dtype=object)
+    documents[::83] = ''
+    flags = random.randint(0, 2, rows)
+    names = np.array(['name {}'.format(i % 5000) for i in range(rows)], dtype=object)
+    return pd.DataFrame({'id': ids, 'price': prices, 'document': documents, 'flag': flags, 'name': names})
+
+
+def assert_same_output(expected, actual):
+    pd.testing.assert_frame_equal(expected, actual)
+    for col in expected:
+        assert [type(value) for value in expected[col]] == [type(value) for value in actual[col]], col
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = make_dataframe(args.rows)
+    raw_columns = OrderedDict([('id', int), ('price', float), ('document', str), ('flag', bool), ('name', str)])
+    clean_columns = OrderedDict([('id', int), ('price', float), ('document', [int, r'[.-]', '']),
+                                 ('active', bool), ('name', str)])
+
+    started_at = time.time()
+    expected = legacy_format_dataframe_columns(df, raw_columns, clean_columns)
+    legacy = time.time() - started_at
+
+    started_at = time.time()
+    actual = format_dataframe_columns(df, raw_columns, clean_columns)
+    vectorized = time.time() - started_at
+
+    assert_same_output(expected, actual)
+    print('rows={}'.format(args.rows))
+    print('per-cell __format_entry:   {:8.2f}s'.format(legacy))
+    print('format_dataframe_columns: {:8.2f}s'.format(vectorized))
+    print('speedup: {:.2f}x'.format(legacy / vectorized))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.backoff import poll_intervals
+
+logger = QuintoAndarLogger('aws.async_watcher')
+
+
+class AsyncWatcher(object):
+    """
+    Base of the non-blocking clients: _wait returns a concurrent.futures.Future right away, and every id waited on is
+    polled by a single watcher thread in one call per round, so no thread is held per wait and finished ids stop being
+    polled. Waits fail once their timeout passes, and ids missing from not_found_polls polls in a row fail as not
+    found, if not_found_polls is set.
+
+    Subclasses implement:
+        - _poll(ids): dict of id -> description, ids unknown to the service being left out
+        - _outcome(id, description): None while the id is not finished, otherwise a (result, error) tuple
+        - _timeout_error(id) and _not_found_error(id): exceptions the futures fail with
+        - _on_timeout(id), optionally: called once every wait of an id timed out
+    """
+
+    def __init__(self, check_sleep_time, initial_sleep_time=0.2, timeout=None, not_found_polls=None, name='watcher'):
+        """
+        :param timeout: default seconds to wait for an id before its future fails, forever if None
+        """
+        self.check_sleep_time = check_sleep_time
+        self.initial_sleep_time = initial_sleep_time
+        self.timeout = timeout
+        self.not_found_polls = not_found_polls
+        self._condition = threading.Condition()
+        # id -> list of (future, deadline or None)
+        self._waiters = {}
+        self._misses = {}
+        self._closed = False
+        self._watcher = threading.Thread(target=self.__watch, name=name)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _wait(self, key, timeout=None):
+        """
+        :param timeout: seconds to wait before the future fails, the client timeout if None
+        :return: future resolved with the result of _outcome, or failed with its error
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('m=_wait, key={}, msg=client is closed'.format(key))
+            self._waiters.setdefault(key, []).append((future, time.time() + timeout if timeout is not None else None))
+            self._misses.setdefault(key, 0)
+            self._condition.notify()
+        return future
+
+    def close(self, timeout=None):
+        """
+        Stops the watcher once every wait in flight finished, waiting at most timeout seconds, the client timeout if
+        None. Waits still pending then fail with RuntimeError.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._watcher.join(timeout)
+        if not self._watcher.is_alive():
+            return
+
+        with self._condition:
+            waiters, self._waiters = self._waiters, {}
+            self._misses.clear()
+            self._condition.notify()
+        for key, key_waiters in waiters.items():
+            for future, _ in key_waiters:
+                future.set_exception(RuntimeError('m=close, key={}, msg=client closed before the wait finished'.format(
+                    key)))
+
+    def _poll(self, keys):
+        raise NotImplementedError()
+
+    def _outcome(self, key, description):
+        raise NotImplementedError()
+
+    def _timeout_error(self, key):
+        raise NotImplementedError()
+
+    def _not_found_error(self, key):
+        raise NotImplementedError()
+
+    def _on_timeout(self, key):
+        pass
+
+    def __sleep_times(self):
+        return poll_intervals(initial=self.initial_sleep_time, maximum=self.check_sleep_time)
+
+    def __watch(self):
+        sleep_times = self.__sleep_times()
+        while True:
+            with self._condition:
+                if not self._waiters and not self._closed:
+                    self._condition.wait()
+                    # new waits start being polled quickly again
+                    sleep_times = self.__sleep_times()
+                if not self._waiters:
+                    return
+                pending = list(self._waiters)
+
+            try:
+                descriptions = self._poll(pending)
+            except Exception as e:
+                logger.error('m=__watch, msg=failed to poll, it will be retried. Error: {}'.format(e))
+                descriptions = None
+
+            if descriptions is not None:
+                for key in pending:
+                    description = descriptions.get(key)
+                    outcome = self._outcome(key, description) if description is not None else None
+                    if outcome is not None:
+                        self.__resolve(key, *outcome)
+                    elif (self.not_found_polls is not None and
+                          self.__count_miss(key, description is None) >= self.not_found_polls):
+                        self.__resolve(key, error=self._not_found_error(key))
+            self.__expire()
+
+            with self._condition:
+                if self._waiters:
+                    self._condition.wait(next(sleep_times))
+
+    def __count_miss(self, key, missing):
+        with self._condition:
+            self._misses[key] = self._misses.get(key, 0) + 1 if missing else 0
+            return self._misses[key]
+
+    def __expire(self):
+        now = time.time()
+        expired = []
+        abandoned = []
+        with self._condition:
+            for key, waiters in list(self._waiters.items()):
+                alive = [(future, deadline) for future, deadline in waiters if deadline is None or deadline > now]
+                expired.extend((key, future) for future, deadline in waiters if deadline is not None and
+                               deadline <= now)
+                if alive:
+                    self._waiters[key] = alive
+                else:
+                    del self._waiters[key]
+                    self._misses.pop(key, None)
+                    abandoned.append(key)
+
+        # handled before the futures fail, so their callers find the timeout already acted on
+        for key in abandoned:
+            try:
+                self._on_timeout(key)
+            except Exception as e:
+                logger.error('m=__expire, key={}, msg=failed to handle the timeout. Error: {}'.format(key, e))
+        for key, future in expired:
+            future.set_exception(self._timeout_error(key))
+
+    def __resolve(self, key, result=None, error=None):
+        with self._condition:
+            waiters = self._waiters.pop(key, [])
+            self._misses.pop(key, None)
+
+        for future, _ in waiters:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -1,15 +1,37 @@
+import os
 import re
 import sys
+import tempfile
 import time
 import json
-import boto3
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from urllib import quote, unquote
 import botocore
 import fastparquet as fp
+import numpy as np
 import pandas as pd
-import s3fs
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.athena_types import DEFAULT_CATEGORICAL_THRESHOLD, apply_athena_types
+from qa_python_utils.aws.athena_executor import DEFAULT_MAX_DOWNLOAD_WORKERS, DEFAULT_MAX_RUNNING_QUERIES, \
+    AthenaQueryExecutor
+from qa_python_utils.aws.athena_metrics import QueryMetrics
+from qa_python_utils.aws.athena_queries import QueryRegistry, supports_execution_parameters
+from qa_python_utils.aws.backoff import RETRY_LOOP_ERRORS, RETRYABLE_ERROR_CODES, TokenBucket, error_code, \
+    is_retryable_error, poll_intervals, retry_delay
+from qa_python_utils.aws.clients import DEFAULT_MAX_POOL_CONNECTIONS, get_client, get_resource, get_s3_filesystem
+from qa_python_utils.aws.parallel import NO_INITIALIZER, map_reduce
+from qa_python_utils.aws.parquet import DEFAULT_SMALL_ROW_GROUP_ROWS, append_parquet_dataset, \
+    compact_parquet_dataset, write_parquet_row_groups
+from qa_python_utils.aws.prefetch import prefetch
+from qa_python_utils.aws.s3 import DEFAULT_MAX_CONCURRENCY, DEFAULT_PART_SIZE, DEFAULT_RANGE_SIZE, \
+    delete_s3_prefix, download_s3_object_in_parts, list_partition_prefixes, list_s3_objects, open_s3_object, \
+    parse_s3_url
+from qa_python_utils.aws.spool import get_default_spool
 
 # while working with ipython notebooks, the stdout would be sent to the default tunnel (server)
 # in order to work it around, the stdout needs to be stored and then reassigned after working with sys
@@ -20,34 +42,219 @@ sys.stdout = stdout
 
 logger = QuintoAndarLogger('aws.athena')
 
+QUERY_TIMEOUT = 7200
+BATCH_GET_QUERY_EXECUTION_MAX_IDS = 50
+GET_QUERY_RESULTS_MAX_RESULTS = 1000
+MAX_QUERY_STRING_BYTES = 262144
+DEFAULT_PARTITION_DDL_WORKERS = 4
+DEFAULT_MAX_PARTITIONS_PER_STATEMENT = 100
+DEFAULT_UNLOAD_WORKERS = 8
+START_QUERY_EXECUTION_MAX_ATTEMPTS = 5
+# default StartQueryExecution quota of an account and region, in calls per second and burst
+START_QUERY_EXECUTION_RATE = 20
+START_QUERY_EXECUTION_BURST = 80
+# compressions fastparquet reads without optional dependencies
+UNLOAD_COMPRESSION = 'GZIP'
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# Athena result files quote every value and leave nulls as unquoted empty fields, which pandas cannot tell from
+# quoted empty strings, so nulls are replaced with this marker before parsing
+CSV_NULL_MARKER = '__QA_PYTHON_UTILS_NULL__'
+# a quoted field, kept as is, or the position of an unquoted empty field
+CSV_NULL_FIELD_REGEX = re.compile(r'("(?:[^"]|"")*")|(?:^|(?<=,))(?=,|\r?\n|$)')
+# shared by every AthenaClient of the process, so that all their threads together stay under the quota
+start_query_execution_limiter = TokenBucket(START_QUERY_EXECUTION_RATE, START_QUERY_EXECUTION_BURST)
+# types numpy can cast a whole column to, giving the same values as calling the type on each entry
+VECTORIZED_CAST_TYPES = (int, float, bool, str)
+# Parquet types of the column types of raw_columns and clean_columns, columns of other types being inferred
+PARQUET_DTYPES = {int: np.int64, long: np.int64, float: np.float64, bool: np.bool_, str: str, unicode: unicode}
+
+
+def format_dataframe_columns(df, raw_columns, clean_columns=None):
+    """
+    Builds a new dataframe with the raw_columns of df, each cast to its type. Null and empty entries become None.
+    :param df: source dataframe
+    :param raw_columns: ordered dict of column name -> type
+    :param clean_columns: optional ordered dict, positionally matching raw_columns, of output column name -> type or
+        [type, regex_from, regex_to] to cast the entries again after replacing regex_from by regex_to
+    :return: formatted dataframe
+    """
+    clean_column_names = list(clean_columns.keys()) if clean_columns else None
+    new_df = pd.DataFrame()
+    for index, col in enumerate(raw_columns):
+        new_col = clean_column_names[index] if clean_columns else col
+        new_df[new_col] = _format_column(df[col], raw_columns[col], clean_columns[new_col] if clean_columns else None)
+    return new_df
+
+
+def _formatted_column_types(raw_columns, clean_columns=None):
+    """
+    :return: ordered dict of the columns of format_dataframe_columns -> the type their entries are cast to last
+    """
+    if not clean_columns:
+        return OrderedDict(raw_columns)
+    return OrderedDict((col, _type[0] if isinstance(_type, list) else _type) for col, _type in clean_columns.items())
+
+
+def _format_column(series, _type, clean_type=None):
+    series = series.astype(object)
+    mask = (series.notnull() & (series != '')).values
+    values = _cast_column(series[mask], _type)
+
+    if isinstance(clean_type, list):
+        regex_from = re.compile(clean_type[1]) if isinstance(clean_type[1], basestring) else clean_type[1]
+        values = _cast_column(values.str.replace(regex_from, clean_type[2]), clean_type[0])
+    elif clean_type is not None:
+        values = _cast_column(values, clean_type)
+
+    result = np.empty(len(series), dtype=object)
+    result[:] = None
+    result[mask] = values.values
+    # built from python objects, so the resulting dtype is inferred exactly as for a list of formatted entries
+    return pd.Series(result.tolist())
+
+
+def _partition_value(value):
+    """
+    :return: the hive partition value of a column entry, nulls going to the HIVE_DEFAULT_PARTITION directory
+    """
+    if pd.isnull(value):
+        return HIVE_DEFAULT_PARTITION
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        # integer columns with nulls hold floats
+        return str(int(value))
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        return value.date().isoformat()
+    return str(value)
+
+
+def _cast_column(values, _type):
+    if _type in VECTORIZED_CAST_TYPES:
+        try:
+            return values.astype(_type)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return values.map(_type)
+
+
+class _MarkedNullsFile(object):
+    """
+    Read only view of an Athena result file with its unquoted empty fields replaced with CSV_NULL_MARKER
+    """
+
+    def __init__(self, f):
+        self._records = self.__records(f)
+        self._buffer = ''
+
+    @staticmethod
+    def __records(f):
+        record = ''
+        for line in f:
+            record += line
+            # quoted fields may span lines, a record is complete once its quotes are balanced
+            if record.count('"') % 2 == 0:
+                yield CSV_NULL_FIELD_REGEX.sub(lambda match: match.group(1) or CSV_NULL_MARKER, record)
+                record = ''
+        if record:
+            yield record
+
+    def __iter__(self):
+        if self._buffer:
+            yield self.read()
+        for record in self._records:
+            yield record
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            record = next(self._records, None)
+            if record is None:
+                break
+            self._buffer += record
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
 
 class AthenaClient(object):
     @logger(exclude=["aws_access_key_id", "aws_secret_access_key"])
     def __init__(self, s3_bucket=None, aws_access_key_id=None, aws_secret_access_key=None,
-                 bucket_folder_path='query_results'):
+                 bucket_folder_path='query_results', download_part_size=DEFAULT_PART_SIZE,
+                 download_max_concurrency=DEFAULT_MAX_CONCURRENCY, result_cache=None,
+                 categorical_threshold=DEFAULT_CATEGORICAL_THRESHOLD, metrics=None,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, query_directory=None, spool=None):
         self.s3_bucket = s3_bucket
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
-        if self.aws_access_key_id is not None and self.aws_secret_access_key is not None:
-            self.athena_client = boto3.client('athena', aws_access_key_id=aws_access_key_id,
-                                              aws_secret_access_key=aws_secret_access_key)
-            self.s3_resource = boto3.resource('s3', aws_access_key_id=aws_access_key_id,
-                                              aws_secret_access_key=aws_secret_access_key)
-        else:
-            self.athena_client = boto3.client('athena')
-            self.s3_resource = boto3.resource('s3')
+        self.max_pool_connections = max_pool_connections
+        if self.aws_access_key_id is None or self.aws_secret_access_key is None:
+            self.aws_access_key_id = self.aws_secret_access_key = None
+        # clients are shared by every AthenaClient with the same credentials, see qa_python_utils.aws.clients
+        self.athena_client = get_client('athena', aws_access_key_id=self.aws_access_key_id,
+                                        aws_secret_access_key=self.aws_secret_access_key,
+                                        max_pool_connections=max_pool_connections)
+        # submissions are retried by execute_raw_query, so botocore must not retry each attempt again underneath
+        self.submit_client = get_client('athena', aws_access_key_id=self.aws_access_key_id,
+                                        aws_secret_access_key=self.aws_secret_access_key,
+                                        max_pool_connections=max_pool_connections,
+                                        config=Config(retries={'max_attempts': 0}))
+        self.s3_resource = get_resource('s3', aws_access_key_id=self.aws_access_key_id,
+                                        aws_secret_access_key=self.aws_secret_access_key,
+                                        max_pool_connections=max_pool_connections)
 
         self.bucket_folder_path = bucket_folder_path
+        self.download_part_size = download_part_size
+        self.download_max_concurrency = download_max_concurrency
+        # optional AthenaResultCache used by execute_query_and_return_dataframe
+        self.result_cache = result_cache
+        # typed reads turn string columns with at most this ratio of distinct values into categoricals
+        self.categorical_threshold = categorical_threshold
+        # QueryMetrics of every query run or read by this client, see metrics.summary()
+        self.metrics = metrics if metrics is not None else QueryMetrics()
+        # templates of execute_file_query and of the named queries in query_directory, see execute_named_query
+        self.query_registry = QueryRegistry(query_directory)
+        # downloaded results, reused by later reads of the same execution, see ResultSpool
+        self.spool = spool if spool is not None else get_default_spool()
 
     @logger
     def execute_file_query(self, filename, query_params=None, s3_bucket=None, bucket_folder_path=None):
-        with open(filename) as f:
-            sql = f.read()
-            return self.execute_raw_query(
-                sql=sql.format(**query_params) if query_params else sql,
-                s3_bucket=s3_bucket,
-                bucket_folder_path=bucket_folder_path
-            )
+        """
+        Runs the SQL template in filename, which is read once and cached until it changes, see QueryTemplate for its
+        parameters
+        """
+        return self.__execute_template(self.query_registry.load_file(filename), query_params, s3_bucket,
+                                       bucket_folder_path)
+
+    @logger
+    def execute_named_query(self, name, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        Runs a query of query_directory by name, such as daily/users for query_directory/daily/users.sql
+        """
+        return self.__execute_template(self.query_registry.get(name), query_params, s3_bucket, bucket_folder_path)
+
+    @logger
+    def execute_named_query_and_return_dataframe(self, name, query_params=None, s3_bucket=None,
+                                                 bucket_folder_path=None, typed=False):
+        query_execution_id = self.execute_named_query(
+            name=name,
+            query_params=query_params,
+            s3_bucket=s3_bucket,
+            bucket_folder_path=bucket_folder_path
+        )
+        return self.get_dataframe_from_query_execution_id(query_execution_id, typed=typed)
+
+    def __execute_template(self, template, query_params, s3_bucket, bucket_folder_path):
+        # values are bound as execution parameters when the installed botocore supports them, otherwise inlined
+        sql, execution_parameters = template.render(query_params,
+                                                    bind=supports_execution_parameters(self.athena_client))
+        return self.execute_raw_query(
+            sql=sql,
+            s3_bucket=s3_bucket,
+            bucket_folder_path=bucket_folder_path,
+            execution_parameters=execution_parameters
+        )
 
     @logger
     def execute_file_query_and_return_dataframe(self, filename, query_params=None, s3_bucket=None,
@@ -61,22 +268,159 @@ class AthenaClient(object):
         return self.get_dataframe_from_query_execution_id(query_execution_id)
 
     def execute_query_and_return_dataframe(self, sql, query_params=None, paginate=False, page_size=1000, s3_bucket=None,
-                                           bucket_folder_path=None):
+                                           bucket_folder_path=None, chunk_size=None, typed=False, unload=False):
         logger.info(
             'm=execute_query_and_return_dataframe, sql={}, query_params={}, paginate={}, page_size={}, s3_bucket={}, '
-            'bucket_folder_path={}'.format(
-                sql, query_params, paginate, page_size, s3_bucket, bucket_folder_path))
+            'bucket_folder_path={}, chunk_size={}, typed={}, unload={}'.format(
+                sql, query_params, paginate, page_size, s3_bucket, bucket_folder_path, chunk_size, typed, unload))
+
+        if unload:
+            # results are typed by the Parquet schema and their files deleted once read, so they are never cached
+            return self.execute_unload_query_and_return_dataframe(sql, query_params, chunked=bool(chunk_size),
+                                                                  s3_bucket=s3_bucket,
+                                                                  bucket_folder_path=bucket_folder_path)
+
+        sql = sql.format(**query_params) if query_params else sql
+        cache_key = None
+        query_execution_id = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.make_key(sql, query_params, 's3://{}/{}/'.format(
+                s3_bucket or self.s3_bucket, bucket_folder_path or self.bucket_folder_path))
+            if not paginate and not chunk_size:
+                df = self.result_cache.get_dataframe(cache_key, variant=typed)
+                if df is not None:
+                    logger.info('m=execute_query_and_return_dataframe, msg=dataframe cache hit')
+                    return df
+            query_execution_id = self.result_cache.get_query_execution_id(cache_key)
+
+        cache_hit = query_execution_id is not None
+        if cache_key is None:
+            query_execution_id = self.execute_raw_query(
+                sql=sql,
+                s3_bucket=s3_bucket,
+                bucket_folder_path=bucket_folder_path
+            )
+        elif not cache_hit:
+            query_execution_id = self.__execute_query_into_cache(cache_key, sql, s3_bucket, bucket_folder_path)
+        else:
+            logger.info('m=execute_query_and_return_dataframe, query_execution_id={}, msg=query execution cache '
+                        'hit'.format(query_execution_id))
 
+        if paginate:
+            return self.get_paginated_dataframe_from_query_execution_id(query_execution_id=query_execution_id,
+                                                                        page_size=page_size, typed=typed)
+        elif chunk_size:
+            return self.get_chunked_dataframe_from_query_execution_id(query_execution_id=query_execution_id,
+                                                                      chunk_size=chunk_size, typed=typed)
+
+        try:
+            df = self.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id, file_ext='csv',
+                                                            typed=typed)
+        except IOError:
+            if not cache_hit:
+                raise
+            # the cached result was removed from S3, so the query has to run again
+            self.result_cache.invalidate(cache_key)
+            query_execution_id = self.__execute_query_into_cache(cache_key, sql, s3_bucket, bucket_folder_path)
+            df = self.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id, file_ext='csv',
+                                                            typed=typed)
+
+        if cache_key is not None:
+            self.result_cache.put_dataframe(cache_key, query_execution_id, df, variant=typed)
+        return df
+
+    def __execute_query_into_cache(self, cache_key, sql, s3_bucket, bucket_folder_path):
         query_execution_id = self.execute_raw_query(
-            sql=sql.format(**query_params) if query_params else sql,
+            sql=sql,
             s3_bucket=s3_bucket,
             bucket_folder_path=bucket_folder_path
         )
-        if paginate:
-            return self.get_paginated_dataframe_from_query_execution_id(query_execution_id=query_execution_id,
-                                                                        page_size=page_size)
-        else:
-            return self.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id, file_ext='csv')
+        # only successful executions are worth reusing
+        self.wait_for_query_results(query_execution_id)
+        self.result_cache.put_query_execution_id(cache_key, query_execution_id)
+        return query_execution_id
+
+    def execute_unload_query_and_return_dataframe(self, sql, query_params=None, chunked=False, s3_bucket=None,
+                                                  bucket_folder_path=None, max_workers=DEFAULT_UNLOAD_WORKERS):
+        """
+        Fast path for large results: the query is wrapped in UNLOAD ... WITH (format = 'PARQUET'), so Athena writes
+        typed, compressed and usually several Parquet files to a scratch prefix under bucket_folder_path. They are read
+        concurrently with fastparquet, and the scratch prefix is deleted afterwards.
+        :param sql: a SELECT query, which may not use ORDER BY without LIMIT, as UNLOAD does not keep order
+        :param chunked: if True, returns an iterator of one DataFrame per file instead of a single DataFrame, reading
+            at most max_workers files ahead. The query only runs once iteration starts, and the scratch prefix is only
+            deleted once the iterator is exhausted or closed, so iterate it to the end or call its close() method
+        :param max_workers: maximum number of files read at the same time
+        """
+        s3_bucket = s3_bucket or self.s3_bucket
+        bucket_folder_path = bucket_folder_path or self.bucket_folder_path
+        scratch_prefix = '{}/unload/{}/'.format(bucket_folder_path, uuid.uuid4())
+        sql = sql.format(**query_params) if query_params else sql
+        unload_sql = "UNLOAD ({}) TO 's3://{}/{}' WITH (format = 'PARQUET', compression = '{}')".format(
+            sql.strip().rstrip(';'), s3_bucket, scratch_prefix, UNLOAD_COMPRESSION)
+        logger.info('m=execute_unload_query_and_return_dataframe, sql={}, scratch_prefix={}, chunked={}'.format(
+            sql, scratch_prefix, chunked))
+
+        dfs = self.__iter_unloaded_dataframes(unload_sql, s3_bucket, bucket_folder_path, scratch_prefix, max_workers)
+        if chunked:
+            return dfs
+
+        dfs = list(dfs)
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+    def __iter_unloaded_dataframes(self, unload_sql, s3_bucket, bucket_folder_path, scratch_prefix, max_workers):
+        s3_client = self.s3_resource.meta.client
+        try:
+            query_execution_id = self.execute_query_and_wait_for_results(sql=unload_sql, s3_bucket=s3_bucket,
+                                                                         bucket_folder_path=bucket_folder_path)
+            objects = [(key, size) for key, size in list_s3_objects(s3_client, s3_bucket, scratch_prefix) if size > 0]
+            self.metrics.record(query_execution_id, 'result_bytes', sum(size for _, size in objects))
+            s3_fs = self.__get_s3_filesystem()
+
+            def open_with(path, mode='rb'):
+                # each file stands alone, so fastparquet's lookup of a dataset _metadata file is skipped
+                if path.endswith('/_metadata'):
+                    raise IOError('m=open_with, path={}, msg=not a dataset'.format(path))
+                return s3_fs.open(path, mode)
+
+            def read(key):
+                return fp.ParquetFile('{}/{}'.format(s3_bucket, key), open_with=open_with).to_pandas()
+
+            # files are read ahead on the pool, at most max_workers at a time, and yielded in order
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                keys = iter(key for key, _ in objects)
+                pending = deque(executor.submit(read, key) for key in islice(keys, max_workers))
+                try:
+                    while pending:
+                        with self.metrics.timer(query_execution_id, 'download'):
+                            df = pending.popleft().result()
+                        key = next(keys, None)
+                        if key is not None:
+                            pending.append(executor.submit(read, key))
+                        yield df
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            delete_s3_prefix(s3_client, s3_bucket, scratch_prefix)
+
+    def execute_queries_and_return_dataframes(self, queries, query_params=None, s3_bucket=None, bucket_folder_path=None,
+                                              max_running_queries=DEFAULT_MAX_RUNNING_QUERIES,
+                                              max_download_workers=DEFAULT_MAX_DOWNLOAD_WORKERS):
+        """
+        Runs many queries concurrently, at most max_running_queries at a time, and yields (sql, DataFrame) tuples as
+        they complete. See AthenaQueryExecutor to submit queries and files individually and get futures back.
+        """
+        queries = list(queries)
+        logger.info(
+            'm=execute_queries_and_return_dataframes, queries={}, query_params={}, s3_bucket={}, bucket_folder_path={}, '
+            'max_running_queries={}, max_download_workers={}'.format(
+                len(queries), query_params, s3_bucket, bucket_folder_path, max_running_queries, max_download_workers))
+
+        with AthenaQueryExecutor(self, max_running_queries=max_running_queries,
+                                 max_download_workers=max_download_workers) as executor:
+            for sql, df in executor.map(queries, query_params, s3_bucket, bucket_folder_path):
+                yield sql, df
 
     def execute_txt_query_and_return_dataframe(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
         logger.info(
@@ -92,12 +436,11 @@ class AthenaClient(object):
         return self.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id, file_ext='txt')
 
     @logger
-    def execute_raw_query(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
-        logger.info('m=execute_raw_query, sql={}, query_params=None, s3_bucket={}, bucket_folder_path={}'.format(
-            sql,
-            query_params,
-            s3_bucket,
-            bucket_folder_path))
+    def execute_raw_query(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None,
+                          execution_parameters=None):
+        logger.info('m=execute_raw_query, sql={}, query_params={}, s3_bucket={}, bucket_folder_path={}, '
+                    'execution_parameters={}'.format(sql, query_params, s3_bucket, bucket_folder_path,
+                                                     execution_parameters))
 
         s3_bucket = s3_bucket or self.s3_bucket
         bucket_folder_path = bucket_folder_path or self.bucket_folder_path
@@ -107,113 +450,340 @@ class AthenaClient(object):
                 'm=execute_raw_query, s3_bucket={}, bucket_folder_path={}, msg=s3 path must be complete'.format(
                     s3_bucket, bucket_folder_path))
 
-        count = 0
-        while count < 3:
+        kwargs = {
+            'QueryString': sql.format(**query_params) if query_params else sql,
+            'ResultConfiguration': {
+                'OutputLocation': 's3://{}/{}/'.format(s3_bucket, bucket_folder_path)
+            }
+        }
+        if execution_parameters:
+            kwargs['ExecutionParameters'] = execution_parameters
+        # the same token on every attempt, so an attempt that started the query before failing is not run twice
+        kwargs['ClientRequestToken'] = str(uuid.uuid4())
+
+        start_time = time.time()
+        for attempt in range(1, START_QUERY_EXECUTION_MAX_ATTEMPTS + 1):
+            start_query_execution_limiter.acquire()
             try:
-                response = self.athena_client.start_query_execution(
-                    QueryString=sql.format(**query_params) if query_params else sql,
-                    ResultConfiguration={
-                        'OutputLocation': 's3://{}/{}/'.format(s3_bucket, bucket_folder_path)
-                    }
-                )
+                response = self.submit_client.start_query_execution(**kwargs)
+                self.metrics.record(response['QueryExecutionId'], 'submit_seconds', time.time() - start_time)
                 return response['QueryExecutionId']
-            except ClientError as e:
-                logger.error(
-                    'm={}.init, msg=query failed, it will be retried in 60 seconds. Error: {}.'.format(
-                        'execute_raw_query', e.response['Error']['Message']))
-                time.sleep(60)
-                count += 1
+            except RETRY_LOOP_ERRORS as e:
+                if not is_retryable_error(e):
+                    raise RuntimeError('m=execute_raw_query, code={}, msg=athena query failed. Error: {}.'.format(
+                        e.response['Error']['Code'], e.response['Error']['Message']))
+                if attempt == START_QUERY_EXECUTION_MAX_ATTEMPTS:
+                    break
+
+                delay = retry_delay(attempt)
+                logger.warn('m=execute_raw_query, attempt={}, code={}, msg=query failed, it will be retried in {:.1f} '
+                            'seconds. Error: {}.'.format(attempt, error_code(e), delay, e))
+                time.sleep(delay)
 
-        raise RuntimeError('m={}.init, msg=athena query failed three times.'.format('execute_raw_query'))
+        raise RuntimeError('m=execute_raw_query, msg=athena query failed {} times.'.format(
+            START_QUERY_EXECUTION_MAX_ATTEMPTS))
 
     @logger
-    def __download_from_s3(self, key):
+    def __download_from_s3(self, query_execution_id, bucket, key):
+        """
+        Downloads a result file into the spool, unless it is already there from an earlier read
+        :param bucket: bucket of the query's OutputLocation
+        :param key: key of the query's OutputLocation
+        :return: the local file, open for reading, or None if it does not exist
+        """
+
+        def download(path):
+            download_s3_object_in_parts(self.s3_resource.meta.client, bucket, key, path,
+                                        part_size=self.download_part_size,
+                                        max_concurrency=self.download_max_concurrency)
+
         try:
-            self.s3_resource.Bucket(self.s3_bucket).download_file('{}/{}'.format(self.bucket_folder_path, key),
-                                                                  '/tmp/{}'.format(key))
+            return self.spool.open_or_create(query_execution_id + os.path.splitext(key)[1], download)
         except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
                 logger.error("m=__download_from_s3, msg=The object does not exist.")
-                return False
+                return None
             else:
                 raise
-        return True
 
     @logger
-    def get_dataframe_from_query_execution_id(self, query_execution_id, check_sleep_time=2, file_ext='csv'):
-        self.wait_for_query_results(query_execution_id, check_sleep_time)
-        key = '{0}.{1}'.format(query_execution_id, file_ext)
-        self.__download_from_s3(key)
-        return pd.read_csv('/tmp/{}'.format(key), keep_default_na=False, sep='\t' if file_ext == 'txt' else ',',
-                           header=-1 if file_ext == 'txt' else 'infer')
+    def get_dataframe_from_query_execution_id(self, query_execution_id, check_sleep_time=2, file_ext='csv',
+                                              typed=False):
+        """
+        Reads the whole result of a query. By default columns are parsed by pandas, with typed=True they are converted
+        from the query's column metadata instead, see apply_athena_types.
+        """
+        # the finished execution already has the result location
+        bucket, key = self.__get_query_output_location(self.wait_for_query_results(query_execution_id, check_sleep_time))
+        with self.metrics.timer(query_execution_id, 'download'):
+            f = self.__download_from_s3(query_execution_id, bucket, key)
+        if f is None:
+            raise IOError('m=get_dataframe_from_query_execution_id, query_execution_id={}, msg=result file not '
+                          'found'.format(query_execution_id))
+        with f:
+            self.metrics.record(query_execution_id, 'result_bytes', os.fstat(f.fileno()).st_size)
+            with self.metrics.timer(query_execution_id, 'parse'):
+                df = pd.read_csv(f, keep_default_na=False, sep='\t' if file_ext == 'txt' else ',',
+                                 header=-1 if file_ext == 'txt' else 'infer', dtype=str if typed else None)
+
+        if typed:
+            column_info = self.get_query_column_info(query_execution_id)
+            with self.metrics.timer(query_execution_id, 'parse'):
+                apply_athena_types(df, column_info, self.categorical_threshold)
+        return df
 
     @logger
-    def get_paginated_dataframe_from_query_execution_id(self, query_execution_id, check_sleep_time=2, page_size=1000):
+    def get_chunked_dataframe_from_query_execution_id(self, query_execution_id, check_sleep_time=2, chunk_size=100000,
+                                                      range_size=DEFAULT_RANGE_SIZE, dtype=None, typed=False):
+        """
+        Streams the query result file straight from S3 with ranged GETs, yielding dataframes of up to chunk_size rows.
+        Neither the local disk nor the full result are needed, and quoted fields spanning ranges are parsed correctly.
+        With typed=True columns are converted from the query's column metadata, see apply_athena_types. As reading and
+        parsing overlap, the time spent producing chunks is recorded as download and only typing as parse.
+        """
+        bucket, key = self.__get_query_output_location(self.wait_for_query_results(query_execution_id, check_sleep_time))
+        is_txt = key.endswith('.txt')
+        column_info = self.get_query_column_info(query_execution_id) if typed else None
+
+        # a result already in the spool is read from disk
+        spooled = self.spool.open(query_execution_id + os.path.splitext(key)[1])
+        with (spooled if spooled is not None else
+              open_s3_object(self.s3_resource.meta.client, bucket, key, range_size=range_size)) as f:
+            if spooled is None:
+                self.metrics.record(query_execution_id, 'result_bytes', f.raw.size)
+            chunks = pd.read_csv(f, chunksize=chunk_size, keep_default_na=False, sep='\t' if is_txt else ',',
+                                 header=-1 if is_txt else 'infer', dtype=str if typed else dtype)
+            categorical_columns = {}
+            while True:
+                with self.metrics.timer(query_execution_id, 'download'):
+                    df = next(chunks, None)
+                if df is None:
+                    break
+                if typed:
+                    with self.metrics.timer(query_execution_id, 'parse'):
+                        apply_athena_types(df, column_info, self.categorical_threshold, categorical_columns)
+                yield df
+
+    @logger(exclude=['map_function', 'reduce_function', 'initializer'])
+    def map_reduce_query_results(self, query_execution_id, map_function, reduce_function, initializer=NO_INITIALIZER,
+                                 chunk_size=100000, typed=False, processes=None, max_in_flight=None):
+        """
+        Aggregates a query result on every core: chunks of chunk_size rows are streamed from S3 into a process pool,
+        map_function is applied to each one and the partial results are combined with reduce_function, in order.
+        Only max_in_flight chunks are read ahead of the pool, see map_reduce.
+
+        Usage:
+            def count_by_city(df):
+                return df.groupby('city').size()
+
+            counts = athena_client.map_reduce_query_results(query_execution_id, count_by_city,
+                                                            lambda total, counts: total.add(counts, fill_value=0))
+        :param map_function: picklable function, defined at module level, taking a DataFrame
+        :param reduce_function: function taking the accumulated value and one mapped result
+        :return: the reduced value
+        """
+        chunks = self.get_chunked_dataframe_from_query_execution_id(query_execution_id, chunk_size=chunk_size,
+                                                                    typed=typed)
+        return map_reduce(chunks, map_function, reduce_function, initializer=initializer, processes=processes,
+                          max_in_flight=max_in_flight)
+
+    @logger
+    def get_paginated_dataframe_from_query_execution_id(self, query_execution_id, check_sleep_time=2, page_size=1000,
+                                                        typed=False, prefetch_pages=1):
+        """
+        Yields the result of a query in dataframes of page_size rows. Up to prefetch_pages pages are fetched ahead on
+        a background thread while the current one is processed, 0 fetches each page only when it is requested.
+        """
         self.wait_for_query_results(query_execution_id, check_sleep_time)
-        final_run = False
-        first_run = True
+        spooled = self.spool.open(query_execution_id + '.csv')
+        if spooled is not None:
+            pages = self.__iter_spooled_dataframe_pages(query_execution_id, spooled, page_size, typed)
+        else:
+            pages = self.__iter_dataframe_pages(query_execution_id, page_size, typed)
+        for df in (prefetch(pages, depth=prefetch_pages) if prefetch_pages else pages):
+            yield df
+
+    def __iter_spooled_dataframe_pages(self, query_execution_id, spooled, page_size, typed):
+        # pages of a result already in the spool are read from disk, as the API would return them
+        logger.info('m=__iter_spooled_dataframe_pages, query_execution_id={}, msg=reading spooled result'.format(
+            query_execution_id))
+        with spooled as f:
+            column_info = self.get_query_column_info(query_execution_id)
+            names = [str(column['Name']) for column in column_info]
+            categorical_columns = {}
+            for df in pd.read_csv(_MarkedNullsFile(f), header=None, skiprows=1, names=range(len(names)), dtype=str,
+                                  keep_default_na=False, na_values=[CSV_NULL_MARKER], chunksize=page_size):
+                with self.metrics.timer(query_execution_id, 'parse'):
+                    # the API has no value for nulls and keeps empty strings, as the marked csv does
+                    df = df.where(df.notnull(), None).reset_index(drop=True)
+                    df.columns = names
+                    if typed:
+                        apply_athena_types(df, column_info, self.categorical_threshold, categorical_columns)
+                yield df
+
+    def __iter_dataframe_pages(self, query_execution_id, page_size, typed):
         token = None
-        columns = []
-        while not final_run:
-            data = []
-            if token:
-                result = self.athena_client.get_query_results(
-                    QueryExecutionId=query_execution_id,
-                    NextToken=token,
-                    MaxResults=page_size
-                )
-            else:
-                result = self.athena_client.get_query_results(
-                    QueryExecutionId=query_execution_id,
-                    MaxResults=page_size
-                )
-            if first_run:
-                for value in result['ResultSet']['Rows'][0]['Data']:
-                    columns.append(str(value.get('VarCharValue')))
-
-                for rows in result['ResultSet']['Rows'][1:]:
-                    row = []
-                    for values in rows['Data']:
-                        row.append(values.get('VarCharValue'))
-                    data.append(row)
-            else:
-                for rows in result['ResultSet']['Rows']:
-                    row = []
-                    for values in rows['Data']:
-                        row.append(values.get('VarCharValue'))
-                    data.append(row)
-            # update generator status
-            first_run = False
-            token = result.get('NextToken', None)
-            final_run = False if token else True
-            df = pd.DataFrame(data, columns=columns)
+        categorical_columns = {}
+        while True:
+            df, token = self.get_dataframe_page_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                page_size=page_size,
+                next_token=token,
+                typed=typed,
+                categorical_columns=categorical_columns
+            )
             yield df
+            if not token:
+                break
+
+    def get_dataframe_page_from_query_execution_id(self, query_execution_id, page_size=1000, next_token=None,
+                                                   typed=False, categorical_columns=None):
+        """
+        Fetches a single page of results of a finished query, typed from its column metadata if typed=True. Pages
+        larger than GET_QUERY_RESULTS_MAX_RESULTS rows are assembled from several get_query_results calls.
+        Pass the same categorical_columns dict for every page of a result to give all pages the same dtypes, see
+        apply_athena_types.
+        :return: tuple (DataFrame, next_token), next_token being None on the last page
+        """
+        with self.metrics.timer(query_execution_id, 'download'):
+            column_info, column_values, next_token = self.__get_query_results_columns(
+                query_execution_id, min(page_size, GET_QUERY_RESULTS_MAX_RESULTS), next_token)
+            rows = len(column_values[0]) if column_values else 0
+            # pages up to the API limit keep a single call, as before
+            while next_token and page_size > GET_QUERY_RESULTS_MAX_RESULTS and rows < page_size:
+                _, next_column_values, next_token = self.__get_query_results_columns(
+                    query_execution_id, min(page_size - rows, GET_QUERY_RESULTS_MAX_RESULTS), next_token)
+                for values, next_values in zip(column_values, next_column_values):
+                    values.extend(next_values)
+                rows = len(column_values[0]) if column_values else 0
+
+        with self.metrics.timer(query_execution_id, 'parse'):
+            # built by position, as result columns may share a name
+            df = pd.DataFrame(dict(enumerate(column_values)), columns=range(len(column_values)))
+            df.columns = [str(column['Name']) for column in column_info]
+            if typed:
+                apply_athena_types(df, column_info, self.categorical_threshold, categorical_columns)
+        return df, next_token
+
+    def __get_query_results_columns(self, query_execution_id, max_results, next_token):
+        if next_token:
+            result = self.athena_client.get_query_results(
+                QueryExecutionId=query_execution_id,
+                NextToken=next_token,
+                MaxResults=max_results
+            )
+        else:
+            result = self.athena_client.get_query_results(
+                QueryExecutionId=query_execution_id,
+                MaxResults=max_results
+            )
+
+        column_info = result['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        # the first page starts with the header row
+        rows = result['ResultSet']['Rows'] if next_token else result['ResultSet']['Rows'][1:]
+        column_values = [[row['Data'][index].get('VarCharValue') for row in rows] for index in range(len(column_info))]
+        return column_info, column_values, result.get('NextToken', None)
+
+    @logger
+    def get_query_column_info(self, query_execution_id):
+        """
+        :return: list of ColumnInfo dicts, with the Name and Athena Type of each result column
+        """
+        result = self.athena_client.get_query_results(QueryExecutionId=query_execution_id, MaxResults=1)
+        return result['ResultSet']['ResultSetMetadata']['ColumnInfo']
 
     @logger
     def wait_for_query_results(self, query_execution_id, check_sleep_time=2):
-        query_execution_status = self.__get_query_execution_status(query_execution_id)
+        """
+        Polls a query until it finishes, raising if it failed or was cancelled
+        :return: the QueryExecution of the finished query
+        """
         start_time = time.time()
-        while query_execution_status in ('QUEUED', 'RUNNING'):
-            time.sleep(check_sleep_time)
+        query_execution = self.__get_query_execution(query_execution_id)
+        # polls quickly at first and backs off up to check_sleep_time, so short queries return without delay
+        sleep_times = poll_intervals(maximum=check_sleep_time)
+        while query_execution['Status']['State'] in ('QUEUED', 'RUNNING'):
+            time.sleep(next(sleep_times))
 
-            if time.time() - start_time > 7200:
+            if time.time() - start_time > QUERY_TIMEOUT:
                 self.athena_client.stop_query_execution(QueryExecutionId=query_execution_id)
                 raise Exception('msg=query execution timed out')
 
-            query_execution_status = self.__get_query_execution_status(query_execution_id)
+            query_execution = self.__get_query_execution(query_execution_id)
 
-        if query_execution_status in ('FAILED', 'CANCELLED'):
-            raise Exception('status={}, time_elapsed={}, error_msg={}'.format(query_execution_status,
-                                                                              time.time() - start_time,
-                                                                              self.athena_client.get_query_execution(
-                                                                                  QueryExecutionId=query_execution_id)[
-                                                                                  'QueryExecution']['Status'][
-                                                                                  'StateChangeReason']))
+        self.metrics.record(query_execution_id, 'wait_seconds', time.time() - start_time, accumulate=True)
+        self.metrics.record_query_execution(query_execution)
+        if query_execution['Status']['State'] in ('FAILED', 'CANCELLED'):
+            raise Exception('status={}, time_elapsed={}, error_msg={}'.format(
+                query_execution['Status']['State'], time.time() - start_time,
+                query_execution['Status'].get('StateChangeReason')))
+        return query_execution
 
     @logger
-    def __get_query_execution_status(self, query_execution_id):
-        query_execution = self.athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-        return query_execution['QueryExecution']['Status']['State']
+    def wait_for_many_query_results(self, query_execution_ids, check_sleep_time=2):
+        """
+        Waits on many queries at once, polling them together through batch_get_query_execution, and yields each
+        QueryExecution as soon as it finishes, like concurrent.futures.as_completed. FAILED and CANCELLED queries are
+        yielded as well, so callers should check ['Status']['State'].
+        """
+        pending = list(query_execution_ids)
+        start_time = time.time()
+        sleep_times = poll_intervals(maximum=check_sleep_time)
+        while pending:
+            for query_execution in self.batch_get_query_executions(pending):
+                if query_execution['Status']['State'] not in ('QUEUED', 'RUNNING'):
+                    pending.remove(query_execution['QueryExecutionId'])
+                    self.metrics.record(query_execution['QueryExecutionId'], 'wait_seconds', time.time() - start_time,
+                                        accumulate=True)
+                    self.metrics.record_query_execution(query_execution)
+                    yield query_execution
+
+            if not pending:
+                break
+
+            if time.time() - start_time > QUERY_TIMEOUT:
+                for query_execution_id in pending:
+                    self.athena_client.stop_query_execution(QueryExecutionId=query_execution_id)
+                raise Exception('msg=query execution timed out, query_execution_ids={}'.format(pending))
+
+            time.sleep(next(sleep_times))
+
+    def batch_get_query_executions(self, query_execution_ids):
+        """
+        Describes any number of queries, BATCH_GET_QUERY_EXECUTION_MAX_IDS per batch_get_query_execution call. Ids
+        Athena left unprocessed for a retryable error are left out, to be asked again, while the others, such as
+        invalid ids, are returned as FAILED QueryExecutions with the error as StateChangeReason, so waiters stop
+        polling them.
+        :return: list of QueryExecution
+        """
+        query_executions = []
+        for start in range(0, len(query_execution_ids), BATCH_GET_QUERY_EXECUTION_MAX_IDS):
+            response = self.athena_client.batch_get_query_execution(
+                QueryExecutionIds=query_execution_ids[start:start + BATCH_GET_QUERY_EXECUTION_MAX_IDS]
+            )
+            query_executions.extend(response['QueryExecutions'])
+            for unprocessed in response.get('UnprocessedQueryExecutionIds', []):
+                if unprocessed.get('ErrorCode') in RETRYABLE_ERROR_CODES:
+                    continue
+                logger.warn('m=batch_get_query_executions, query_execution_id={}, code={}, msg=query execution not '
+                            'processed'.format(unprocessed['QueryExecutionId'], unprocessed.get('ErrorCode')))
+                query_executions.append({
+                    'QueryExecutionId': unprocessed['QueryExecutionId'],
+                    'Status': {
+                        'State': 'FAILED',
+                        'StateChangeReason': '{}: {}'.format(unprocessed.get('ErrorCode'),
+                                                             unprocessed.get('ErrorMessage'))
+                    }
+                })
+        return query_executions
+
+    @logger
+    def __get_query_execution(self, query_execution_id):
+        return self.athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+
+    @staticmethod
+    def __get_query_output_location(query_execution):
+        return parse_s3_url(query_execution['ResultConfiguration']['OutputLocation'])
 
     def execute_query_and_wait_for_results(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
         logger.info(
@@ -246,8 +816,42 @@ class AthenaClient(object):
 
     def create_parquet_from_query(self, key, query, row_group_offsets=500000,
                                   query_params=None, raw_columns=None, clean_columns=None,
-                                  s3_bucket=None, bucket_folder_path=None):
-        logger.info('m=create_parquet_from_query, key={}, query={}'.format(key, query))
+                                  s3_bucket=None, bucket_folder_path=None, stream=False):
+        """
+        Writes the result of query as a Parquet file at key in the client's bucket. With stream=True the result is
+        read from S3 in chunks of row_group_offsets rows, each written as a row group as soon as it is formatted, so
+        memory is bounded by the row group size instead of the table size. Every row group shares one schema: columns
+        typed int, long, float, bool, str or unicode in raw_columns, or clean_columns, get that type whatever the
+        values of the first chunk, other typed columns take the type of the first chunk, and without raw_columns every
+        column is written as strings. Each chunk is then cast to the schema.
+        """
+        logger.info('m=create_parquet_from_query, key={}, query={}, stream={}'.format(key, query, stream))
+
+        if stream:
+            query_execution_id = self.execute_raw_query(
+                sql=query.format(**query_params) if query_params else query,
+                s3_bucket=s3_bucket,
+                bucket_folder_path=bucket_folder_path
+            )
+            if raw_columns is not None:
+                # string columns are read as written, so their entries do not depend on the types guessed per chunk
+                read_dtype = dict((col, str) for col, _type in raw_columns.items() if _type in (str, unicode))
+                dtypes = dict((col, PARQUET_DTYPES[_type])
+                              for col, _type in _formatted_column_types(raw_columns, clean_columns).items()
+                              if _type in PARQUET_DTYPES)
+            else:
+                read_dtype, dtypes = str, None
+            chunks = self.get_chunked_dataframe_from_query_execution_id(query_execution_id=query_execution_id,
+                                                                        chunk_size=row_group_offsets,
+                                                                        dtype=read_dtype)
+            dfs = (format_dataframe_columns(chunk, raw_columns, clean_columns) if raw_columns is not None else chunk
+                   for chunk in chunks)
+            rows = write_parquet_row_groups(dfs, '{}/{}'.format(self.s3_bucket, key),
+                                            open_with=self.__get_s3_filesystem().open,
+                                            object_encoding='infer' if raw_columns is not None else 'bytes',
+                                            dtypes=dtypes)
+            logger.info('m=create_parquet_from_query, key={}, rows={}, msg={} ready!'.format(key, rows, key))
+            return
 
         df = self.execute_query_and_return_dataframe(
             sql=query.format(**query_params) if query_params else query,
@@ -266,50 +870,109 @@ class AthenaClient(object):
         self.create_parquet_from_df(key, df, row_group_offsets, raw_columns, clean_columns)
 
     def create_parquet_from_df(self, key, df, row_group_offsets=500000, raw_columns=None,
-                               clean_columns=None, s3_bucket=None):
-        logger.info('m=create_parquet_from_df')
+                               clean_columns=None, s3_bucket=None, partition_cols=None, database=None, table=None,
+                               max_workers=DEFAULT_MAX_CONCURRENCY, append=False, compaction_threshold=None,
+                               small_row_group_rows=DEFAULT_SMALL_ROW_GROUP_ROWS):
+        """
+        Writes df as Parquet to key. With partition_cols, key is the root of a hive style layout instead: each
+        combination of partition values is written without the partition columns to
+        key/col=value/.../part.0.parquet, files being uploaded concurrently, and if database and table are given the
+        partitions are then registered on that table in one batch, see add_partitions.
+        With append=True, key is a fastparquet dataset directory that df is appended to as new part files, see
+        append_parquet_dataset. Once compaction_threshold row groups have fewer than small_row_group_rows rows, they
+        are merged into one, see compact_parquet_dataset.
+        Rows with null partition values are written under col=__HIVE_DEFAULT_PARTITION__, as hive does, but those
+        partitions are not registered, ADD PARTITION having no null value for typed partition columns.
+        :return: with partition_cols, add_partitions results if the partitions were registered, partitions with null
+            values having status SKIPPED, otherwise the list of {'values', 'location'} partitions written
+        """
+        logger.info('m=create_parquet_from_df, partition_cols={}, append={}'.format(partition_cols, append))
+        if append and partition_cols:
+            raise ValueError('m=create_parquet_from_df, msg=append is not supported with partition_cols')
 
-        df = df.astype(object).where(pd.notnull(df), None)
         if raw_columns is None:
-            new_df = df
+            new_df = df.astype(object).where(pd.notnull(df), None)
         else:
-            new_df = pd.DataFrame()
-            for index, col_key in enumerate(raw_columns):
-                col, _type = col_key, raw_columns[col_key]
-
-                new_col = col if not clean_columns else clean_columns.keys()[index]
-                new_df[new_col] = pd.Series([self.__format_entry(_type(entry), clean_columns,
-                                                                 index) if entry is not None and entry != '' else None
-                                             for entry in df.loc[:, col]])
-
-        self.__save_df_file_into_s3_as_parquet(df=new_df, bucket=s3_bucket or self.s3_bucket, file_path=key,
-                                               row_group_offsets=row_group_offsets)
-
-    def __format_entry(self, entry, clean_columns, column_index):
-        if entry is None or clean_columns is None:
-            return entry
-
-        list_clean_columns = clean_columns.keys()
-        new_type = clean_columns[list_clean_columns[column_index]]
-        if type(new_type) != list:
-            return new_type(entry)
+            new_df = format_dataframe_columns(df, raw_columns, clean_columns)
+
+        if append:
+            s3_fs = self.__get_s3_filesystem()
+            path = '{}/{}'.format(s3_bucket or self.s3_bucket, key.rstrip('/'))
+            append_parquet_dataset(new_df.where(new_df.notnull(), None), path, open_with=s3_fs.open,
+                                   row_group_offsets=row_group_offsets)
+            if compaction_threshold:
+                compact_parquet_dataset(path, open_with=s3_fs.open, remove_with=s3_fs.rm,
+                                        small_row_group_rows=small_row_group_rows,
+                                        min_row_groups=compaction_threshold)
+            return
 
-        regex_from = clean_columns[list_clean_columns[column_index]][1]
-        regex_to = clean_columns[list_clean_columns[column_index]][2]
+        if not partition_cols:
+            self.__save_df_file_into_s3_as_parquet(df=new_df, bucket=s3_bucket or self.s3_bucket, file_path=key,
+                                                   row_group_offsets=row_group_offsets)
+            return
 
-        return new_type[0](re.sub(regex_from, regex_to, entry))
+        bucket = s3_bucket or self.s3_bucket
+        partitions = self.__save_df_partitions_into_s3_as_parquet(new_df, bucket, key.rstrip('/'), partition_cols,
+                                                                  row_group_offsets, max_workers)
+        if database is not None and table is not None:
+            return self.__add_written_partitions(database, table, partitions)
+        return partitions
+
+    def __add_written_partitions(self, database, table, partitions):
+        # ADD PARTITION cannot give typed partition columns a null value, so partitions of nulls are only written
+        nulls = [HIVE_DEFAULT_PARTITION in dict(partition['values']).values() for partition in partitions]
+        if any(nulls):
+            logger.warn('m=__add_written_partitions, table={}.{}, partitions={}, msg=partitions with null values are '
+                        'not registered'.format(database, table, sum(nulls)))
+        results = iter(self.add_partitions(database, table, [partition for partition, null in zip(partitions, nulls)
+                                                             if not null]))
+        return [{
+            'partition': partition,
+            'status': 'SKIPPED',
+            'error': 'null partition values cannot be registered'
+        } if null else next(results) for partition, null in zip(partitions, nulls)]
+
+    def __save_df_partitions_into_s3_as_parquet(self, df, bucket, root, partition_cols, row_group_offsets,
+                                                max_workers):
+        partition_cols = list(partition_cols)
+        # nulls cannot be grouped on, so rows are grouped on their partition values and the columns keep their types
+        groups = df.groupby([df[name].map(_partition_value).values for name in partition_cols], sort=False)
+
+        partitions = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for values, group in groups:
+                values = values if isinstance(values, tuple) else (values,)
+                path = '/'.join('{}={}'.format(name, quote(value, safe='')) for name, value in
+                                zip(partition_cols, values))
+                partitions.append({
+                    'values': list(zip(partition_cols, values)),
+                    'location': 's3://{}/{}/{}'.format(bucket, root, path)
+                })
+                futures.append(executor.submit(self.__save_df_file_into_s3_as_parquet,
+                                               df=group.drop(partition_cols, axis=1).reset_index(drop=True),
+                                               bucket=bucket, file_path='{}/{}/part.0.parquet'.format(root, path),
+                                               row_group_offsets=row_group_offsets))
+            # re-raises the first failed upload
+            for future in futures:
+                future.result()
+
+        logger.info('m=__save_df_partitions_into_s3_as_parquet, root={}, partitions={}'.format(root, len(partitions)))
+        return partitions
 
     def __save_df_file_into_s3_as_parquet(self, df, bucket, file_path, row_group_offsets):
         logger.info('m=__save_df_file_into_s3_as_parquet')
-        if self.aws_access_key_id is not None and self.aws_secret_access_key is not None:
-            s3_fs = s3fs.S3FileSystem(key=self.aws_access_key_id, secret=self.aws_secret_access_key)
-        else:
-            s3_fs = s3fs.S3FileSystem()
+        s3_fs = self.__get_s3_filesystem()
         fp.write('{}/{}'.format(bucket, file_path), df.where(df.notnull(), None),
                  open_with=s3_fs.open, row_group_offsets=row_group_offsets)
 
         logger.info('m=__save_df_file_into_s3_as_parquet, msg={} ready!'.format(file_path))
 
+    def __get_s3_filesystem(self):
+        return get_s3_filesystem(aws_access_key_id=self.aws_access_key_id,
+                                 aws_secret_access_key=self.aws_secret_access_key,
+                                 max_pool_connections=self.max_pool_connections)
+
     def create_athena_table_with_json_serde(self, database, table_name, schema, location, partitions=None,
                                             serde_options=None, drop_if_exists=True):
         self.__create_athena_table(database=database, table_name=table_name, schema=schema, location=location,
@@ -412,36 +1075,149 @@ class AthenaClient(object):
         )
         self.execute_raw_query(sql=sql)
 
-    def update_partitions(self, table, location):
-        # An alternative approach would be to simply use an
-        # "msck repair table fastly" statement but this is very slow at Athena.
-        # we will pay to list all S3 keys, so try to be efficient with the location choice
-        #
-        #
-        # if not location.endswith('/'):
-        #     location += '/'
-        #
-        # bucket_path = 's3://{}/'.format(self.amplitude_bucket)
-        # prefix = location[len(bucket_path):]
-        #
-        # all_keys = boto3.resource('s3').Bucket(self.amplitude_bucket).objects.filter(Prefix=prefix)
-        #
-        # objects = set([k.key for k in all_keys if k.key.endswith('.gz')])
-        #
-        # partitions = set()
-        # for o in objects:
-        #     partitions.add(o[:len(o) - o[::-1].find('/')])
-        #
-        # for p in list(partitions):
-        #     pp = re.split('/|=', p)
-        #
-        #     sql = """ALTER TABLE {} ADD IF NOT EXISTS""".format(table)
-        #     sql += """PARTITION (app = {}, event_type = '{}', server_upload_date = date '{}')""". \
-        #         format(pp[1], pp[3], pp[5])
-        #     sql += """LOCATION '{}'""".format(bucket_path + p)
-        #
-        #     logger.info('m=update_partitions, msg=Adding new partition at {}'.format(bucket_path + p))
-        #     self._execute_query(sql)
-
-        # TODO Need to figure out how to implement this one to be generic at location and partitions!
-        raise NotImplementedError
+    def add_partitions(self, database, table, partitions, max_workers=DEFAULT_PARTITION_DDL_WORKERS,
+                       max_partitions_per_statement=DEFAULT_MAX_PARTITIONS_PER_STATEMENT):
+        """
+        Registers many partitions with as few ALTER TABLE ... ADD statements as the query size limit allows, running
+        them concurrently
+        :param partitions: list of partition specs, dicts with:
+            - values: ordered dict or list of (partition_name, partition_value) tuples
+            - location: s3 location of the partition, optional
+        :return: list with one {'partition': spec, 'status': 'SUCCEEDED' or 'FAILED', 'error': message} dict per
+            partition, in the given order
+        """
+        prefix = 'ALTER TABLE {}.{} ADD IF NOT EXISTS'.format(database, table)
+        clauses = []
+        for partition in partitions:
+            clause = ' PARTITION ({})'.format(self.__partition_values_sql(partition['values']))
+            if partition.get('location'):
+                clause += " LOCATION '{}'".format(partition['location'])
+            clauses.append(clause)
+
+        logger.info('m=add_partitions, database={}, table={}, partitions={}'.format(database, table, len(partitions)))
+        errors = self.__execute_partition_statements(prefix, clauses, '', max_workers, max_partitions_per_statement)
+        return self.__partition_results(partitions, errors)
+
+    def drop_partitions(self, database, table, partitions, max_workers=DEFAULT_PARTITION_DDL_WORKERS,
+                        max_partitions_per_statement=DEFAULT_MAX_PARTITIONS_PER_STATEMENT):
+        """
+        Drops many partitions with as few ALTER TABLE ... DROP statements as the query size limit allows, running them
+        concurrently. Takes and returns the same as add_partitions, locations being ignored.
+        """
+        prefix = 'ALTER TABLE {}.{} DROP IF EXISTS'.format(database, table)
+        clauses = [' PARTITION ({})'.format(self.__partition_values_sql(partition['values']))
+                   for partition in partitions]
+
+        logger.info('m=drop_partitions, database={}, table={}, partitions={}'.format(database, table, len(partitions)))
+        errors = self.__execute_partition_statements(prefix, clauses, ',', max_workers, max_partitions_per_statement)
+        return self.__partition_results(partitions, errors)
+
+    def upsert_partitions_in_bulk(self, bucket_folder_path, database, table, partitions_list_dicts_list,
+                                  max_workers=DEFAULT_PARTITION_DDL_WORKERS,
+                                  max_partitions_per_statement=DEFAULT_MAX_PARTITIONS_PER_STATEMENT):
+        """
+        Bulk version of upsert_partitions: takes a list of its partitions_list_dicts, drops those partitions and adds
+        them back at bucket_folder_path/partition_name=partition_value/...
+        :return: same as add_partitions, a partition failing if either its drop or its add failed
+        """
+        partitions = []
+        for partitions_list_dicts in partitions_list_dicts_list:
+            values = [(partition['partition_name'], partition['partition_value']) for partition in partitions_list_dicts]
+            location = 's3://{}/{}'.format(bucket_folder_path, '/'.join('{}={}'.format(name, value)
+                                                                        for name, value in values))
+            partitions.append({'values': values, 'location': location})
+
+        drop_results = self.drop_partitions(database, table, partitions, max_workers, max_partitions_per_statement)
+        add_results = self.add_partitions(database, table, partitions, max_workers, max_partitions_per_statement)
+        for drop_result, add_result in zip(drop_results, add_results):
+            if drop_result['status'] == 'FAILED' and add_result['status'] == 'SUCCEEDED':
+                add_result.update({'status': 'FAILED', 'error': drop_result['error']})
+        return add_results
+
+    @staticmethod
+    def __partition_values_sql(values):
+        items = values.items() if isinstance(values, dict) else values
+        return ', '.join("{}='{}'".format(name, str(value).replace("'", "''")) for name, value in items)
+
+    def __execute_partition_statements(self, prefix, clauses, separator, max_workers, max_partitions_per_statement):
+        """
+        Packs clauses after prefix into statements below MAX_QUERY_STRING_BYTES and runs them concurrently
+        :return: dict of clause index -> error message, for the clauses of failed statements
+        """
+        statements = []
+        for index, clause in enumerate(clauses):
+            if (not statements or len(statements[-1][1]) >= max_partitions_per_statement or
+                    len(statements[-1][0]) + len(separator) + len(clause) > MAX_QUERY_STRING_BYTES):
+                statements.append([prefix + clause, [index]])
+            else:
+                statements[-1][0] += separator + clause
+                statements[-1][1].append(index)
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict((executor.submit(self.execute_query_and_wait_for_results, sql=sql), indexes)
+                           for sql, indexes in statements)
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    logger.warn('m=__execute_partition_statements, partitions={}, msg=statement failed, error: '
+                                '{}'.format(len(futures[future]), future.exception()))
+                    errors.update((index, str(future.exception())) for index in futures[future])
+        return errors
+
+    @staticmethod
+    def __partition_results(partitions, errors):
+        return [{
+            'partition': partition,
+            'status': 'FAILED' if index in errors else 'SUCCEEDED',
+            'error': errors.get(index)
+        } for index, partition in enumerate(partitions)]
+
+    def update_partitions(self, table, location, snapshot_path=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                          max_workers=DEFAULT_PARTITION_DDL_WORKERS):
+        """
+        Registers the partitions added to a table's location since the last call, as a much cheaper alternative to
+        msck_repair_table. The key=value prefixes under location are listed level by level, skipping the partitions of
+        the local snapshot of partitions already registered, so each run lists the parent prefixes and new partitions
+        only, and the new ones are added with batched DDL.
+        :param table: table name as database.table
+        :param location: table location, s3://bucket/path
+        :param snapshot_path: json file keeping the registered partitions, defaults to one per table in the temp dir.
+            Deleting it makes the next call register every partition again, which is harmless.
+        :param max_concurrency: maximum number of prefixes listed at the same time
+        :param max_workers: maximum number of DDL statements running at the same time
+        :return: add_partitions results for the new partitions
+        """
+        database, _, table_name = table.rpartition('.')
+        if not database:
+            raise ValueError('m=update_partitions, table={}, msg=table must be given as database.table'.format(table))
+
+        snapshot_path = snapshot_path or os.path.join(tempfile.gettempdir(),
+                                                      'athena_partitions_{}.{}.json'.format(database, table_name))
+        registered = set()
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path) as f:
+                registered = set(json.load(f))
+
+        bucket, prefix = parse_s3_url(location.rstrip('/'))
+        paths = list_partition_prefixes(self.s3_resource.meta.client, bucket, prefix, max_concurrency=max_concurrency,
+                                        known=frozenset(registered))
+        new_paths = [path for path in paths if path not in registered]
+        logger.info('m=update_partitions, table={}, location={}, partitions={}, new_partitions={}'.format(
+            table, location, len(paths), len(new_paths)))
+        if not new_paths:
+            return []
+
+        partitions = [{
+            'values': [tuple(unquote(part) for part in segment.split('=', 1)) for segment in path.split('/')],
+            'location': '{}/{}'.format(location.rstrip('/'), path)
+        } for path in new_paths]
+        results = self.add_partitions(database, table_name, partitions, max_workers=max_workers)
+
+        registered.update(path for path, result in zip(new_paths, results) if result['status'] == 'SUCCEEDED')
+        # written to a temporary file first, so an interrupted run never leaves a truncated snapshot
+        temp_path = '{}.tmp'.format(snapshot_path)
+        with open(temp_path, 'w') as f:
+            json.dump(sorted(registered), f)
+        os.rename(temp_path, snapshot_path)
+
+        return results
@@ -0,0 +1,133 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.async_watcher import AsyncWatcher
+from qa_python_utils.aws.athena import QUERY_TIMEOUT
+
+logger = QuintoAndarLogger('aws.athena_async')
+
+
+def _copy_future(target, source):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _then(future, callback):
+    """
+    Chains callback, which receives the result of future and returns another future
+    :return: future resolved with the result of the future returned by callback
+    """
+    chained = Future()
+    chained.set_running_or_notify_cancel()
+
+    def on_done(done):
+        if done.exception() is not None:
+            chained.set_exception(done.exception())
+            return
+        try:
+            next_future = callback(done.result())
+        except Exception as e:
+            chained.set_exception(e)
+            return
+        next_future.add_done_callback(partial(_copy_future, chained))
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+class AsyncAthenaClient(AsyncWatcher):
+    """
+    Non-blocking counterpart of AthenaClient: every method returns a concurrent.futures.Future right away. Query
+    submission and result fetching run on a small I/O pool, while all queries in flight are waited on by a single
+    watcher thread polling them together through batch_get_query_execution, so no thread is held per query. Queries
+    still running after their timeout are stopped and their futures fail, as with AthenaClient.wait_for_query_results.
+
+    asyncio code can await any of these futures through asyncio.wrap_future.
+    """
+
+    @logger(exclude=['athena_client'])
+    def __init__(self, athena_client, max_workers=8, check_sleep_time=2, timeout=QUERY_TIMEOUT):
+        """
+        :param timeout: default seconds to wait for a query before it is stopped and its future fails
+        """
+        self.athena_client = athena_client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        super(AsyncAthenaClient, self).__init__(check_sleep_time, timeout=timeout, name='athena-async-watcher')
+
+    def start_query(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        :return: future resolved with the QueryExecutionId
+        """
+        return self._executor.submit(
+            self.athena_client.execute_raw_query,
+            sql=sql,
+            query_params=query_params,
+            s3_bucket=s3_bucket,
+            bucket_folder_path=bucket_folder_path
+        )
+
+    def wait_for_query_results(self, query_execution_id, timeout=None):
+        """
+        :param timeout: seconds to wait before the query is stopped and the future fails, the client timeout if None
+        :return: future resolved with the QueryExecution once the query succeeds, or failed if it does not
+        """
+        return self._wait(query_execution_id, timeout)
+
+    def get_dataframe(self, query_execution_id, file_ext='csv'):
+        """
+        :return: future resolved with the full result DataFrame once the query succeeds
+        """
+        return _then(self.wait_for_query_results(query_execution_id), lambda _: self._executor.submit(
+            self.athena_client.get_dataframe_from_query_execution_id,
+            query_execution_id=query_execution_id,
+            file_ext=file_ext
+        ))
+
+    def get_dataframe_page(self, query_execution_id, page_size=1000, next_token=None):
+        """
+        :return: future resolved with a (DataFrame, next_token) tuple, next_token being None on the last page
+        """
+        return _then(self.wait_for_query_results(query_execution_id), lambda _: self._executor.submit(
+            self.athena_client.get_dataframe_page_from_query_execution_id,
+            query_execution_id=query_execution_id,
+            page_size=page_size,
+            next_token=next_token
+        ))
+
+    def execute_query_and_return_dataframe(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        :return: future resolved with the result DataFrame
+        """
+        return _then(self.start_query(sql, query_params, s3_bucket, bucket_folder_path), self.get_dataframe)
+
+    def close(self, timeout=None):
+        super(AsyncAthenaClient, self).close(timeout)
+        self._executor.shutdown(wait=True)
+
+    def _poll(self, query_execution_ids):
+        query_executions = self.athena_client.batch_get_query_executions(query_execution_ids)
+        return dict((query_execution['QueryExecutionId'], query_execution) for query_execution in query_executions)
+
+    def _outcome(self, query_execution_id, query_execution):
+        status = query_execution['Status']
+        if status['State'] in ('QUEUED', 'RUNNING'):
+            return None
+        try:
+            self.athena_client.metrics.record_query_execution(query_execution)
+        except Exception as e:
+            # metrics must never keep waiters from being resolved
+            logger.error('m=_outcome, query_execution_id={}, msg=failed to record metrics. Error: {}'.format(
+                query_execution_id, e))
+        if status['State'] == 'SUCCEEDED':
+            return query_execution, None
+        return None, Exception('status={}, error_msg={}'.format(status['State'], status.get('StateChangeReason')))
+
+    def _timeout_error(self, query_execution_id):
+        # the same as AthenaClient.wait_for_query_results
+        return Exception('msg=query execution timed out')
+
+    def _on_timeout(self, query_execution_id):
+        self.athena_client.athena_client.stop_query_execution(QueryExecutionId=query_execution_id)
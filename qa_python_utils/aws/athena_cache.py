@@ -0,0 +1,120 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.athena_cache')
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_MEMORY_BYTES = 512 * 1024 * 1024
+
+# quoted literals and identifiers are kept as they are, runs of whitespace and comments become a single space
+SQL_TOKENS_REGEX = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(?:\s+|--[^\n]*|/\*.*?\*/)+""", re.DOTALL)
+
+
+def normalize_sql(sql):
+    """
+    Normalizes a query so that formatting differences do not change its cache key: comments outside of quotes are
+    removed, whitespace is collapsed and trailing semicolons are dropped
+    """
+    def replace(match):
+        return match.group(1) if match.group(1) is not None else ' '
+
+    return SQL_TOKENS_REGEX.sub(replace, sql).strip().rstrip(';').strip()
+
+
+class AthenaResultCache(object):
+    """
+    Result cache for AthenaClient, keyed by normalized SQL, query params and output location. It has two levels:
+        - the QueryExecutionId of each query, reused while younger than ttl seconds, so a hit reads the result Athena
+            already wrote to S3 instead of running the query again.
+        - an LRU of parsed DataFrames bounded by max_memory_bytes, so a hit does not even touch S3. Copies are
+            returned, so callers are free to modify them. A key may hold one DataFrame per variant, such as raw and
+            typed reads of the same result.
+    """
+
+    @logger
+    def __init__(self, ttl=DEFAULT_TTL, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES):
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self._lock = threading.Lock()
+        self._query_execution_ids = {}
+        self._dataframes = OrderedDict()
+        self._memory_bytes = 0
+
+    @staticmethod
+    def make_key(sql, query_params, output_location):
+        return hashlib.sha256(json.dumps([normalize_sql(sql), query_params or {}, output_location], sort_keys=True,
+                                         default=str)).hexdigest()
+
+    def get_query_execution_id(self, key):
+        with self._lock:
+            return self.__get_query_execution_id(key)
+
+    def put_query_execution_id(self, key, query_execution_id):
+        with self._lock:
+            self._query_execution_ids[key] = (query_execution_id, time.time())
+
+    def get_dataframe(self, key, variant=None):
+        with self._lock:
+            query_execution_id = self.__get_query_execution_id(key)
+            if query_execution_id is None or (key, variant) not in self._dataframes:
+                return None
+
+            cached_query_execution_id, df, size = self._dataframes.pop((key, variant))
+            # a dataframe is only valid while the execution it was read from is the cached one
+            if cached_query_execution_id != query_execution_id:
+                self._memory_bytes -= size
+                return None
+
+            self._dataframes[(key, variant)] = (cached_query_execution_id, df, size)
+            return df.copy()
+
+    def put_dataframe(self, key, query_execution_id, df, variant=None):
+        size = df.memory_usage(index=True, deep=True).sum()
+        if size > self.max_memory_bytes:
+            logger.info('m=put_dataframe, size={}, msg=dataframe exceeds the memory budget, not cached'.format(size))
+            return
+
+        with self._lock:
+            if (key, variant) in self._dataframes:
+                self._memory_bytes -= self._dataframes.pop((key, variant))[2]
+
+            self._dataframes[(key, variant)] = (query_execution_id, df.copy(), size)
+            self._memory_bytes += size
+
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, _, evicted_size) = self._dataframes.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def invalidate(self, key=None):
+        """
+        Forgets the given key, or every key if none is given
+        """
+        with self._lock:
+            if key is not None:
+                self.__invalidate(key)
+            else:
+                self._query_execution_ids.clear()
+                self._dataframes.clear()
+                self._memory_bytes = 0
+
+    def __get_query_execution_id(self, key):
+        if key not in self._query_execution_ids:
+            return None
+
+        query_execution_id, created_at = self._query_execution_ids[key]
+        if time.time() - created_at > self.ttl:
+            self.__invalidate(key)
+            return None
+
+        return query_execution_id
+
+    def __invalidate(self, key):
+        self._query_execution_ids.pop(key, None)
+        for dataframe_key in [dataframe_key for dataframe_key in self._dataframes if dataframe_key[0] == key]:
+            self._memory_bytes -= self._dataframes.pop(dataframe_key)[2]
@@ -0,0 +1,108 @@
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.athena_executor')
+
+DEFAULT_MAX_RUNNING_QUERIES = 20
+DEFAULT_MAX_DOWNLOAD_WORKERS = 4
+
+
+class AthenaQueryExecutor(object):
+    """
+    Runs many independent queries through an AthenaClient, keeping at most max_running_queries submitted to Athena at
+    a time. A query frees its slot as soon as Athena finishes it, and its result is downloaded and parsed on a separate
+    pool, overlapping with the queries still running.
+
+    Usage:
+        with AthenaQueryExecutor(athena_client, max_running_queries=20) as executor:
+            for sql, df in executor.map(queries):
+                pass
+    """
+
+    @logger(exclude=['athena_client'])
+    def __init__(self, athena_client, max_running_queries=DEFAULT_MAX_RUNNING_QUERIES,
+                 max_download_workers=DEFAULT_MAX_DOWNLOAD_WORKERS):
+        self.athena_client = athena_client
+        self._query_executor = ThreadPoolExecutor(max_workers=max_running_queries)
+        self._download_executor = ThreadPoolExecutor(max_workers=max_download_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+
+    def submit(self, sql, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        Queues a query
+        :return: concurrent.futures.Future resolved with the result DataFrame
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        query_future = self._query_executor.submit(
+            self.athena_client.execute_query_and_wait_for_results,
+            sql=sql,
+            query_params=query_params,
+            s3_bucket=s3_bucket,
+            bucket_folder_path=bucket_folder_path
+        )
+        query_future.add_done_callback(partial(self.__download_result, future))
+        return future
+
+    def submit_file(self, filename, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        # rendered through the client's cached templates, values inlined
+        sql, _ = self.athena_client.query_registry.load_file(filename).render(query_params)
+        return self.submit(
+            sql=sql,
+            s3_bucket=s3_bucket,
+            bucket_folder_path=bucket_folder_path
+        )
+
+    def map(self, queries, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        Runs all queries and yields (sql, DataFrame) tuples in completion order, re-raising the first failure
+        """
+        futures = dict((self.submit(sql, query_params, s3_bucket, bucket_folder_path), sql) for sql in queries)
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def map_files(self, filenames, query_params=None, s3_bucket=None, bucket_folder_path=None):
+        """
+        Runs all query files and yields (filename, DataFrame) tuples in completion order, re-raising the first failure
+        """
+        futures = dict((self.submit_file(filename, query_params, s3_bucket, bucket_folder_path), filename)
+                       for filename in filenames)
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def shutdown(self, wait=True):
+        """
+        Stops both pools. With wait=False, queries still running fail with RuntimeError instead of being downloaded.
+        """
+        self._query_executor.shutdown(wait=wait)
+        self._download_executor.shutdown(wait=wait)
+
+    def __download_result(self, future, query_future):
+        if query_future.exception() is not None:
+            future.set_exception(query_future.exception())
+            return
+
+        try:
+            download_future = self._download_executor.submit(
+                self.athena_client.get_dataframe_from_query_execution_id,
+                query_execution_id=query_future.result()
+            )
+        except RuntimeError as e:
+            # the download pool was shut down with wait=False while the query ran
+            future.set_exception(e)
+            return
+        download_future.add_done_callback(partial(self.__set_result, future))
+
+    @staticmethod
+    def __set_result(future, download_future):
+        if download_future.exception() is not None:
+            future.set_exception(download_future.exception())
+        else:
+            future.set_result(download_future.result())
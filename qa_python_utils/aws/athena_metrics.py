@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.athena_metrics')
+
+DEFAULT_MAX_QUERIES = 1000
+# on demand Athena pricing, billed per query with a 10MB minimum
+PRICE_PER_TB_SCANNED = 5.0
+MIN_BYTES_SCANNED = 10 * 1024 * 1024
+
+# Statistics of a QueryExecution and the names they are recorded under
+ATHENA_STATISTICS = OrderedDict([
+    ('QueryQueueTimeInMillis', 'queue_ms'),
+    ('QueryPlanningTimeInMillis', 'planning_ms'),
+    ('EngineExecutionTimeInMillis', 'engine_ms'),
+    ('ServiceProcessingTimeInMillis', 'service_processing_ms'),
+    ('TotalExecutionTimeInMillis', 'total_execution_ms'),
+    ('DataScannedInBytes', 'data_scanned_bytes')
+])
+# phases timed on our side, in seconds
+PHASES = ('submit', 'wait', 'download', 'parse')
+
+
+def estimate_cost(data_scanned_bytes):
+    """
+    :return: estimated cost in USD of a query that scanned data_scanned_bytes
+    """
+    return max(data_scanned_bytes, MIN_BYTES_SCANNED) / float(1024 ** 4) * PRICE_PER_TB_SCANNED
+
+
+class QueryMetrics(object):
+    """
+    Collects performance and cost metrics of the queries run by an AthenaClient:
+        - the Statistics Athena reports for each query, such as queue, planning and engine time and data scanned
+        - the size of each result read from S3
+        - the time spent on our side submitting, waiting, downloading and parsing, accumulated per query
+    Every measurement is also passed to the hooks, callables taking (query_execution_id, metric, value), so metrics can
+    be forwarded to statsd, CloudWatch or any other backend. Only the latest max_queries queries are kept, while totals
+    cover every query seen.
+
+    Usage:
+        metrics = QueryMetrics(hooks=[lambda query_execution_id, metric, value: statsd.gauge(metric, value)])
+        athena_client = AthenaClient(s3_bucket='bucket', metrics=metrics)
+        ...
+        print(metrics.summary())
+    """
+
+    @logger(exclude=['hooks'])
+    def __init__(self, hooks=None, max_queries=DEFAULT_MAX_QUERIES):
+        self.hooks = list(hooks or [])
+        self.max_queries = max_queries
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self._totals = {}
+        self._query_count = 0
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, query_execution_id, metric, value, accumulate=False):
+        """
+        Records a metric of a query, adding it to the previous value if accumulate is True
+        """
+        with self._lock:
+            metrics = self.__get_query(query_execution_id)
+            previous = metrics.get(metric, 0)
+            metrics[metric] = previous + value if accumulate else value
+            self._totals[metric] = self._totals.get(metric, 0) + metrics[metric] - previous
+
+        for hook in self.hooks:
+            try:
+                hook(query_execution_id, metric, value)
+            except Exception as e:
+                logger.warn('m=record, metric={}, msg=metrics hook failed, error: {}'.format(metric, e))
+
+    def record_query_execution(self, query_execution):
+        """
+        Records the state and Statistics of a QueryExecution, as returned by get_query_execution, once per query
+        """
+        query_execution_id = query_execution['QueryExecutionId']
+        with self._lock:
+            if 'state' in self.__get_query(query_execution_id):
+                return
+            self._queries[query_execution_id]['state'] = query_execution['Status']['State']
+            self._queries[query_execution_id]['query'] = query_execution.get('Query')
+
+        statistics = query_execution.get('Statistics', {})
+        for statistic, metric in ATHENA_STATISTICS.items():
+            if statistic in statistics:
+                self.record(query_execution_id, metric, statistics[statistic])
+        if 'DataScannedInBytes' in statistics:
+            self.record(query_execution_id, 'cost_usd', estimate_cost(statistics['DataScannedInBytes']))
+
+    @contextmanager
+    def timer(self, query_execution_id, phase):
+        """
+        Times the block as phase of the query, accumulating with previous timings of the same phase
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record(query_execution_id, '{}_seconds'.format(phase), time.time() - start_time, accumulate=True)
+
+    def get(self, query_execution_id):
+        """
+        :return: copy of the metrics recorded for the query, or None if it is not kept
+        """
+        with self._lock:
+            metrics = self._queries.get(query_execution_id)
+            return dict(metrics) if metrics is not None else None
+
+    def summary(self, top=5):
+        """
+        :return: dict with the number of queries, the totals of every metric and the top slowest and most expensive
+            kept queries, each as (query_execution_id, metrics)
+        """
+        with self._lock:
+            queries = [(query_execution_id, dict(metrics)) for query_execution_id, metrics in self._queries.items()]
+            totals = dict(self._totals)
+            query_count = self._query_count
+
+        def elapsed(item):
+            metrics = item[1]
+            return (metrics.get('total_execution_ms', 0) / 1000.0 +
+                    sum(metrics.get('{}_seconds'.format(phase), 0) for phase in PHASES if phase != 'wait'))
+
+        return {
+            'queries': query_count,
+            'totals': totals,
+            'slowest': sorted(queries, key=elapsed, reverse=True)[:top],
+            'most_expensive': sorted(queries, key=lambda item: item[1].get('data_scanned_bytes', 0), reverse=True)[:top]
+        }
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+            self._totals.clear()
+            self._query_count = 0
+
+    def __get_query(self, query_execution_id):
+        if query_execution_id not in self._queries:
+            self._query_count += 1
+            self._queries[query_execution_id] = {}
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+        return self._queries[query_execution_id]
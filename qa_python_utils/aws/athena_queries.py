@@ -0,0 +1,151 @@
+import numbers
+import os
+import re
+import threading
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.athena_queries')
+
+DEFAULT_EXTENSION = '.sql'
+
+# {:name} is a bound value and {name}, with the conversion, format spec and attribute or index access of str.format,
+# a formatted one. {{ and }} are matched only to be kept, so that they never take part in a field.
+TEMPLATE_FIELD_REGEX = re.compile(r'\{\{|\}\}|\{(?::(?P<bound>[A-Za-z_][A-Za-z0-9_]*)|'
+                                  r'(?P<name>[A-Za-z_][A-Za-z0-9_]*)(?P<access>(?:\.[A-Za-z_][A-Za-z0-9_]*|\[[^\[\]{}]*\])*)'
+                                  r'(?P<conversion>![rsa])?(?::(?P<spec>[^{}]*))?)\}')
+
+
+def sql_literal(value):
+    """
+    :return: value as an Athena SQL literal, strings being quoted
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, numbers.Number):
+        return repr(value) if isinstance(value, float) else str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def supports_execution_parameters(athena_client):
+    """
+    Tells whether the installed botocore knows the ExecutionParameters of StartQueryExecution
+    :param athena_client: boto3 athena client
+    """
+    operation_model = athena_client.meta.service_model.operation_model('StartQueryExecution')
+    return 'ExecutionParameters' in operation_model.input_shape.members
+
+
+class QueryTemplate(object):
+    """
+    SQL template with two kinds of parameters:
+        - {name} is formatted into the query text as with str.format, {dt:%Y-%m-%d}, {table!s} or {user.name}
+            included, but only when name is one of the query parameters
+        - {:name} is a value, sent as an Athena execution parameter when bound, or inlined as a SQL literal
+    Everything else is sent as written, so json literals, regexes such as a{2,3} and {name} fields of names that are
+    not parameters need no escaping.
+    """
+
+    def __init__(self, sql, name=None):
+        self.sql = sql
+        self.name = name
+        matches = list(TEMPLATE_FIELD_REGEX.finditer(sql))
+        self.bound_params = frozenset(match.group('bound') for match in matches if match.group('bound'))
+        # names of the fields formatted when given
+        self.params = self.bound_params.union(match.group('name') for match in matches if match.group('name'))
+
+    def render(self, query_params=None, bind=False):
+        """
+        :param query_params: dict of parameter values, every {:name} of the template being required
+        :param bind: if True, {:name} parameters become ? placeholders and their literals are returned apart
+        :return: tuple (sql, execution_parameters), execution_parameters being None unless bind is True
+        :raise ValueError: if bound parameters are missing
+        """
+        query_params = query_params or {}
+        missing = self.bound_params.difference(query_params)
+        if missing:
+            raise ValueError('m=render, query={}, missing_params={}, msg=query parameters missing'.format(
+                self.name, sorted(missing)))
+
+        execution_parameters = []
+
+        def replace(match):
+            if match.group('bound'):
+                value = sql_literal(query_params[match.group('bound')])
+                if bind:
+                    execution_parameters.append(value)
+                    return '?'
+                return value
+            if match.group('name') in query_params:
+                field = '{0' + (match.group('access') or '') + (match.group('conversion') or '') + (
+                    ':' + match.group('spec') if match.group('spec') is not None else '') + '}'
+                return field.format(query_params[match.group('name')])
+            return match.group(0)
+
+        sql = TEMPLATE_FIELD_REGEX.sub(replace, self.sql) if query_params or self.bound_params else self.sql
+        return sql, execution_parameters if bind else None
+
+
+class QueryRegistry(object):
+    """
+    Named SQL templates loaded from a directory, a query being named after its file without extension, such as
+    daily/users for directory/daily/users.sql. Files are read once and cached, and read again only when their mtime
+    changes. Any other file can be loaded through the same cache with load_file.
+
+    Usage:
+        queries = QueryRegistry('queries/')
+        sql, execution_parameters = queries.render('daily/users', {'table': 'users', 'date': '2019-01-01'})
+    """
+
+    @logger
+    def __init__(self, directory=None, extension=DEFAULT_EXTENSION):
+        self.directory = directory
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._templates = {}
+
+    def names(self):
+        """
+        :return: sorted names of the templates in the directory
+        """
+        names = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(self.extension):
+                    path = os.path.relpath(os.path.join(root, filename), self.directory)
+                    names.append(path[:-len(self.extension)].replace(os.sep, '/'))
+        return sorted(names)
+
+    def get(self, name):
+        """
+        :return: QueryTemplate of a named query
+        :raise IOError: if there is no such query
+        """
+        if self.directory is None:
+            raise ValueError('m=get, name={}, msg=the registry has no directory'.format(name))
+        return self.load_file(os.path.join(self.directory, *(name + self.extension).split('/')), name=name)
+
+    def load_file(self, path, name=None):
+        """
+        :return: QueryTemplate of the file at path, read only if it changed since it was cached
+        """
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            cached = self._templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path) as f:
+            template = QueryTemplate(f.read(), name=name or path)
+        logger.info('m=load_file, path={}, params={}, msg=template loaded'.format(path, sorted(template.params)))
+        with self._lock:
+            self._templates[path] = (mtime, template)
+        return template
+
+    def render(self, name, query_params=None, bind=False):
+        """
+        Renders a named query, see QueryTemplate.render
+        """
+        return self.get(name).render(query_params, bind=bind)
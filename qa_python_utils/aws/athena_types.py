@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.athena_types')
+
+DEFAULT_CATEGORICAL_THRESHOLD = 0.5
+
+INTEGER_TYPES = {
+    'tinyint': np.int8,
+    'smallint': np.int16,
+    'integer': np.int32,
+    'int': np.int32,
+    'bigint': np.int64
+}
+FLOAT_TYPES = {
+    'real': np.float32,
+    'float': np.float64,
+    'double': np.float64,
+    'decimal': np.float64
+}
+DATETIME_TYPES = ('date', 'timestamp')
+STRING_TYPES = ('varchar', 'char', 'string')
+
+# nullable integer arrays only exist from pandas 0.24 on, older versions fall back to float64 when there are nulls
+HAS_INTEGER_ARRAY = hasattr(getattr(pd, 'arrays', None), 'IntegerArray')
+
+
+def apply_athena_types(df, column_info, categorical_threshold=DEFAULT_CATEGORICAL_THRESHOLD, categorical_columns=None):
+    """
+    Converts the string columns read from an Athena result into compact pandas dtypes, based on the ColumnInfo of the
+    query's ResultSetMetadata:
+        - tinyint, smallint, integer and bigint become nullable Int8, Int16, Int32 and Int64, or on pandas older than
+            0.24 int8 to int64 without nulls and float64 with them
+        - real becomes float32, float, double and decimal become float64
+        - boolean becomes bool, or object when there are nulls
+        - date and timestamp become datetime64
+        - varchar and char become categorical when the ratio of distinct values to rows is at most
+            categorical_threshold
+    Other types, such as arrays, maps and timestamps with time zone, are left as strings, as are columns with values
+    that cannot be converted. Both None and empty strings are taken as nulls for non string types.
+    When a result is converted in chunks, pass the same categorical_columns dict to every call: whether a string column
+    becomes categorical is decided on the first chunk and reused, so every chunk has the same dtypes.
+    :param df: dataframe with string columns, as read from the result file or from get_query_results
+    :param column_info: list of ColumnInfo dicts
+    :param categorical_threshold: maximum ratio of distinct values for a string column to become categorical
+    :param categorical_columns: dict of column index in column_info to whether it is categorical, filled on first use
+    :return: the same dataframe, converted in place
+    """
+    names = df.columns
+    if [column['Name'] for column in column_info] == list(names):
+        # matched by position, as result columns may share a name
+        positions = range(len(names))
+    else:
+        positions = [names.get_loc(column['Name']) if column['Name'] in names else None for column in column_info]
+
+    if categorical_columns is None:
+        categorical_columns = {}
+
+    df.columns = range(len(names))
+    try:
+        for index, (position, column) in enumerate(zip(positions, column_info)):
+            if not isinstance(position, int):
+                continue
+
+            athena_type = column['Type'].lower()
+            if _base_type(athena_type) in STRING_TYPES and index not in categorical_columns:
+                values = df[position]
+                categorical_columns[index] = len(values) > 0 and values.nunique() <= categorical_threshold * len(values)
+            try:
+                df[position] = _convert_column(df[position], athena_type, categorical_columns.get(index, False))
+            except (ValueError, TypeError, OverflowError) as e:
+                logger.warn('m=apply_athena_types, column={}, type={}, msg=column kept as string, error: {}'.format(
+                    column['Name'], athena_type, e))
+    finally:
+        df.columns = names
+
+    return df
+
+
+def _base_type(athena_type):
+    return athena_type.split('(')[0].strip()
+
+
+def _convert_column(values, athena_type, categorical):
+    base_type = _base_type(athena_type)
+    if base_type in STRING_TYPES:
+        return values.astype('category') if categorical else values
+
+    nulls = (values.isnull() | (values == '')).values
+    if base_type in INTEGER_TYPES:
+        integers = np.zeros(len(values), dtype=INTEGER_TYPES[base_type])
+        integers[~nulls] = values.values[~nulls].astype(np.int64)
+        if HAS_INTEGER_ARRAY:
+            return pd.Series(pd.arrays.IntegerArray(integers, nulls), index=values.index)
+        if nulls.any():
+            return pd.Series(integers, index=values.index).where(~nulls, np.nan)
+        return pd.Series(integers, index=values.index)
+
+    if base_type in FLOAT_TYPES:
+        return values.where(~nulls, np.nan).astype(FLOAT_TYPES[base_type])
+
+    if base_type == 'boolean':
+        booleans = values.str.lower().map({'true': True, 'false': False})
+        return booleans.astype(bool) if not nulls.any() else booleans.where(~nulls, None)
+
+    if base_type in DATETIME_TYPES:
+        # unparseable values raise, keeping the column as string, rather than becoming NaT
+        return pd.to_datetime(values.where(~nulls, None), errors='raise')
+
+    return values
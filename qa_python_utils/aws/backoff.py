@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# throttling and server side error codes of AWS APIs
+RETRYABLE_ERROR_CODES = frozenset([
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'Throttling',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'InternalServerException',
+    'InternalFailure',
+    'ServiceUnavailable'
+])
+# connection failures and timeouts, raised without a response, which botocore itself retries unless told not to
+CONNECTION_ERRORS = (ConnectionError, HTTPClientError)
+# what manual retry loops catch, is_retryable_error telling which of them are worth another attempt
+RETRY_LOOP_ERRORS = (ClientError,) + CONNECTION_ERRORS
+
+
+def poll_intervals(initial=0.2, maximum=2, factor=1.5, jitter=0.2):
+    """
+    Endless generator of sleep times for polling loops: starts at initial and grows by factor up to maximum, so short
+    operations are noticed quickly while long ones are not polled more than every maximum seconds. Each value is
+    randomized by +-jitter so that many pollers started together do not stay in lockstep.
+    :param initial: first interval in seconds
+    :param maximum: interval cap in seconds
+    :param factor: growth factor between consecutive intervals
+    :param jitter: maximum relative deviation applied to each interval
+    """
+    interval = min(initial, maximum)
+    while True:
+        yield interval * random.uniform(1 - jitter, 1 + jitter)
+        interval = min(interval * factor, maximum)
+
+
+def retry_delay(attempt, base=1, maximum=60):
+    """
+    Sleep time before retrying after the given failed attempt, growing exponentially from base up to maximum. Half of
+    it is random, so that clients throttled together spread their retries instead of hitting the service again at the
+    same time.
+    :param attempt: number of attempts failed so far, starting at 1
+    :param base: delay in seconds after the first failure, before jitter
+    :param maximum: delay cap in seconds
+    """
+    delay = min(base * 2 ** (attempt - 1), maximum)
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+def is_retryable_error(error):
+    """
+    Tells throttling, server side and connection errors, worth retrying, from errors retries cannot fix such as invalid
+    queries or missing permissions
+    :param error: botocore ClientError or one of CONNECTION_ERRORS
+    """
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    response = getattr(error, 'response', {})
+    return (response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES or
+            response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket: tokens are added at rate per second up to capacity, and acquire blocks until enough are
+    available. Sharing one bucket between every thread of a process keeps the whole process under an API rate quota,
+    capacity allowing short bursts above it.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, sleeping until they are available
+        :return: seconds spent waiting
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def error_code(error):
+    """
+    :return: the AWS error code of a ClientError, or the class name of errors without a response
+    """
+    # timeouts carry the response attribute of requests exceptions, which is None
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') or type(error).__name__
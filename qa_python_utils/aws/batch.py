@@ -1,14 +1,64 @@
 import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
 
-import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.backoff import RETRY_LOOP_ERRORS, error_code, is_retryable_error, poll_intervals, retry_delay
+from qa_python_utils.aws.clients import get_client
 
 reload(sys)
 sys.setdefaultencoding('utf8')
 
 logger = QuintoAndarLogger('aws.batch')
 
+DEFAULT_SNAPSHOT_TTL = 10
+LIST_JOBS_MAX_RESULTS = 1000
+DESCRIBE_JOBS_MAX_IDS = 100
+DEFAULT_MAX_CACHED_JOBS = 10000
+# jobs in these statuses never change again, so their descriptions can be cached
+TERMINAL_STATUSES = ('SUCCEEDED', 'FAILED')
+DEFAULT_SUBMIT_WORKERS = 8
+SUBMIT_JOB_MAX_ATTEMPTS = 5
+# jobs take minutes, so waiters start polling every second and slow down to DEFAULT_CHECK_SLEEP_TIME
+DEFAULT_CHECK_SLEEP_TIME = 30
+WAIT_INITIAL_SLEEP_TIME = 1
+# describe_jobs leaves unknown and expired ids out, so ids missing from this many polls in a row are not found
+NOT_FOUND_POLLS = 3
+NOT_FOUND_STATUS = 'NOT_FOUND'
+
+
+class JobQueueSnapshot(object):
+    """
+    Every job of a queue in the listed statuses at created_at, indexed by status and job name
+    """
+
+    def __init__(self, job_queue, statuses, job_summaries, created_at=None):
+        self.job_queue = job_queue
+        self.statuses = tuple(statuses)
+        self.created_at = created_at if created_at is not None else time.time()
+        self._index = defaultdict(lambda: defaultdict(list))
+        for status, job_summary in job_summaries:
+            self._index[status][job_summary['jobName']].append(job_summary)
+
+    def get_jobs(self, job_name=None, status=None):
+        """
+        :return: job summaries, of one name and one status if given
+        """
+        statuses = [status] if status is not None else self.statuses
+        jobs = []
+        for listed_status in statuses:
+            for name, job_summaries in self._index.get(listed_status, {}).items():
+                if job_name is None or name == job_name:
+                    jobs.extend(job_summaries)
+        return jobs
+
+    def count(self, job_name, status='RUNNING'):
+        return len(self._index.get(status, {}).get(job_name, []))
+
 
 class BatchClient(object):
     """
@@ -16,19 +66,80 @@ class BatchClient(object):
     """
 
     @logger
-    def __init__(self):
-        self._batch_client = boto3.client('batch')
+    def __init__(self, snapshot_ttl=DEFAULT_SNAPSHOT_TTL, max_cached_jobs=DEFAULT_MAX_CACHED_JOBS):
+        self._batch_client = get_client('batch')
+        # submits are retried by __submit_job, so botocore must not retry each attempt again underneath
+        self._submit_client = get_client('batch', config=Config(retries={'max_attempts': 0}))
+        # queue listings are reused for snapshot_ttl seconds, so bursts of submits share them
+        self.snapshot_ttl = snapshot_ttl
+        self._snapshots = {}
+        self._snapshots_lock = threading.Lock()
+        # one listing per queue and statuses at a time, concurrent callers wait for it instead of listing again
+        self._snapshot_locks = defaultdict(threading.Lock)
+        self.max_cached_jobs = max_cached_jobs
+        self._terminal_jobs = OrderedDict()
+        self._terminal_jobs_lock = threading.Lock()
 
     @logger
-    def get_running_jobs_list(self, job_name, job_queue):
-        all_running_jobs = self._batch_client.list_jobs(
-            jobQueue=job_queue,
-            jobStatus='RUNNING',
-            maxResults=1000
-        )
+    def get_queue_snapshot(self, job_queue, statuses=('RUNNING',), refresh=False):
+        """
+        Lists every job of a queue in the given statuses, following nextToken, and indexes them. Snapshots are cached
+        for snapshot_ttl seconds unless refresh is True, and concurrent callers share a single listing. Jobs changing
+        status in the meantime, including those this client submits, are only seen once the snapshot expires.
+        :return: JobQueueSnapshot
+        """
+        key = (job_queue, tuple(statuses))
+        requested_at = time.time()
+        with self._snapshots_lock:
+            snapshot = self._snapshots.get(key)
+            key_lock = self._snapshot_locks[key]
+        if not refresh and snapshot is not None and requested_at - snapshot.created_at <= self.snapshot_ttl:
+            return snapshot
+
+        with key_lock:
+            # another caller may have listed the queue while this one waited
+            with self._snapshots_lock:
+                snapshot = self._snapshots.get(key)
+            if snapshot is not None and (snapshot.created_at >= requested_at or (
+                    not refresh and time.time() - snapshot.created_at <= self.snapshot_ttl)):
+                return snapshot
+
+            # the listing start is the snapshot time, so refreshes requested during it list again
+            listed_at = time.time()
+            job_summaries = []
+            for status in statuses:
+                kwargs = {'jobQueue': job_queue, 'jobStatus': status, 'maxResults': LIST_JOBS_MAX_RESULTS}
+                while True:
+                    response = self._batch_client.list_jobs(**kwargs)
+                    job_summaries.extend((status, job_summary) for job_summary in response['jobSummaryList'])
+                    if not response.get('nextToken'):
+                        break
+                    kwargs['nextToken'] = response['nextToken']
+
+            snapshot = JobQueueSnapshot(job_queue, statuses, job_summaries, created_at=listed_at)
+            logger.info('m=get_queue_snapshot, job_queue={}, statuses={}, jobs={}'.format(
+                job_queue, statuses, len(job_summaries)))
+            with self._snapshots_lock:
+                self._snapshots[key] = snapshot
+        return snapshot
+
+    def invalidate_queue_snapshots(self, job_queue=None):
+        """
+        Forgets the cached snapshots of a queue, or of every queue if none is given. Listings in progress are waited
+        for, so they cannot store a snapshot taken before the invalidation.
+        """
+        with self._snapshots_lock:
+            keys = [key for key in self._snapshot_locks if job_queue is None or key[0] == job_queue]
+            key_locks = [(key, self._snapshot_locks[key]) for key in keys]
+        for key, key_lock in key_locks:
+            with key_lock:
+                with self._snapshots_lock:
+                    self._snapshots.pop(key, None)
 
-        return [job_summary['jobName'] for job_summary in all_running_jobs['jobSummaryList'] if
-                job_summary['jobName'] == job_name]
+    @logger
+    def get_running_jobs_list(self, job_name, job_queue):
+        return [job_summary['jobName'] for job_summary in
+                self.get_queue_snapshot(job_queue).get_jobs(job_name=job_name, status='RUNNING')]
 
     @logger
     def __compare_running_instances(self, job_name, job_queue, comparison_value):
@@ -54,19 +165,13 @@ class BatchClient(object):
 
     @logger
     def has_job_exceeded_max_running(self, job_name, job_queue, max_running_jobs):
-        comparison_result = self.__compare_running_instances(
-            job_name=job_name,
-            job_queue=job_queue,
-            comparison_value=max_running_jobs
-        )
-
         running_jobs = self.get_running_jobs_list(
             job_name=job_name,
             job_queue=job_queue
         )
 
         logger.info('m=has_job_exceeded_max_running, running_jobs={}'.format(len(running_jobs)))
-        return comparison_result
+        return len(running_jobs) >= max_running_jobs
 
     @logger
     def start_batch_job(self, job_name, job_queue, job_definition, command=None, vcpus=4, memory=4096,
@@ -86,19 +191,14 @@ class BatchClient(object):
             return
 
         try:
-            r = self._batch_client.submit_job(
-                jobName=job_name,
-                jobQueue=job_queue,
-                jobDefinition=job_definition,
-                containerOverrides={
-                    'vcpus': vcpus,
-                    'memory': memory,
-                    'command': command
-                },
-                retryStrategy={
-                    'attempts': 1
-                }
-            )
+            r = self._batch_client.submit_job(**self.__submit_job_kwargs(
+                job_name=job_name,
+                job_queue=job_queue,
+                job_definition=job_definition,
+                command=command,
+                vcpus=vcpus,
+                memory=memory
+            ))
 
             r.update({
                 'status': 'SUBMITTED'
@@ -113,21 +213,249 @@ class BatchClient(object):
                     job_name, job_queue, job_definition, command))
             raise e
 
+    @staticmethod
+    def __submit_job_kwargs(job_name, job_queue, job_definition, command, vcpus=4, memory=4096, array_size=None,
+                            depends_on=None):
+        kwargs = {
+            'jobName': job_name,
+            'jobQueue': job_queue,
+            'jobDefinition': job_definition,
+            'containerOverrides': {
+                'vcpus': vcpus,
+                'memory': memory,
+                'command': command
+            },
+            'retryStrategy': {
+                'attempts': 1
+            }
+        }
+        if array_size is not None:
+            kwargs['arrayProperties'] = {'size': array_size}
+        if depends_on:
+            kwargs['dependsOn'] = depends_on
+        return kwargs
+
+    @logger
+    def submit_array_job(self, job_name, job_queue, job_definition, size, command, vcpus=4, memory=4096,
+                         depends_on=None, sequential=False):
+        """
+        Submits size copies of a job as a single array job, each child telling its shard apart through the
+        AWS_BATCH_JOB_ARRAY_INDEX environment variable. One call fans out to up to 10000 children.
+        :param depends_on: job ids the whole array waits for
+        :param sequential: if True, each child waits for the previous one
+        :return: submit_job response of the parent job
+        """
+        dependencies = [{'jobId': job_id} for job_id in depends_on or []]
+        if sequential:
+            dependencies.append({'type': 'SEQUENTIAL'})
+
+        response = self.__submit_job(self.__submit_job_kwargs(
+            job_name=job_name,
+            job_queue=job_queue,
+            job_definition=job_definition,
+            command=command,
+            vcpus=vcpus,
+            memory=memory,
+            array_size=size,
+            depends_on=dependencies
+        ))
+        response['status'] = 'SUBMITTED'
+        return response
+
+    @logger(exclude=['jobs'])
+    def submit_jobs(self, jobs, max_workers=DEFAULT_SUBMIT_WORKERS):
+        """
+        Submits many jobs concurrently, without the running jobs check of start_batch_job. Throttled calls are
+        retried with backoff.
+        :param jobs: list of dicts with the arguments of a job:
+            - job_name, job_queue, job_definition and command, required
+            - vcpus and memory, as in start_batch_job
+            - array_size, to submit the job as an array job of that many children
+            - depends_on, list of job ids or of positions of earlier jobs of this list, so chains of jobs are
+              submitted in a single call. A job is submitted once the jobs it depends on are.
+        :param max_workers: maximum number of submit_job calls in flight
+        :return: list with a dict per job, in the order of jobs, with job, jobId, status SUBMITTED or FAILED, and error
+        :raise ValueError: if a job depends on its own position or a later one
+        """
+        for index, job in enumerate(jobs):
+            for dependency in job.get('depends_on') or []:
+                if isinstance(dependency, int) and not 0 <= dependency < index:
+                    raise ValueError('m=submit_jobs, job={}, depends_on={}, msg=jobs can only depend on earlier '
+                                     'jobs'.format(index, dependency))
+
+        job_ids = {}
+        errors = {}
+        pending = list(range(len(jobs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending:
+                # jobs whose dependencies are all submitted, or failed, are submitted together
+                ready = [index for index in pending if all(
+                    dependency in job_ids or dependency in errors
+                    for dependency in jobs[index].get('depends_on') or [] if isinstance(dependency, int))]
+                pending = [index for index in pending if index not in ready]
+
+                futures = {}
+                for index in ready:
+                    job = jobs[index]
+                    failed_dependencies = [dependency for dependency in job.get('depends_on') or []
+                                           if isinstance(dependency, int) and dependency in errors]
+                    if failed_dependencies:
+                        errors[index] = 'dependencies {} were not submitted'.format(failed_dependencies)
+                        continue
+                    depends_on = [{'jobId': job_ids[dependency] if isinstance(dependency, int) else dependency}
+                                  for dependency in job.get('depends_on') or []]
+                    kwargs = self.__submit_job_kwargs(
+                        job_name=job['job_name'],
+                        job_queue=job['job_queue'],
+                        job_definition=job['job_definition'],
+                        command=job['command'],
+                        vcpus=job.get('vcpus', 4),
+                        memory=job.get('memory', 4096),
+                        array_size=job.get('array_size'),
+                        depends_on=depends_on
+                    )
+                    futures[executor.submit(self.__submit_job, kwargs)] = index
+
+                for future in as_completed(futures):
+                    index = futures[future]
+                    if future.exception() is not None:
+                        logger.warn('m=submit_jobs, job_name={}, msg=job not submitted, error: {}'.format(
+                            jobs[index]['job_name'], future.exception()))
+                        errors[index] = str(future.exception())
+                    else:
+                        job_ids[index] = future.result()['jobId']
+
+        logger.info('m=submit_jobs, jobs={}, submitted={}, failed={}'.format(len(jobs), len(job_ids), len(errors)))
+        return [{
+            'job': jobs[position],
+            'jobId': job_ids.get(position),
+            'status': 'FAILED' if position in errors else 'SUBMITTED',
+            'error': errors.get(position)
+        } for position in range(len(jobs))]
+
+    def __submit_job(self, kwargs):
+        for attempt in range(1, SUBMIT_JOB_MAX_ATTEMPTS + 1):
+            try:
+                return self._submit_client.submit_job(**kwargs)
+            except RETRY_LOOP_ERRORS as e:
+                if not is_retryable_error(e) or attempt == SUBMIT_JOB_MAX_ATTEMPTS:
+                    raise
+                delay = retry_delay(attempt)
+                logger.warn('m=__submit_job, job_name={}, attempt={}, code={}, msg=submit failed, it will be retried '
+                            'in {:.1f} seconds'.format(kwargs['jobName'], attempt, error_code(e), delay))
+                time.sleep(delay)
+
+    @logger
+    def describe_jobs_by_ids(self, job_ids, use_cache=True):
+        """
+        Describes many jobs in describe_jobs calls of up to DESCRIBE_JOBS_MAX_IDS ids. Jobs in TERMINAL_STATUSES are
+        cached and, unless use_cache is False, not described again.
+        :return: dict of job id to job description, jobs not found being left out
+        """
+        job_ids = list(OrderedDict.fromkeys(job_id for job_id in job_ids if job_id is not None))
+        jobs = {}
+        if use_cache:
+            with self._terminal_jobs_lock:
+                for job_id in job_ids:
+                    if job_id in self._terminal_jobs:
+                        jobs[job_id] = self._terminal_jobs[job_id]
+
+        missing_ids = [job_id for job_id in job_ids if job_id not in jobs]
+        for start in range(0, len(missing_ids), DESCRIBE_JOBS_MAX_IDS):
+            response = self._batch_client.describe_jobs(jobs=missing_ids[start:start + DESCRIBE_JOBS_MAX_IDS])
+            for job in response['jobs']:
+                jobs[job['jobId']] = job
+                if job.get('status') in TERMINAL_STATUSES:
+                    self.__cache_terminal_job(job)
+
+        logger.info('m=describe_jobs_by_ids, jobs={}, described={}, found={}'.format(
+            len(job_ids), len(missing_ids), len(jobs)))
+        return jobs
+
+    @logger
+    def get_jobs_fields_by_ids(self, job_ids, field_names, use_cache=True):
+        """
+        :param field_names: fields of the job description, such as status, createdAt, startedAt and stoppedAt
+        :return: dict of job id to dict of field name to value, None for fields the job does not have yet
+        """
+        return {
+            job_id: {field_name: job.get(field_name) for field_name in field_names}
+            for job_id, job in self.describe_jobs_by_ids(job_ids, use_cache=use_cache).items()
+        }
+
+    @logger
+    def wait_for_many_jobs(self, job_ids, check_sleep_time=DEFAULT_CHECK_SLEEP_TIME, timeout=None):
+        """
+        Waits on many jobs at once, describing all pending ones together on each poll, and yields each job description
+        as soon as the job reaches SUCCEEDED or FAILED, like concurrent.futures.as_completed. Finished jobs are no longer
+        polled, and polls slow down from WAIT_INITIAL_SLEEP_TIME up to check_sleep_time seconds, so thousands of jobs
+        cost a few describe_jobs calls per poll. FAILED jobs are yielded as well, so callers should check ['status'].
+        Ids missing from NOT_FOUND_POLLS describes in a row, such as unknown or expired jobs, are yielded as
+        {'jobId': job_id, 'status': NOT_FOUND_STATUS}.
+        :param timeout: seconds to wait before giving up, forever if None
+        :raise RuntimeError: if jobs are still pending after timeout
+        """
+        pending = list(OrderedDict.fromkeys(job_ids))
+        misses = dict((job_id, 0) for job_id in pending)
+        start_time = time.time()
+        sleep_times = poll_intervals(initial=WAIT_INITIAL_SLEEP_TIME, maximum=check_sleep_time)
+        while pending:
+            jobs = self.describe_jobs_by_ids(pending)
+            for job_id in list(pending):
+                job = jobs.get(job_id)
+                misses[job_id] = misses[job_id] + 1 if job is None else 0
+                if misses[job_id] >= NOT_FOUND_POLLS:
+                    logger.warn('m=wait_for_many_jobs, job_id={}, msg=job not found'.format(job_id))
+                    pending.remove(job_id)
+                    yield {'jobId': job_id, 'status': NOT_FOUND_STATUS}
+                elif job is not None and job['status'] in TERMINAL_STATUSES:
+                    pending.remove(job_id)
+                    yield job
+
+            if not pending:
+                break
+
+            if timeout is not None and time.time() - start_time > timeout:
+                raise RuntimeError('m=wait_for_many_jobs, job_ids={}, msg=jobs timed out'.format(pending))
+
+            logger.info('m=wait_for_many_jobs, pending={}'.format(len(pending)))
+            time.sleep(next(sleep_times))
+
+    @logger
+    def wait_for_jobs(self, job_ids, check_sleep_time=DEFAULT_CHECK_SLEEP_TIME, timeout=None):
+        """
+        :return: dict of job id to job description once every job reached SUCCEEDED or FAILED, or was not found, see
+            wait_for_many_jobs
+        """
+        return {job['jobId']: job for job in self.wait_for_many_jobs(job_ids, check_sleep_time, timeout)}
+
+    def __cache_terminal_job(self, job):
+        with self._terminal_jobs_lock:
+            self._terminal_jobs.pop(job['jobId'], None)
+            self._terminal_jobs[job['jobId']] = job
+            while len(self._terminal_jobs) > self.max_cached_jobs:
+                self._terminal_jobs.popitem(last=False)
+
     @logger
     def get_job_info_by_id(self, job_id):
         if job_id is None:
             logger.error('m=get_job_info_by_id, job_id=None')
             return None
 
-        job_description = self._batch_client.describe_jobs(
-            jobs=[job_id]
-        )
+        job_info = self.describe_jobs_by_ids([job_id]).get(job_id)
 
-        if len(job_description['jobs']) == 0:
+        if job_info is None:
             logger.error('m=get_job_info_by_id, job_id={}, msg=job not found'.format(job_id))
             return None
 
-        return job_description['jobs'][0]
+        return job_info
+
+    @logger
+    def get_job_fields_by_id(self, job_id, field_names):
+        """
+        :return: dict of field name to value from a single description of the job, or None if it is not found
+        """
+        return self.get_jobs_fields_by_ids([job_id], field_names).get(job_id)
 
     @logger
     def get_job_field_info_by_id(self, field_name, job_id):
@@ -0,0 +1,55 @@
+from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.async_watcher import AsyncWatcher
+from qa_python_utils.aws.batch import DEFAULT_CHECK_SLEEP_TIME, NOT_FOUND_POLLS, TERMINAL_STATUSES, \
+    WAIT_INITIAL_SLEEP_TIME
+
+logger = QuintoAndarLogger('aws.batch_async')
+
+
+class AsyncBatchClient(AsyncWatcher):
+    """
+    Non-blocking job waits for a BatchClient, for callers that submit jobs and must not hold a thread per job until
+    it ends. wait_for_job returns a future resolved with the job description, and every job waited on is described
+    together through describe_jobs_by_ids, which serves finished jobs from its cache. Jobs describe_jobs stops knowing
+    about fail after NOT_FOUND_POLLS polls in a row, and jobs still running after their timeout fail too.
+    """
+
+    @logger(exclude=['batch_client'])
+    def __init__(self, batch_client, check_sleep_time=DEFAULT_CHECK_SLEEP_TIME, timeout=None):
+        """
+        :param timeout: default seconds to wait for a job before its future fails, forever if None
+        """
+        self.batch_client = batch_client
+        super(AsyncBatchClient, self).__init__(check_sleep_time, initial_sleep_time=WAIT_INITIAL_SLEEP_TIME,
+                                               timeout=timeout, not_found_polls=NOT_FOUND_POLLS,
+                                               name='batch-async-watcher')
+
+    def wait_for_job(self, job_id, timeout=None):
+        """
+        :param timeout: seconds to wait before the future fails, the client timeout if None
+        :return: future resolved with the job description once the job succeeds, or failed if it fails, is not found
+            or times out
+        """
+        return self._wait(job_id, timeout)
+
+    def wait_for_jobs(self, job_ids, timeout=None):
+        """
+        :return: list of futures, one per job, see wait_for_job
+        """
+        return [self.wait_for_job(job_id, timeout) for job_id in job_ids]
+
+    def _poll(self, job_ids):
+        return self.batch_client.describe_jobs_by_ids(job_ids)
+
+    def _outcome(self, job_id, job):
+        if job['status'] not in TERMINAL_STATUSES:
+            return None
+        if job['status'] == 'SUCCEEDED':
+            return job, None
+        return None, Exception('status={}, status_reason={}'.format(job['status'], job.get('statusReason')))
+
+    def _timeout_error(self, job_id):
+        return Exception('job_id={}, msg=job timed out'.format(job_id))
+
+    def _not_found_error(self, job_id):
+        return Exception('job_id={}, msg=job not found'.format(job_id))
@@ -0,0 +1,132 @@
+import inspect
+import os
+import threading
+
+import boto3
+import s3fs
+from botocore.config import Config
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.clients')
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+# boto3 sessions are not thread safe, so sessions, clients, resources and filesystems are all created under this lock.
+# Once created, clients and filesystems are safe to share between threads, while resources are not and are never
+# pooled.
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_filesystems = {}
+
+
+def _freeze(value):
+    """
+    :return: hashable equivalent of a client option, options without one being told apart by identity
+    """
+    if isinstance(value, Config):
+        return Config, _freeze(value._user_provided_options)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return id(value)
+
+
+def _session_key(aws_access_key_id, aws_secret_access_key, aws_session_token, region_name):
+    # connections do not survive a fork, so every process gets its own pool
+    return os.getpid(), aws_access_key_id, aws_secret_access_key, aws_session_token, region_name
+
+
+def _get_session(key):
+    if key not in _sessions:
+        _, aws_access_key_id, aws_secret_access_key, aws_session_token, region_name = key
+        logger.info('m=_get_session, region_name={}, msg=creating session'.format(region_name))
+        _sessions[key] = boto3.Session(aws_access_key_id=aws_access_key_id,
+                                       aws_secret_access_key=aws_secret_access_key,
+                                       aws_session_token=aws_session_token, region_name=region_name)
+    return _sessions[key]
+
+
+def get_session(aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None):
+    """
+    :return: the process wide boto3 Session for the given credentials and region, credentials being resolved once
+    """
+    with _lock:
+        return _get_session(_session_key(aws_access_key_id, aws_secret_access_key, aws_session_token, region_name))
+
+
+def get_client(service_name, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None,
+               region_name=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, **client_kwargs):
+    """
+    Returns the process wide boto3 client of a service for the given credentials, region and options, so its
+    connections stay warm across the objects and jobs using it
+    :param max_pool_connections: maximum number of connections the client keeps open, at least the number of threads
+        sharing it
+    :param client_kwargs: other arguments of boto3 client, such as endpoint_url. A config is merged over the pool
+        options, its own max_pool_connections taking precedence.
+    """
+    session_key = _session_key(aws_access_key_id, aws_secret_access_key, aws_session_token, region_name)
+    key = (service_name, session_key, max_pool_connections, _freeze(client_kwargs))
+    with _lock:
+        if key not in _clients:
+            logger.info('m=get_client, service_name={}, region_name={}, max_pool_connections={}, msg=creating '
+                        'client'.format(service_name, region_name, max_pool_connections))
+            client_kwargs = dict(client_kwargs)
+            config = Config(max_pool_connections=max_pool_connections)
+            if client_kwargs.get('config') is not None:
+                config = config.merge(client_kwargs['config'])
+            client_kwargs['config'] = config
+            _clients[key] = _get_session(session_key).client(service_name, **client_kwargs)
+        return _clients[key]
+
+
+def get_resource(service_name, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None,
+                 region_name=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    Returns a new boto3 resource of a service, backed by the pooled client of get_client. Resource objects are not
+    thread safe, so each caller gets its own, while their connections are shared.
+    """
+    client = get_client(service_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                        aws_session_token=aws_session_token, region_name=region_name,
+                        max_pool_connections=max_pool_connections)
+    session_key = _session_key(aws_access_key_id, aws_secret_access_key, aws_session_token, region_name)
+    with _lock:
+        resource = _get_session(session_key).resource(service_name,
+                                                      config=Config(max_pool_connections=max_pool_connections))
+    resource.meta.client = client
+    return resource
+
+
+def get_s3_filesystem(aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None,
+                      max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    Returns the process wide s3fs.S3FileSystem for the given credentials and region. max_pool_connections is only
+    applied by s3fs versions taking config_kwargs.
+    """
+    key = (_session_key(aws_access_key_id, aws_secret_access_key, aws_session_token, region_name),
+           max_pool_connections)
+    with _lock:
+        if key not in _filesystems:
+            kwargs = {'key': aws_access_key_id, 'secret': aws_secret_access_key, 'token': aws_session_token}
+            if region_name is not None:
+                kwargs['client_kwargs'] = {'region_name': region_name}
+            if 'config_kwargs' in inspect.getargspec(s3fs.S3FileSystem.__init__).args:
+                kwargs['config_kwargs'] = {'max_pool_connections': max_pool_connections}
+            _filesystems[key] = s3fs.S3FileSystem(**kwargs)
+        return _filesystems[key]
+
+
+def clear_pool():
+    """
+    Forgets every pooled session, client and filesystem, mostly for tests
+    """
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
+        _filesystems.clear()
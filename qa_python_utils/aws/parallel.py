@@ -0,0 +1,61 @@
+import multiprocessing
+from collections import deque
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.parallel')
+
+# tells an initializer of None apart from no initializer, as reduce does
+NO_INITIALIZER = object()
+
+
+def map_reduce(iterable, map_function, reduce_function, initializer=NO_INITIALIZER, processes=None,
+               max_in_flight=None, pool=None):
+    """
+    Applies map_function to every item of iterable on a process pool and folds the results with reduce_function, as
+    reduce(reduce_function, map(map_function, iterable), initializer) would, but using every core. At most
+    max_in_flight items are queued or being mapped at a time, so a large iterable, such as the chunks of a query
+    result, is never held in memory at once. Results are reduced in the order of iterable, on the calling process.
+    :param map_function: picklable function, defined at module level, taking one item
+    :param reduce_function: function taking the accumulated value and one mapped result
+    :param processes: size of the pool created when none is given, defaults to the number of cores
+    :param max_in_flight: maximum number of items sent to the pool and not reduced yet, defaults to twice the pool size
+    :param pool: multiprocessing.Pool to use, left open, instead of creating one
+    :return: the reduced value
+    :raise TypeError: if iterable is empty and there is no initializer
+    """
+    own_pool = pool is None
+    processes = processes or multiprocessing.cpu_count()
+    max_in_flight = max_in_flight or 2 * processes
+    if own_pool:
+        pool = multiprocessing.Pool(processes)
+
+    accumulated = initializer
+    pending = deque()
+    items = 0
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(map_function, (item,)))
+            items += 1
+            if len(pending) >= max_in_flight:
+                accumulated = _reduce(reduce_function, accumulated, pending.popleft().get())
+        while pending:
+            accumulated = _reduce(reduce_function, accumulated, pending.popleft().get())
+    except BaseException:
+        if own_pool:
+            pool.terminate()
+            own_pool = False
+        raise
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    logger.info('m=map_reduce, items={}, max_in_flight={}'.format(items, max_in_flight))
+    if accumulated is NO_INITIALIZER:
+        raise TypeError('m=map_reduce, msg=empty iterable with no initializer')
+    return accumulated
+
+
+def _reduce(reduce_function, accumulated, result):
+    return result if accumulated is NO_INITIALIZER else reduce_function(accumulated, result)
@@ -0,0 +1,211 @@
+import posixpath
+import struct
+from itertools import chain
+
+import fastparquet as fp
+import numpy as np
+import pandas as pd
+from fastparquet import parquet_thrift
+from fastparquet.thrift_structures import write_thrift
+from fastparquet.writer import MARKER, find_max_part, make_metadata, make_part_file, make_row_group, \
+    write_common_metadata
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.parquet')
+
+DEFAULT_SMALL_ROW_GROUP_ROWS = 100000
+
+INTEGER_TYPES = {parquet_thrift.Type.INT32: np.int32, parquet_thrift.Type.INT64: np.int64}
+FLOAT_TYPES = {parquet_thrift.Type.FLOAT: np.float32, parquet_thrift.Type.DOUBLE: np.float64}
+TIMESTAMP_CONVERTED_TYPES = (parquet_thrift.ConvertedType.TIMESTAMP_MILLIS,
+                             parquet_thrift.ConvertedType.TIMESTAMP_MICROS)
+STRING_CONVERTED_TYPES = (None, parquet_thrift.ConvertedType.UTF8)
+# object encodings of the string types of dtypes, str columns being inferred as bytes by fastparquet
+STRING_ENCODINGS = {str: 'bytes', type(u''): 'utf8'}
+
+
+def _string_value(value, utf8):
+    if value is None or value != value:
+        return None
+    if not isinstance(value, (bytes, type(u''))):
+        value = u'{}'.format(value)
+    if utf8:
+        return value.decode('utf8') if isinstance(value, bytes) else value
+    return value.encode('utf8') if not isinstance(value, bytes) else value
+
+
+def _conform_column(column, element):
+    """
+    Casts column so fastparquet can write it with the type of element, the schema of the same column in a file.
+    Nulls are kept: fastparquet drops them before converting the values, so an integer column with nulls is kept as
+    float, its other values being integral.
+    :raise ValueError: if the values cannot be converted
+    """
+    if element.type == parquet_thrift.Type.INT96 or element.converted_type in TIMESTAMP_CONVERTED_TYPES:
+        return column if column.dtype.kind == 'M' else pd.to_datetime(column, errors='raise')
+
+    if element.type == parquet_thrift.Type.BYTE_ARRAY and element.converted_type in STRING_CONVERTED_TYPES:
+        utf8 = element.converted_type == parquet_thrift.ConvertedType.UTF8
+        return column.astype(object).map(lambda value: _string_value(value, utf8))
+
+    if element.type == parquet_thrift.Type.BOOLEAN:
+        if column.dtype.kind != 'b' and not column.dropna().isin([True, False]).all():
+            raise ValueError('values are not booleans')
+        return column
+
+    if element.type in INTEGER_TYPES and element.converted_type is None:
+        column = column if column.dtype.kind in 'biuf' else pd.to_numeric(column, errors='raise')
+        if not (column.dropna() % 1 == 0).all():
+            raise ValueError('values are not integers')
+        return column.astype(np.float64 if column.isnull().any() else INTEGER_TYPES[element.type])
+
+    if element.type in FLOAT_TYPES:
+        column = column if column.dtype.kind in 'biuf' else pd.to_numeric(column, errors='raise')
+        return column.astype(FLOAT_TYPES[element.type])
+
+    return column
+
+
+def _conform_to_schema(df, schema, path):
+    """
+    :return: df with the columns of schema, in its order, each cast to its type, see _conform_column
+    :raise ValueError: if the columns differ or a column cannot be converted
+    """
+    names = [element.name for element in schema[1:]]
+    if sorted(names) != sorted(df.columns):
+        raise ValueError('m=_conform_to_schema, path={}, msg=columns do not match the schema, schema={}, '
+                         'new={}'.format(path, names, list(df.columns)))
+
+    columns = []
+    for element in schema[1:]:
+        try:
+            columns.append(_conform_column(df[element.name], element))
+        except (TypeError, ValueError) as e:
+            raise ValueError('m=_conform_to_schema, path={}, column={}, dtype={}, msg=column does not match the '
+                             'schema type, error: {}'.format(path, element.name, df[element.name].dtype, e))
+    return pd.concat(columns, axis=1)
+
+
+def _schema_prototype(df, dtypes, object_encoding):
+    """
+    :return: tuple (dataframe, object encodings) from which make_metadata builds the schema of df with the types of
+        dtypes, whatever the values of df, such as a column that is entirely null
+    """
+    prototype = df.copy()
+    object_encodings = dict((column, object_encoding) for column in df.columns)
+    for column, dtype in dtypes.items():
+        if dtype in STRING_ENCODINGS:
+            object_encodings[column] = STRING_ENCODINGS[dtype]
+        else:
+            prototype[column] = np.zeros(len(df), dtype=dtype)
+    return prototype, object_encodings
+
+
+def write_parquet_row_groups(dfs, path, open_with, compression=None, object_encoding='infer', dtypes=None):
+    """
+    Writes an iterable of dataframes into a single Parquet file, one row group per dataframe, as they are produced.
+    Only one dataframe is held in memory at a time. The schema comes from dtypes, and from the first dataframe for
+    the other columns, and every column is nullable. Each dataframe is cast to the schema before it is written, as
+    each chunk of a result may come with different dtypes, such as an integer column with nulls read as float.
+    :param dfs: iterable of dataframes with the same columns
+    :param path: destination path
+    :param open_with: function that opens path for writing, such as s3fs.S3FileSystem().open
+    :param compression: compression passed to fastparquet
+    :param object_encoding: object column encoding passed to fastparquet
+    :param dtypes: optional dict of column -> numpy dtype, or str or unicode for strings, fixing the type of the
+        column
+    :return: number of rows written, the file is not created if there are none
+    :raise ValueError: if a dataframe cannot be cast to the schema
+    """
+    dfs = (df for df in dfs if len(df) > 0)
+    first_df = next(dfs, None)
+    if first_df is None:
+        logger.info('m=write_parquet_row_groups, path={}, msg=no rows to write'.format(path))
+        return 0
+
+    prototype, object_encodings = _schema_prototype(first_df, dtypes or {}, object_encoding)
+    fmd = make_metadata(prototype, has_nulls=True, object_encoding=object_encodings)
+    with open_with(path, 'wb') as f:
+        f.write(MARKER)
+        for df in chain([first_df], dfs):
+            df = _conform_to_schema(df, fmd.schema, path)
+            fmd.row_groups.append(make_row_group(f, df, fmd.schema, compression=compression))
+            logger.info('m=write_parquet_row_groups, path={}, row_group={}, rows={}'.format(
+                path, len(fmd.row_groups), len(df)))
+
+        fmd.num_rows = sum(row_group.num_rows for row_group in fmd.row_groups)
+        foot_size = write_thrift(f, fmd)
+        f.write(struct.pack(b'<i', foot_size))
+        f.write(MARKER)
+
+    return fmd.num_rows
+
+
+def append_parquet_dataset(df, path, open_with, row_group_offsets=500000, compression=None, object_encoding='infer'):
+    """
+    Appends df to the hive style Parquet dataset at path, a directory of part.N.parquet files described by a _metadata
+    file, creating the dataset if there is none. Only the new rows are written, in new part files, and _metadata is
+    rewritten to include them. fastparquet writes appended rows with the existing schema without checking it, so the
+    columns of df are first cast to the dataset types, such as an integer column with nulls, read as float, to the
+    integer type of the dataset.
+    :param df: dataframe to append, its index is not written
+    :param path: dataset directory
+    :param open_with: function that opens path for reading and writing, such as s3fs.S3FileSystem().open
+    :return: number of row groups in the dataset
+    :raise ValueError: if the columns of df differ from the dataset, or cannot be converted to its types
+    """
+    df = df.reset_index(drop=True)
+    try:
+        pf = fp.ParquetFile(path, open_with=open_with)
+    except (IOError, OSError):
+        pf = None
+
+    if pf is not None:
+        df = _conform_to_schema(df, pf.fmd.schema, path)
+
+    fp.write(path, df, row_group_offsets=row_group_offsets, compression=compression, file_scheme='hive',
+             open_with=open_with, mkdirs=lambda directory: None, write_index=False, object_encoding=object_encoding,
+             append=pf is not None)
+    row_groups = len(fp.ParquetFile(path, open_with=open_with).row_groups)
+    logger.info('m=append_parquet_dataset, path={}, rows={}, row_groups={}, created={}'.format(
+        path, len(df), row_groups, pf is None))
+    return row_groups
+
+
+def compact_parquet_dataset(path, open_with, remove_with, small_row_group_rows=DEFAULT_SMALL_ROW_GROUP_ROWS,
+                            min_row_groups=2, compression=None):
+    """
+    Merges the row groups of a hive style dataset that have fewer than small_row_group_rows rows into a single new part
+    file, rewrites _metadata, and then removes the part files left unreferenced. Readers listing the directory may see
+    the merged rows twice until the old files are removed.
+    :param remove_with: function that removes a path, such as s3fs.S3FileSystem().rm
+    :param min_row_groups: minimum number of small row groups for the dataset to be compacted
+    :return: number of row groups merged
+    """
+    pf = fp.ParquetFile(path, open_with=open_with)
+    small = [row_group for row_group in pf.row_groups if row_group.num_rows < small_row_group_rows]
+    if len(small) < max(min_row_groups, 2):
+        return 0
+
+    df = pd.concat([pf.read_row_group_file(row_group, pf.columns, {}) for row_group in small], ignore_index=True)
+    fmd = pf.fmd
+    part = 'part.{}.parquet'.format(find_max_part(fmd.row_groups))
+    row_group = make_part_file(open_with(posixpath.join(path, part), 'wb'), df, fmd.schema,
+                               compression=compression, fmd=fmd)
+    for chunk in row_group.columns:
+        chunk.file_path = part
+
+    old_files = set(chunk.file_path for small_row_group in small for chunk in small_row_group.columns)
+    small_ids = set(id(small_row_group) for small_row_group in small)
+    fmd.row_groups = [rg for rg in fmd.row_groups if id(rg) not in small_ids] + [row_group]
+    fmd.num_rows = sum(rg.num_rows for rg in fmd.row_groups)
+    write_common_metadata(posixpath.join(path, '_metadata'), fmd, open_with, no_row_groups=False)
+    write_common_metadata(posixpath.join(path, '_common_metadata'), fmd, open_with)
+
+    referenced = set(chunk.file_path for rg in fmd.row_groups for chunk in rg.columns)
+    for file_path in old_files - referenced:
+        remove_with(posixpath.join(path, file_path))
+
+    logger.info('m=compact_parquet_dataset, path={}, merged_row_groups={}, rows={}'.format(path, len(small), len(df)))
+    return len(small)
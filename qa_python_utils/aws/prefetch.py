@@ -0,0 +1,53 @@
+import threading
+from Queue import Full, Queue
+
+PAGE = 'page'
+ERROR = 'error'
+END = 'end'
+
+
+def prefetch(iterable, depth=1):
+    """
+    Iterates over iterable on a background thread, keeping up to depth items ready ahead of the consumer, so that
+    producing the next items (e.g. network calls) overlaps with processing the current one. Errors raised by the
+    iterable are re-raised to the consumer, and closing the returned generator stops the background thread.
+    :param iterable: iterable to prefetch
+    :param depth: maximum number of items fetched ahead
+    :return: generator over the items of iterable
+    """
+    items = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(items, (PAGE, item), stop):
+                    return
+            _put(items, (END, None), stop)
+        except Exception as e:
+            _put(items, (ERROR, e), stop)
+
+    thread = threading.Thread(target=produce, name='prefetch')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == END:
+                return
+            if kind == ERROR:
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _put(items, item, stop):
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
@@ -0,0 +1,203 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.s3')
+
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 10
+WRITE_BUFFER_SIZE = 1024 * 1024
+DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+def parse_s3_url(url):
+    """
+    Splits an s3://bucket/key url into its bucket and key
+    :param url: s3 url
+    :return: tuple (bucket, key)
+    """
+    if not url.startswith('s3://'):
+        raise ValueError('m=parse_s3_url, url={}, msg=not an s3 url'.format(url))
+
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only file-like object over an S3 object. The object is fetched lazily with ranged GETs of range_size bytes,
+    so only one range is held in memory at a time and nothing touches the local disk.
+    """
+
+    def __init__(self, s3_client, bucket, key, range_size=DEFAULT_RANGE_SIZE):
+        io.RawIOBase.__init__(self)
+        self._s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.range_size = range_size
+        self._size = None
+        self._position = 0
+        self._buffer = b''
+        self._buffer_start = 0
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._s3_client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+        return self._size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._position >= self.size:
+            return 0
+
+        offset = self._position - self._buffer_start
+        if offset >= len(self._buffer):
+            self.__fetch_range(self._position)
+            offset = 0
+
+        data = self._buffer[offset:offset + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def __fetch_range(self, start):
+        end = min(start + self.range_size, self.size) - 1
+        response = self._s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range='bytes={}-{}'.format(start, end)
+        )
+        self._buffer = response['Body'].read()
+        self._buffer_start = start
+
+
+def open_s3_object(s3_client, bucket, key, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Opens an S3 object as a buffered, read-only stream that can be handed to readers such as pd.read_csv
+    :param s3_client: boto3 s3 client
+    :param bucket: object bucket
+    :param key: object key
+    :param range_size: size in bytes of each ranged GET
+    :return: io.BufferedReader over the object
+    """
+    logger.info('m=open_s3_object, bucket={}, key={}, range_size={}'.format(bucket, key, range_size))
+    return io.BufferedReader(S3RangeReader(s3_client, bucket, key, range_size), buffer_size=range_size)
+
+
+def download_s3_object_in_parts(s3_client, bucket, key, path, part_size=DEFAULT_PART_SIZE,
+                                max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Downloads an S3 object to path by splitting it into byte ranges of part_size and fetching them concurrently,
+    each part being written straight to its offset in the destination file
+    :param s3_client: boto3 s3 client
+    :param bucket: object bucket
+    :param key: object key
+    :param path: local destination path
+    :param part_size: size in bytes of each ranged GET
+    :param max_concurrency: maximum number of parts fetched at the same time
+    :return: number of bytes downloaded
+    """
+    size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    logger.info('m=download_s3_object_in_parts, bucket={}, key={}, path={}, size={}, part_size={}, '
+                'max_concurrency={}'.format(bucket, key, path, size, part_size, max_concurrency))
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    def download_part(start):
+        end = min(start + part_size, size) - 1
+        body = s3_client.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body']
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            for data in iter(lambda: body.read(WRITE_BUFFER_SIZE), b''):
+                f.write(data)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # list() re-raises the first failed part
+        list(executor.map(download_part, range(0, size, part_size)))
+
+    return size
+
+
+def list_partition_prefixes(s3_client, bucket, prefix, max_concurrency=DEFAULT_MAX_CONCURRENCY, known=None):
+    """
+    Discovers the hive style partitions (key=value/...) under a prefix. The tree is walked one level at a time with
+    delimited listings, all prefixes of a level being listed concurrently, so only partition prefixes are listed and
+    never the data files inside them. A prefix is only known to be a partition once its listing has no children, so
+    the known partitions are not listed again: with them, the cost of a walk grows with the number of parent prefixes
+    and new partitions rather than with the number of partitions.
+    :param s3_client: boto3 s3 client
+    :param bucket: bucket name
+    :param prefix: prefix of the table location, with or without a trailing slash
+    :param max_concurrency: maximum number of prefixes listed at the same time
+    :param known: partition paths found by an earlier walk, returned without being listed if they still exist
+    :return: sorted list of partition paths relative to prefix, such as 'dt=2019-01-01/city=sp'
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+
+    def list_children(parent):
+        children = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=parent, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                if '=' in common_prefix['Prefix'][len(parent):]:
+                    children.append(common_prefix['Prefix'])
+        return children
+
+    known = set(known or [])
+    partitions = []
+    listed = 0
+    level = [prefix]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while level:
+            listed += len(level)
+            next_level = []
+            for parent, children in zip(level, executor.map(list_children, level)):
+                if not children and parent != prefix:
+                    partitions.append(parent[len(prefix):].rstrip('/'))
+                for child in children:
+                    path = child[len(prefix):].rstrip('/')
+                    if path in known:
+                        partitions.append(path)
+                    else:
+                        next_level.append(child)
+            level = next_level
+
+    logger.info('m=list_partition_prefixes, bucket={}, prefix={}, partitions={}, listed_prefixes={}'.format(
+        bucket, prefix, len(partitions), listed))
+    return sorted(partitions)
+
+
+def list_s3_objects(s3_client, bucket, prefix):
+    """
+    :return: list of (key, size) tuples of every object under prefix
+    """
+    objects = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend((content['Key'], content['Size']) for content in page.get('Contents', []))
+    return objects
+
+
+def delete_s3_prefix(s3_client, bucket, prefix):
+    """
+    Deletes every object under prefix, DELETE_OBJECTS_MAX_KEYS per delete_objects call
+    :return: number of objects deleted
+    """
+    keys = [key for key, _ in list_s3_objects(s3_client, bucket, prefix)]
+    for start in range(0, len(keys), DELETE_OBJECTS_MAX_KEYS):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + DELETE_OBJECTS_MAX_KEYS]], 'Quiet': True}
+        )
+        for error in response.get('Errors', []):
+            logger.warn('m=delete_s3_prefix, bucket={}, key={}, msg=object not deleted, error: {}'.format(
+                bucket, error.get('Key'), error.get('Message')))
+
+    logger.info('m=delete_s3_prefix, bucket={}, prefix={}, objects={}'.format(bucket, prefix, len(keys)))
+    return len(keys)
@@ -1,10 +1,10 @@
 import json
 import os
-import boto3
 import datetime
 import arrow
 
 from qa_python_utils import QuintoAndarLogger
+from qa_python_utils.aws.clients import get_client
 
 logger = QuintoAndarLogger('aws.sns')
 
@@ -26,7 +26,7 @@ class SNSClient:
         self.topic_arn = topic_arn
         default_kwargs.update(kwargs)
         try:
-            self.client = boto3.client('sns', **default_kwargs)
+            self.client = get_client('sns', **default_kwargs)
         except:
             logger.exception('failed to init sqs client for %s' % topic_arn)
 
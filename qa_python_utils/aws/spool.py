@@ -0,0 +1,192 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from qa_python_utils import QuintoAndarLogger
+
+logger = QuintoAndarLogger('aws.spool')
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'qa_python_utils_spool')
+TEMP_PREFIX = '.tmp.'
+
+_default_spool = []
+_default_spool_lock = threading.Lock()
+
+
+def get_default_spool():
+    """
+    :return: the process wide ResultSpool over DEFAULT_DIRECTORY. Every process using it gets its own budget of
+        DEFAULT_MAX_BYTES over the same directory, so N processes may keep up to N times that much and evict each
+        other's files; give each worker its own spool, or a smaller max_bytes, to bound the total.
+    """
+    with _default_spool_lock:
+        if not _default_spool:
+            _default_spool.append(ResultSpool())
+        return _default_spool[0]
+
+
+class ResultSpool(object):
+    """
+    Local directory of downloaded files, such as query results, bounded to max_bytes. Files are keyed by name, so a
+    file written once is reused by every later read of the same key, and the least recently used files are removed
+    once the budget is exceeded. Files already in the directory, from earlier processes, are adopted on start.
+
+    Each file is written under a temporary name and renamed when complete, so a key never points to a partial file,
+    and concurrent requests for the same key wait for a single download. An evicted file that is already open keeps
+    being readable until it is closed, so readers should use open and open_or_create, which open the file while it
+    cannot be evicted, rather than a path that may be evicted before it is opened.
+
+    The budget is kept per ResultSpool: spools of several processes over one directory each count only their own
+    files, while evicting files the others may have adopted. Files removed by another process are downloaded again.
+    """
+
+    @logger
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._files = OrderedDict()
+        self._bytes = 0
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.startswith(TEMP_PREFIX) and os.path.isfile(path):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._files[name] = size
+            self._bytes += size
+        with self._lock:
+            self.__evict()
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def get(self, key):
+        """
+        :return: path of the file of key, marked as recently used, or None if it is not spooled. The file may be
+            evicted before the path is opened, see open
+        """
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files[key] = self._files.pop(key)
+        path = os.path.join(self.directory, key)
+        try:
+            # keeps the order across processes adopting the directory
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.__remove(key)
+            return None
+        return path
+
+    def open(self, key, mode='rb'):
+        """
+        :return: the file of key opened in mode and marked as recently used, or None if it is not spooled. The file is
+            opened while it cannot be evicted, and stays readable until it is closed.
+        """
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            if key not in self._files:
+                return None
+            try:
+                f = open(path, mode)
+            except IOError:
+                # removed by another process sharing the directory
+                self.__remove(key)
+                return None
+            self._files[key] = self._files.pop(key)
+        try:
+            # keeps the order across processes adopting the directory
+            os.utime(path, None)
+        except OSError:
+            pass
+        return f
+
+    def open_or_create(self, key, write, mode='rb'):
+        """
+        Opens the file of key, calling write(path) to create it if it is not spooled
+        :param key: file name, such as a query execution id and extension
+        :param write: function writing the whole file to the path it is given
+        :return: the file opened in mode, see open
+        """
+        f = self.open(key, mode)
+        if f is not None:
+            return f
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                f = self.open(key, mode)
+                if f is not None:
+                    return f
+
+                fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+                os.close(fd)
+                try:
+                    write(temp_path)
+                    size = os.path.getsize(temp_path)
+                    path = os.path.join(self.directory, key)
+                    os.rename(temp_path, path)
+                finally:
+                    # only left behind by a failed write, whatever it raised
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+                with self._lock:
+                    # the renamed file replaced any file of key, which is only uncounted here
+                    self._bytes -= self._files.pop(key, 0)
+                    self._files[key] = size
+                    self._bytes += size
+                    self.__evict(keep=key)
+                    f = open(path, mode)
+            finally:
+                # dropped only once the file is registered, so later requests find it instead of writing it again
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+        logger.info('m=open_or_create, key={}, size={}, spool_size={}'.format(key, size, self._bytes))
+        return f
+
+    def get_or_create(self, key, write):
+        """
+        Returns the path of the file of key, calling write(path) to create it if it is not spooled. The file may be
+        evicted before the path is opened, see open_or_create.
+        """
+        self.open_or_create(key, write).close()
+        return os.path.join(self.directory, key)
+
+    def remove(self, key):
+        with self._lock:
+            self.__remove(key)
+
+    def __remove(self, key):
+        if key not in self._files:
+            return
+        self._bytes -= self._files.pop(key)
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+
+    def __evict(self, keep=None):
+        for key in list(self._files):
+            if self._bytes <= self.max_bytes:
+                break
+            if key != keep:
+                logger.info('m=__evict, key={}, size={}, msg=evicting'.format(key, self._files[key]))
+                self.__remove(key)
@@ -0,0 +1,22 @@
+class PollingFake(object):
+    """
+    Service polled by the async clients: every id is running for its first two polls, then fails if 'fail' is in it
+    and succeeds otherwise. Ids with 'missing' are never found and ids with 'slow' never finish.
+    """
+
+    def __init__(self):
+        self.polls = {}
+
+    def states(self, ids):
+        """
+        :return: list of (id, state) tuples, state being RUNNING, FAILED or SUCCEEDED, for the ids found
+        """
+        states = []
+        for key in ids:
+            polls = self.polls.setdefault(key, 0)
+            self.polls[key] = polls + 1
+            if 'missing' in key:
+                continue
+            states.append((key, 'RUNNING' if polls < 2 or 'slow' in key else
+                           'FAILED' if 'fail' in key else 'SUCCEEDED'))
+        return states
@@ -0,0 +1,785 @@
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from io import BytesIO
+from unittest import TestCase
+
+import botocore.session
+import fastparquet as fp
+from botocore.exceptions import EndpointConnectionError
+from botocore.stub import Stubber
+import pandas as pd
+from mock import Mock, patch
+
+from qa_python_utils.aws.athena import AthenaClient
+from qa_python_utils.aws.athena_cache import AthenaResultCache
+from qa_python_utils.aws.spool import ResultSpool
+
+
+def count_rows(df):
+    return len(df)
+
+
+class AWSAthenaTest(TestCase):
+    def setUp(self):
+        self.athena_session = botocore.session.get_session().create_client('athena', region_name='us-east-1')
+        self.athena_stubber = Stubber(self.athena_session)
+        self.s3_session = botocore.session.get_session().create_client('s3', region_name='us-east-1')
+        self.s3_stubber = Stubber(self.s3_session)
+
+        self.spool_directory = tempfile.mkdtemp()
+        self.athena_client = AthenaClient(s3_bucket='bucket', spool=ResultSpool(self.spool_directory))
+        self.athena_client.athena_client = self.athena_session
+        self.athena_client.submit_client = self.athena_session
+        self.athena_client.s3_resource.meta.client = self.s3_session
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_directory)
+
+    def stub_query_execution(self, query_execution_id, state='SUCCEEDED',
+                             output_location='s3://bucket/query_results/{}.csv', statistics=None):
+        query_execution = {
+            'QueryExecutionId': query_execution_id,
+            'Status': {'State': state},
+            'ResultConfiguration': {'OutputLocation': output_location.format(query_execution_id)}
+        }
+        if statistics is not None:
+            query_execution['Statistics'] = statistics
+        self.athena_stubber.add_response(
+            method='get_query_execution',
+            service_response={'QueryExecution': query_execution},
+            expected_params={'QueryExecutionId': query_execution_id}
+        )
+
+    def stub_s3_object(self, bucket, key, body):
+        self.s3_stubber.add_response(
+            method='head_object',
+            service_response={'ContentLength': len(body)},
+            expected_params={'Bucket': bucket, 'Key': key}
+        )
+        self.s3_stubber.add_response(
+            method='get_object',
+            service_response={'Body': BytesIO(body)},
+            expected_params={'Bucket': bucket, 'Key': key, 'Range': 'bytes=0-{}'.format(len(body) - 1)}
+        )
+
+    def test_get_chunked_dataframe_from_query_execution_id(self):
+        # mocks
+        query_execution_id = '123'
+        self.stub_query_execution(query_execution_id, output_location='s3://other_bucket/other_folder/{}.csv')
+        self.stub_s3_object('other_bucket', 'other_folder/123.csv', b'id,name\n1,a\n2,b\n3,\n')
+
+        # calls
+        with self.athena_stubber, self.s3_stubber:
+            chunks = list(self.athena_client.get_chunked_dataframe_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                chunk_size=2
+            ))
+
+        # assertions
+        self.assertEqual(
+            first=[len(chunk) for chunk in chunks],
+            second=[2, 1]
+        )
+        self.assertEqual(
+            first=list(chunks[1]['name']),
+            second=['']
+        )
+
+    def test_get_dataframe_from_query_execution_id(self):
+        # mocks
+        query_execution_id = '123'
+        self.stub_query_execution(query_execution_id, output_location='s3://other_bucket/other_folder/{}.csv')
+        self.stub_s3_object('other_bucket', 'other_folder/123.csv', b'id,name\n1,a\n2,\n')
+        temp_files = set(os.listdir(tempfile.gettempdir()))
+
+        # calls
+        with self.athena_stubber, self.s3_stubber:
+            response = self.athena_client.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id)
+
+        # assertions
+        self.assertEqual(
+            first=list(response['name']),
+            second=['a', '']
+        )
+        self.assertEqual(
+            first=set(os.listdir(tempfile.gettempdir())),
+            second=temp_files
+        )
+
+    @patch('qa_python_utils.aws.athena.time.sleep')
+    def test_wait_for_many_query_results(self, sleep):
+        # mocks
+        self.athena_stubber.add_response(
+            method='batch_get_query_execution',
+            service_response={
+                'QueryExecutions': [
+                    {'QueryExecutionId': '1', 'Status': {'State': 'RUNNING'}},
+                    {'QueryExecutionId': '2', 'Status': {'State': 'SUCCEEDED'}}
+                ],
+                'UnprocessedQueryExecutionIds': [
+                    {'QueryExecutionId': '3', 'ErrorCode': 'InternalServerException'},
+                    {'QueryExecutionId': '4', 'ErrorCode': 'InvalidRequestException', 'ErrorMessage': 'invalid id'}
+                ]
+            },
+            expected_params={'QueryExecutionIds': ['1', '2', '3', '4']}
+        )
+        self.athena_stubber.add_response(
+            method='batch_get_query_execution',
+            service_response={
+                'QueryExecutions': [
+                    {'QueryExecutionId': '1', 'Status': {'State': 'FAILED'}},
+                    {'QueryExecutionId': '3', 'Status': {'State': 'SUCCEEDED'}}
+                ]
+            },
+            expected_params={'QueryExecutionIds': ['1', '3']}
+        )
+
+        # calls
+        with self.athena_stubber:
+            response = [(query_execution['QueryExecutionId'], query_execution['Status']['State'])
+                        for query_execution in self.athena_client.wait_for_many_query_results(['1', '2', '3', '4'])]
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=[('2', 'SUCCEEDED'), ('4', 'FAILED'), ('1', 'FAILED'), ('3', 'SUCCEEDED')]
+        )
+        self.assertEqual(
+            first=sleep.call_count,
+            second=1
+        )
+
+    def test_get_paginated_dataframe_from_query_execution_id(self):
+        # mocks
+        query_execution_id = '123'
+        result_set_metadata = {'ColumnInfo': [{'Name': 'id', 'Type': 'integer'}, {'Name': 'name', 'Type': 'varchar'}]}
+        self.stub_query_execution(query_execution_id)
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={
+                'ResultSet': {
+                    'Rows': [
+                        {'Data': [{'VarCharValue': 'id'}, {'VarCharValue': 'name'}]},
+                        {'Data': [{'VarCharValue': '1'}, {'VarCharValue': 'a'}]}
+                    ],
+                    'ResultSetMetadata': result_set_metadata
+                },
+                'NextToken': 'token'
+            },
+            expected_params={'QueryExecutionId': query_execution_id, 'MaxResults': 2}
+        )
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={
+                'ResultSet': {
+                    'Rows': [
+                        {'Data': [{'VarCharValue': '2'}, {}]}
+                    ],
+                    'ResultSetMetadata': result_set_metadata
+                }
+            },
+            expected_params={'QueryExecutionId': query_execution_id, 'MaxResults': 2, 'NextToken': 'token'}
+        )
+
+        # calls
+        with self.athena_stubber:
+            response = list(self.athena_client.get_paginated_dataframe_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                page_size=2
+            ))
+
+        # assertions
+        self.assertEqual(
+            first=[df.values.tolist() for df in response],
+            second=[[['1', 'a']], [['2', None]]]
+        )
+        self.assertEqual(
+            first=list(response[1].columns),
+            second=['id', 'name']
+        )
+
+    @patch.object(AthenaClient, 'get_dataframe_from_query_execution_id')
+    @patch.object(AthenaClient, 'wait_for_query_results')
+    @patch.object(AthenaClient, 'execute_raw_query')
+    def test_execute_query_and_return_dataframe_cached(self, execute_raw_query, wait_for_query_results,
+                                                       get_dataframe_from_query_execution_id):
+        # mocks
+        execute_raw_query.return_value = '123'
+        get_dataframe_from_query_execution_id.return_value = pd.DataFrame({'a': [1]})
+        self.athena_client.result_cache = AthenaResultCache()
+
+        # calls
+        first_response = self.athena_client.execute_query_and_return_dataframe('SELECT {a}', query_params={'a': 1})
+        second_response = self.athena_client.execute_query_and_return_dataframe('SELECT  {a};', query_params={'a': 1})
+        paginated_response = self.athena_client.execute_query_and_return_dataframe(
+            'SELECT {a}',
+            query_params={'a': 1},
+            paginate=True
+        )
+
+        # assertions
+        self.assertTrue(first_response.equals(second_response))
+        self.assertIsNotNone(obj=paginated_response)
+        execute_raw_query.assert_called_once_with(sql='SELECT 1', s3_bucket=None, bucket_folder_path=None)
+        get_dataframe_from_query_execution_id.assert_called_once_with(query_execution_id='123', file_ext='csv',
+                                                                      typed=False)
+
+    @patch.object(AthenaClient, '_AthenaClient__save_df_file_into_s3_as_parquet')
+    def test_create_parquet_from_df(self, save_df_file_into_s3_as_parquet):
+        # mocks
+        df = pd.DataFrame({
+            'id': ['1', '', '3'],
+            'price': ['1.5', None, '2'],
+            'document': ['123.456-78', '901.234-56', '']
+        })
+
+        # calls
+        self.athena_client.create_parquet_from_df(
+            key='key',
+            df=df,
+            raw_columns=OrderedDict([('id', int), ('price', float), ('document', str)]),
+            clean_columns=OrderedDict([('user_id', int), ('price', float), ('document', [int, r'[.-]', ''])])
+        )
+
+        # assertions
+        new_df = save_df_file_into_s3_as_parquet.call_args[1]['df']
+        self.assertEqual(
+            first=list(new_df.columns),
+            second=['user_id', 'price', 'document']
+        )
+        self.assertEqual(
+            first=new_df.where(new_df.notnull(), None).values.tolist(),
+            second=[[1, 1.5, 12345678], [None, None, 90123456], [3, 2.0, None]]
+        )
+
+    def test_get_dataframe_page_from_query_execution_id_above_api_limit(self):
+        # mocks
+        query_execution_id = '123'
+        result_set_metadata = {'ColumnInfo': [{'Name': 'id', 'Type': 'integer'}, {'Name': 'id', 'Type': 'integer'}]}
+        rows = [{'Data': [{'VarCharValue': str(i)}, {'VarCharValue': str(-i)}]} for i in range(1500)]
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={
+                'ResultSet': {'Rows': [{'Data': [{'VarCharValue': 'id'}, {'VarCharValue': 'id'}]}] + rows[:999],
+                              'ResultSetMetadata': result_set_metadata},
+                'NextToken': 'token_1'
+            },
+            expected_params={'QueryExecutionId': query_execution_id, 'MaxResults': 1000}
+        )
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={
+                'ResultSet': {'Rows': rows[999:1200], 'ResultSetMetadata': result_set_metadata},
+                'NextToken': 'token_2'
+            },
+            expected_params={'QueryExecutionId': query_execution_id, 'MaxResults': 201, 'NextToken': 'token_1'}
+        )
+
+        # calls
+        with self.athena_stubber:
+            df, next_token = self.athena_client.get_dataframe_page_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                page_size=1200,
+                typed=True
+            )
+
+        # assertions
+        self.assertEqual(
+            first=next_token,
+            second='token_2'
+        )
+        self.assertEqual(
+            first=df.shape,
+            second=(1200, 2)
+        )
+        self.assertEqual(
+            first=df.values.tolist()[-1],
+            second=[1199, -1199]
+        )
+
+    @patch.object(AthenaClient, 'execute_query_and_wait_for_results')
+    def test_add_partitions(self, execute_query_and_wait_for_results):
+        # mocks
+        def execute(sql):
+            if "dt='2019-01-03'" in sql:
+                raise RuntimeError('query failed')
+            return '123'
+
+        execute_query_and_wait_for_results.side_effect = execute
+        partitions = [
+            {'values': [('dt', '2019-01-0{}'.format(day)), ('city', "sao'paulo")], 'location': 's3://bucket/{}'.format(day)}
+            for day in range(1, 4)
+        ]
+
+        # calls
+        response = self.athena_client.add_partitions('db', 'table', partitions, max_partitions_per_statement=2)
+
+        # assertions
+        statements = sorted(call[1]['sql'] for call in execute_query_and_wait_for_results.call_args_list)
+        self.assertEqual(
+            first=statements,
+            second=[
+                "ALTER TABLE db.table ADD IF NOT EXISTS PARTITION (dt='2019-01-01', city='sao''paulo') "
+                "LOCATION 's3://bucket/1' PARTITION (dt='2019-01-02', city='sao''paulo') LOCATION 's3://bucket/2'",
+                "ALTER TABLE db.table ADD IF NOT EXISTS PARTITION (dt='2019-01-03', city='sao''paulo') "
+                "LOCATION 's3://bucket/3'"
+            ]
+        )
+        self.assertEqual(
+            first=[(result['status'], result['error']) for result in response],
+            second=[('SUCCEEDED', None), ('SUCCEEDED', None), ('FAILED', 'query failed')]
+        )
+
+    @patch.object(AthenaClient, 'execute_query_and_wait_for_results')
+    def test_upsert_partitions_in_bulk(self, execute_query_and_wait_for_results):
+        # calls
+        response = self.athena_client.upsert_partitions_in_bulk(
+            bucket_folder_path='bucket/table',
+            database='db',
+            table='table',
+            partitions_list_dicts_list=[[{'partition_name': 'dt', 'partition_value': '2019-01-01'}],
+                                        [{'partition_name': 'dt', 'partition_value': '2019-01-02'}]]
+        )
+
+        # assertions
+        self.assertEqual(
+            first=[call[1]['sql'] for call in execute_query_and_wait_for_results.call_args_list],
+            second=[
+                "ALTER TABLE db.table DROP IF EXISTS PARTITION (dt='2019-01-01'), PARTITION (dt='2019-01-02')",
+                "ALTER TABLE db.table ADD IF NOT EXISTS PARTITION (dt='2019-01-01') "
+                "LOCATION 's3://bucket/table/dt=2019-01-01' PARTITION (dt='2019-01-02') "
+                "LOCATION 's3://bucket/table/dt=2019-01-02'"
+            ]
+        )
+        self.assertEqual(
+            first=[result['status'] for result in response],
+            second=['SUCCEEDED', 'SUCCEEDED']
+        )
+
+    @patch.object(AthenaClient, 'add_partitions')
+    @patch('qa_python_utils.aws.athena.list_partition_prefixes')
+    def test_update_partitions(self, list_partition_prefixes, add_partitions):
+        # mocks
+        _, snapshot_path = tempfile.mkstemp()
+        os.remove(snapshot_path)
+        list_partition_prefixes.side_effect = [['dt=2019-01-01'], ['dt=2019-01-01', 'dt=2019-01-02', 'dt=2019-01%3A03']]
+        add_partitions.side_effect = lambda database, table, partitions, max_workers: [
+            {'partition': partition, 'status': 'SUCCEEDED', 'error': None} for partition in partitions]
+
+        # calls
+        try:
+            self.athena_client.update_partitions('db.table', 's3://bucket/table/', snapshot_path=snapshot_path)
+            response = self.athena_client.update_partitions('db.table', 's3://bucket/table/',
+                                                            snapshot_path=snapshot_path)
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+        finally:
+            os.remove(snapshot_path)
+
+        # assertions
+        list_partition_prefixes.assert_called_with(self.s3_session, 'bucket', 'table', max_concurrency=10,
+                                                   known=set(['dt=2019-01-01']))
+        self.assertEqual(
+            first=[result['partition'] for result in response],
+            second=[{'values': [('dt', '2019-01-02')], 'location': 's3://bucket/table/dt=2019-01-02'},
+                    {'values': [('dt', '2019-01:03')], 'location': 's3://bucket/table/dt=2019-01%3A03'}]
+        )
+        self.assertEqual(
+            first=snapshot,
+            second=['dt=2019-01%3A03', 'dt=2019-01-01', 'dt=2019-01-02']
+        )
+
+    def test_get_dataframe_from_query_execution_id_metrics(self):
+        # mocks
+        query_execution_id = '123'
+        self.stub_query_execution(query_execution_id, statistics={'EngineExecutionTimeInMillis': 1500,
+                                                                  'DataScannedInBytes': 2048})
+        self.stub_s3_object('bucket', 'query_results/123.csv', b'id\n1\n2\n')
+
+        # calls
+        with self.athena_stubber, self.s3_stubber:
+            self.athena_client.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id)
+        response = self.athena_client.metrics.get(query_execution_id)
+
+        # assertions
+        self.assertEqual(
+            first=(response['state'], response['engine_ms'], response['data_scanned_bytes'], response['result_bytes']),
+            second=('SUCCEEDED', 1500, 2048, 7)
+        )
+        self.assertEqual(
+            first=sorted(metric for metric in response if metric.endswith('_seconds')),
+            second=['download_seconds', 'parse_seconds', 'wait_seconds']
+        )
+
+    @patch('qa_python_utils.aws.athena.uuid.uuid4')
+    @patch.object(AthenaClient, '_AthenaClient__get_s3_filesystem')
+    @patch.object(AthenaClient, 'execute_query_and_wait_for_results')
+    def test_execute_unload_query_and_return_dataframe(self, execute_query_and_wait_for_results, get_s3_filesystem,
+                                                       uuid4):
+        # mocks
+        uuid4.return_value = 'scratch'
+        execute_query_and_wait_for_results.return_value = '123'
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        files = {}
+        for name, ids in [('part-0', [1, 2]), ('part-1', [3])]:
+            files['bucket/query_results/unload/scratch/{}'.format(name)] = os.path.join(folder, name)
+            fp.write(os.path.join(folder, name), pd.DataFrame({'id': ids}))
+        get_s3_filesystem.return_value = Mock(open=lambda path, mode='rb': open(files[path], mode))
+        listing = {'Contents': [{'Key': 'query_results/unload/scratch/part-0', 'Size': 10},
+                                {'Key': 'query_results/unload/scratch/part-1', 'Size': 10},
+                                {'Key': 'query_results/unload/scratch/empty', 'Size': 0}]}
+        for _ in range(2):
+            self.s3_stubber.add_response(
+                method='list_objects_v2',
+                service_response=listing,
+                expected_params={'Bucket': 'bucket', 'Prefix': 'query_results/unload/scratch/'}
+            )
+        self.s3_stubber.add_response(
+            method='delete_objects',
+            service_response={},
+            expected_params={'Bucket': 'bucket', 'Delete': {'Objects': [{'Key': content['Key']}
+                                                                        for content in listing['Contents']],
+                                                            'Quiet': True}}
+        )
+
+        # calls
+        with self.s3_stubber:
+            response = self.athena_client.execute_query_and_return_dataframe('SELECT id FROM t;', unload=True)
+
+        # assertions
+        execute_query_and_wait_for_results.assert_called_once_with(
+            sql="UNLOAD (SELECT id FROM t) TO 's3://bucket/query_results/unload/scratch/' "
+                "WITH (format = 'PARQUET', compression = 'GZIP')",
+            s3_bucket='bucket',
+            bucket_folder_path='query_results'
+        )
+        self.assertEqual(
+            first=response['id'].tolist(),
+            second=[1, 2, 3]
+        )
+        self.s3_stubber.assert_no_pending_responses()
+
+    @patch('qa_python_utils.aws.athena.time.sleep')
+    def test_execute_raw_query_retries_throttling(self, sleep):
+        # mocks
+        self.athena_stubber.add_client_error('start_query_execution', service_error_code='TooManyRequestsException',
+                                             http_status_code=400)
+        self.athena_stubber.add_client_error('start_query_execution', service_error_code='InternalServerException',
+                                             http_status_code=500)
+        self.athena_stubber.add_response('start_query_execution', {'QueryExecutionId': '123'})
+
+        # calls
+        with self.athena_stubber:
+            response = self.athena_client.execute_raw_query('SELECT 1')
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second='123'
+        )
+        self.assertEqual(
+            first=sleep.call_count,
+            second=2
+        )
+
+    @patch('qa_python_utils.aws.athena.time.sleep')
+    def test_execute_raw_query_retries_connection_errors(self, sleep):
+        # mocks
+        self.athena_client.submit_client = Mock()
+        self.athena_client.submit_client.start_query_execution.side_effect = [
+            EndpointConnectionError(endpoint_url='https://athena.us-east-1.amazonaws.com'),
+            {'QueryExecutionId': '123'}
+        ]
+
+        # calls
+        response = self.athena_client.execute_raw_query('SELECT 1')
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second='123'
+        )
+        tokens = [call[1]['ClientRequestToken'] for call in
+                  self.athena_client.submit_client.start_query_execution.call_args_list]
+        self.assertEqual(
+            first=len(tokens),
+            second=2
+        )
+        self.assertEqual(
+            first=tokens[0],
+            second=tokens[1]
+        )
+        sleep.assert_called_once()
+
+    def test_submit_client_does_not_retry(self):
+        # calls
+        athena_client = AthenaClient(s3_bucket='bucket', spool=ResultSpool(self.spool_directory))
+
+        # assertions
+        self.assertIsNot(expr1=athena_client.submit_client, expr2=athena_client.athena_client)
+        self.assertEqual(
+            first=athena_client.submit_client.meta.config.retries['total_max_attempts'],
+            second=1
+        )
+
+    @patch('qa_python_utils.aws.athena.time.sleep')
+    def test_execute_raw_query_fatal_error(self, sleep):
+        # mocks
+        self.athena_stubber.add_client_error('start_query_execution', service_error_code='InvalidRequestException',
+                                             service_message='syntax error', http_status_code=400)
+
+        # calls
+        with self.athena_stubber:
+            with self.assertRaises(RuntimeError):
+                self.athena_client.execute_raw_query('SELEC 1')
+
+        # assertions
+        sleep.assert_not_called()
+
+    @patch.object(AthenaClient, 'add_partitions')
+    @patch.object(AthenaClient, '_AthenaClient__save_df_file_into_s3_as_parquet')
+    def test_create_parquet_from_df_partitioned(self, save_df_file_into_s3_as_parquet, add_partitions):
+        # mocks
+        df = pd.DataFrame(OrderedDict([
+            ('id', [1, 2, 3, 4]),
+            ('dt', ['2019-01-01', '2019-01-01', '2019-01-02', None]),
+            ('city', ['sp', 'sp', 'sao paulo', 'rj'])
+        ]))
+
+        add_partitions.side_effect = lambda database, table, partitions: [
+            {'partition': partition, 'status': 'SUCCEEDED', 'error': None} for partition in partitions]
+
+        # calls
+        response = self.athena_client.create_parquet_from_df(key='snapshots/', df=df, partition_cols=['dt', 'city'],
+                                                             database='db', table='snapshots')
+
+        # assertions
+        writes = sorted((call[1]['file_path'], call[1]['df']['id'].tolist(), list(call[1]['df'].columns))
+                        for call in save_df_file_into_s3_as_parquet.call_args_list)
+        self.assertEqual(
+            first=writes,
+            second=[
+                ('snapshots/dt=2019-01-01/city=sp/part.0.parquet', [1, 2], ['id']),
+                ('snapshots/dt=2019-01-02/city=sao%20paulo/part.0.parquet', [3], ['id']),
+                ('snapshots/dt=__HIVE_DEFAULT_PARTITION__/city=rj/part.0.parquet', [4], ['id'])
+            ]
+        )
+        partitions = add_partitions.call_args[0][2]
+        self.assertEqual(
+            first=sorted(partition['location'] for partition in partitions),
+            second=['s3://bucket/snapshots/dt=2019-01-01/city=sp', 's3://bucket/snapshots/dt=2019-01-02/city=sao%20paulo']
+        )
+        self.assertIn(member={'values': [('dt', '2019-01-02'), ('city', 'sao paulo')],
+                              'location': 's3://bucket/snapshots/dt=2019-01-02/city=sao%20paulo'}, container=partitions)
+        self.assertEqual(
+            first=sorted((result['partition']['location'], result['status']) for result in response),
+            second=[('s3://bucket/snapshots/dt=2019-01-01/city=sp', 'SUCCEEDED'),
+                    ('s3://bucket/snapshots/dt=2019-01-02/city=sao%20paulo', 'SUCCEEDED'),
+                    ('s3://bucket/snapshots/dt=__HIVE_DEFAULT_PARTITION__/city=rj', 'SKIPPED')]
+        )
+
+    @patch.object(AthenaClient, '_AthenaClient__save_df_file_into_s3_as_parquet')
+    def test_create_parquet_from_df_partitioned_typed_columns(self, save_df_file_into_s3_as_parquet):
+        # mocks
+        df = pd.DataFrame(OrderedDict([
+            ('id', [1, 2, 3]),
+            ('year', [2019, None, 2020]),
+            ('dt', pd.to_datetime(['2019-01-01', '2019-01-01', None])),
+            ('active', [True, True, False])
+        ]))
+
+        # calls
+        response = self.athena_client.create_parquet_from_df(key='snapshots', df=df,
+                                                             partition_cols=['year', 'dt', 'active'])
+
+        # assertions
+        self.assertEqual(
+            first=[partition['values'] for partition in response],
+            second=[[('year', '2019'), ('dt', '2019-01-01'), ('active', 'true')],
+                    [('year', '__HIVE_DEFAULT_PARTITION__'), ('dt', '2019-01-01'), ('active', 'true')],
+                    [('year', '2020'), ('dt', '__HIVE_DEFAULT_PARTITION__'), ('active', 'false')]]
+        )
+        self.assertEqual(
+            first=save_df_file_into_s3_as_parquet.call_args_list[0][1]['file_path'],
+            second='snapshots/year=2019/dt=2019-01-01/active=true/part.0.parquet'
+        )
+        self.assertEqual(
+            first=[call[1]['df']['id'].tolist() for call in save_df_file_into_s3_as_parquet.call_args_list],
+            second=[[1], [2], [3]]
+        )
+
+    @patch('qa_python_utils.aws.athena.compact_parquet_dataset')
+    @patch('qa_python_utils.aws.athena.append_parquet_dataset')
+    @patch.object(AthenaClient, '_AthenaClient__get_s3_filesystem')
+    def test_create_parquet_from_df_append(self, get_s3_filesystem, append_parquet_dataset, compact_parquet_dataset):
+        # mocks
+        s3_fs = get_s3_filesystem.return_value
+
+        # calls
+        self.athena_client.create_parquet_from_df(key='history/', df=pd.DataFrame({'id': [1]}), append=True,
+                                                  compaction_threshold=10)
+
+        # assertions
+        self.assertEqual(
+            first=append_parquet_dataset.call_args[0][1:],
+            second=('bucket/history',)
+        )
+        compact_parquet_dataset.assert_called_once_with('bucket/history', open_with=s3_fs.open, remove_with=s3_fs.rm,
+                                                        small_row_group_rows=100000, min_row_groups=10)
+
+    @patch.object(AthenaClient, '_AthenaClient__get_s3_filesystem')
+    @patch.object(AthenaClient, 'get_chunked_dataframe_from_query_execution_id')
+    @patch.object(AthenaClient, 'execute_raw_query')
+    def test_create_parquet_from_query_stream(self, execute_raw_query, get_chunked_dataframe, get_s3_filesystem):
+        # mocks
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.athena_client.s3_bucket = directory
+        get_s3_filesystem.return_value.open = open
+        # chunks as read with keep_default_na=False, the first one having every score and name empty
+        get_chunked_dataframe.return_value = iter([
+            pd.DataFrame({'id': [1, 2], 'score': ['', ''], 'name': ['', '']}),
+            pd.DataFrame({'id': [3, 4], 'score': ['10', ''], 'name': ['c', '']}),
+            pd.DataFrame({'id': [5, 6], 'score': [20, 30], 'name': ['e', 'f']})
+        ])
+        raw_columns = OrderedDict([('id', int), ('score', int), ('name', str)])
+
+        # calls
+        self.athena_client.create_parquet_from_query(key='users.parquet', query='SELECT 1', raw_columns=raw_columns,
+                                                     stream=True)
+
+        # assertions
+        self.assertEqual(
+            first=get_chunked_dataframe.call_args[1]['dtype'],
+            second={'name': str}
+        )
+        pf = fp.ParquetFile(os.path.join(directory, 'users.parquet'))
+        df = pf.to_pandas().astype(object)
+        self.assertEqual(
+            first=len(pf.row_groups),
+            second=3
+        )
+        self.assertEqual(
+            first=df.where(df.notnull(), None).values.tolist(),
+            second=[[1, None, None], [2, None, None], [3, 10, 'c'], [4, None, None], [5, 20, 'e'], [6, 30, 'f']]
+        )
+
+    @patch('qa_python_utils.aws.athena.supports_execution_parameters')
+    @patch.object(AthenaClient, 'execute_raw_query')
+    def test_execute_named_query(self, execute_raw_query, supports_execution_parameters):
+        # mocks
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'users.sql'), 'w') as f:
+            f.write('SELECT * FROM {table} WHERE id = {:id}')
+        self.athena_client.query_registry.directory = directory
+
+        # calls
+        try:
+            supports_execution_parameters.return_value = True
+            self.athena_client.execute_named_query('users', query_params={'table': 'users', 'id': 1})
+            supports_execution_parameters.return_value = False
+            self.athena_client.execute_named_query('users', query_params={'table': 'users', 'id': 1})
+        finally:
+            os.remove(os.path.join(directory, 'users.sql'))
+            os.rmdir(directory)
+
+        # assertions
+        self.assertEqual(
+            first=[(call[1]['sql'], call[1]['execution_parameters']) for call in execute_raw_query.call_args_list],
+            second=[('SELECT * FROM users WHERE id = ?', ['1']), ('SELECT * FROM users WHERE id = 1', None)]
+        )
+
+    @patch.object(AthenaClient, 'get_chunked_dataframe_from_query_execution_id')
+    def test_map_reduce_query_results(self, get_chunked_dataframe_from_query_execution_id):
+        # mocks
+        chunks = [pd.DataFrame({'id': range(3)}), pd.DataFrame({'id': range(2)})]
+        get_chunked_dataframe_from_query_execution_id.return_value = iter(chunks)
+
+        # calls
+        response = self.athena_client.map_reduce_query_results('123', count_rows, lambda total, rows: total + rows,
+                                                               initializer=0, chunk_size=3, processes=2)
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=5
+        )
+        get_chunked_dataframe_from_query_execution_id.assert_called_once_with('123', chunk_size=3, typed=False)
+
+    def test_paginated_read_keeps_empty_strings_apart_from_nulls(self):
+        # mocks
+        result_set_metadata = {'ColumnInfo': [{'Name': 'id', 'Type': 'integer'}, {'Name': 'name', 'Type': 'varchar'}]}
+        self.stub_query_execution('spooled')
+        self.stub_s3_object('bucket', 'query_results/spooled.csv',
+                            b'"id","name"\n"1",""\n"2",\n,"c\nd"\n')
+        self.stub_query_execution('spooled')
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={'ResultSet': {'Rows': [], 'ResultSetMetadata': result_set_metadata}},
+            expected_params={'QueryExecutionId': 'spooled', 'MaxResults': 1}
+        )
+        self.stub_query_execution('api')
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={
+                'ResultSet': {
+                    'Rows': [
+                        {'Data': [{'VarCharValue': 'id'}, {'VarCharValue': 'name'}]},
+                        {'Data': [{'VarCharValue': '1'}, {'VarCharValue': ''}]},
+                        {'Data': [{'VarCharValue': '2'}, {}]},
+                        {'Data': [{}, {'VarCharValue': 'c\nd'}]}
+                    ],
+                    'ResultSetMetadata': result_set_metadata
+                }
+            },
+            expected_params={'QueryExecutionId': 'api', 'MaxResults': 10}
+        )
+
+        # calls
+        with self.athena_stubber, self.s3_stubber:
+            self.athena_client.get_dataframe_from_query_execution_id(query_execution_id='spooled')
+            responses = [pd.concat(self.athena_client.get_paginated_dataframe_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                page_size=10
+            )) for query_execution_id in ['spooled', 'api']]
+
+        # assertions
+        for response in responses:
+            self.assertEqual(
+                first=response.values.tolist(),
+                second=[['1', ''], ['2', None], [None, 'c\nd']]
+            )
+
+    def test_paginated_read_reuses_spooled_result(self):
+        # mocks
+        query_execution_id = '123'
+        result_set_metadata = {'ColumnInfo': [{'Name': 'id', 'Type': 'integer'}, {'Name': 'name', 'Type': 'varchar'}]}
+        self.stub_query_execution(query_execution_id)
+        self.stub_s3_object('bucket', 'query_results/123.csv', b'"id","name"\n"1","a"\n"2",\n"3","c"\n')
+        self.stub_query_execution(query_execution_id)
+        self.athena_stubber.add_response(
+            method='get_query_results',
+            service_response={'ResultSet': {'Rows': [], 'ResultSetMetadata': result_set_metadata}},
+            expected_params={'QueryExecutionId': query_execution_id, 'MaxResults': 1}
+        )
+
+        # calls
+        with self.athena_stubber, self.s3_stubber:
+            df = self.athena_client.get_dataframe_from_query_execution_id(query_execution_id=query_execution_id)
+            pages = list(self.athena_client.get_paginated_dataframe_from_query_execution_id(
+                query_execution_id=query_execution_id,
+                page_size=2,
+                typed=True
+            ))
+
+        # assertions
+        self.assertEqual(first=len(df), second=3)
+        self.assertEqual(
+            first=[page.astype(object).where(page.notnull(), None).values.tolist() for page in pages],
+            second=[[[1, 'a'], [2, None]], [[3, 'c']]]
+        )
+        self.athena_stubber.assert_no_pending_responses()
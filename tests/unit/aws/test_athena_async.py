@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+import pandas as pd
+from mock import Mock
+
+from qa_python_utils.aws.athena_async import AsyncAthenaClient
+from tests.unit.aws.polling_fake import PollingFake
+
+
+class AsyncAthenaClientTest(TestCase):
+    def setUp(self):
+        self.fake = PollingFake()
+        self.athena_client = Mock()
+        self.athena_client.execute_raw_query.side_effect = lambda sql, **kwargs: 'id_{}'.format(sql)
+        self.athena_client.batch_get_query_executions.side_effect = lambda query_execution_ids: [
+            {'QueryExecutionId': query_execution_id, 'Status': {'State': state}}
+            for query_execution_id, state in self.fake.states(query_execution_ids)]
+        self.athena_client.get_dataframe_from_query_execution_id.side_effect = \
+            lambda query_execution_id, file_ext: pd.DataFrame({'id': [query_execution_id]})
+        self.async_client = AsyncAthenaClient(self.athena_client, check_sleep_time=0.01)
+
+    def tearDown(self):
+        self.async_client.close()
+
+    def test_execute_query_and_return_dataframe(self):
+        # calls
+        futures = [self.async_client.execute_query_and_return_dataframe(str(i)) for i in range(5)]
+        response = [future.result(timeout=5)['id'][0] for future in futures]
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=['id_{}'.format(i) for i in range(5)]
+        )
+
+    def test_execute_query_and_return_dataframe_failed(self):
+        # calls
+        future = self.async_client.execute_query_and_return_dataframe('fail')
+
+        # assertions
+        self.assertRaises(Exception, future.result, 5)
+        self.athena_client.get_dataframe_from_query_execution_id.assert_not_called()
+
+    def test_failing_metrics_do_not_stop_the_watcher(self):
+        # mocks
+        self.athena_client.metrics.record_query_execution.side_effect = ValueError('metrics backend down')
+
+        # calls
+        futures = [self.async_client.execute_query_and_return_dataframe(str(i)) for i in range(2)]
+
+        # assertions
+        self.assertEqual(
+            first=[future.result(timeout=5)['id'][0] for future in futures],
+            second=['id_0', 'id_1']
+        )
+
+    def test_wait_for_query_results_timeout(self):
+        # calls
+        future = self.async_client.wait_for_query_results('id_slow', timeout=0.05)
+        other_future = self.async_client.wait_for_query_results('id_0')
+
+        # assertions
+        self.assertRaises(Exception, future.result, 5)
+        self.assertEqual(
+            first=other_future.result(timeout=5)['Status']['State'],
+            second='SUCCEEDED'
+        )
+        self.athena_client.athena_client.stop_query_execution.assert_called_once_with(QueryExecutionId='id_slow')
+
+    def test_close_fails_pending_waits(self):
+        # mocks
+        future = self.async_client.wait_for_query_results('id_slow')
+
+        # calls
+        self.async_client.close(timeout=0.05)
+
+        # assertions
+        self.assertRaises(RuntimeError, future.result, 5)
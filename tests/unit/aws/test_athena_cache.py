@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+import pandas as pd
+from mock import patch
+
+from qa_python_utils.aws.athena_cache import AthenaResultCache, normalize_sql
+
+
+class AthenaResultCacheTest(TestCase):
+    def setUp(self):
+        self.cache = AthenaResultCache(ttl=60, max_memory_bytes=10 ** 6)
+
+    def tearDown(self):
+        pass
+
+    def test_normalize_sql(self):
+        # calls
+        response = normalize_sql("""
+            SELECT a,  '--not a comment'   -- comment
+            /* block
+               comment */ FROM t WHERE b = 'x  y';
+        """)
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second="SELECT a, '--not a comment' FROM t WHERE b = 'x  y'"
+        )
+
+    def test_make_key(self):
+        # calls and assertions
+        self.assertEqual(
+            first=self.cache.make_key('SELECT  1;', {'a': 1}, 's3://bucket/folder/'),
+            second=self.cache.make_key('SELECT 1', {'a': 1}, 's3://bucket/folder/')
+        )
+        self.assertNotEqual(
+            first=self.cache.make_key('SELECT 1', {'a': 1}, 's3://bucket/folder/'),
+            second=self.cache.make_key('SELECT 1', {'a': 2}, 's3://bucket/folder/')
+        )
+        self.assertNotEqual(
+            first=self.cache.make_key('SELECT 1', None, 's3://bucket/folder/'),
+            second=self.cache.make_key('SELECT 1', None, 's3://bucket/other_folder/')
+        )
+
+    @patch('qa_python_utils.aws.athena_cache.time.time')
+    def test_query_execution_id_ttl(self, time):
+        # mocks
+        time.return_value = 1000
+        self.cache.put_query_execution_id('key', '123')
+        self.cache.put_dataframe('key', '123', pd.DataFrame({'a': [1]}))
+
+        # calls and assertions
+        time.return_value = 1060
+        self.assertEqual(
+            first=self.cache.get_query_execution_id('key'),
+            second='123'
+        )
+        self.assertIsNotNone(obj=self.cache.get_dataframe('key'))
+        time.return_value = 1061
+        self.assertIsNone(obj=self.cache.get_query_execution_id('key'))
+        self.assertIsNone(obj=self.cache.get_dataframe('key'))
+
+    def test_dataframe_lru_memory_budget(self):
+        # mocks
+        df = pd.DataFrame({'a': range(50000)})
+        self.cache.max_memory_bytes = 2.5 * df.memory_usage(index=True, deep=True).sum()
+        for key in ['1', '2', '3']:
+            self.cache.put_query_execution_id(key, key)
+            self.cache.put_dataframe(key, key, df)
+
+        # assertions
+        self.assertIsNone(obj=self.cache.get_dataframe('1'))
+        self.assertIsNotNone(obj=self.cache.get_dataframe('2'))
+        self.assertIsNotNone(obj=self.cache.get_dataframe('3'))
@@ -0,0 +1,69 @@
+import threading
+import time
+from unittest import TestCase
+
+import pandas as pd
+from mock import Mock
+
+from qa_python_utils.aws.athena_executor import AthenaQueryExecutor
+
+
+class AthenaQueryExecutorTest(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.athena_client = Mock()
+        self.athena_client.execute_query_and_wait_for_results.side_effect = self.execute_query_and_wait_for_results
+        self.athena_client.get_dataframe_from_query_execution_id.side_effect = \
+            lambda query_execution_id: pd.DataFrame({'id': [query_execution_id]})
+
+    def tearDown(self):
+        pass
+
+    def execute_query_and_wait_for_results(self, sql, query_params, s3_bucket, bucket_folder_path):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if sql == 'fail':
+            raise Exception('query failed')
+        return 'id_{}'.format(sql)
+
+    def test_map(self):
+        # mocks
+        queries = [str(i) for i in range(10)]
+
+        # calls
+        with AthenaQueryExecutor(self.athena_client, max_running_queries=3) as executor:
+            response = dict((sql, df['id'][0]) for sql, df in executor.map(queries))
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=dict((sql, 'id_{}'.format(sql)) for sql in queries)
+        )
+        self.assertLessEqual(self.max_running, 3)
+
+    def test_submit_failure(self):
+        # calls
+        with AthenaQueryExecutor(self.athena_client) as executor:
+            future = executor.submit('fail')
+
+        # assertions
+        self.assertRaises(Exception, future.result)
+        self.athena_client.get_dataframe_from_query_execution_id.assert_not_called()
+
+    def test_shutdown_without_waiting(self):
+        # mocks
+        executor = AthenaQueryExecutor(self.athena_client)
+
+        # calls
+        future = executor.submit('1')
+        executor.shutdown(wait=False)
+
+        # assertions
+        self.assertRaises(RuntimeError, future.result, 5)
+        self.athena_client.get_dataframe_from_query_execution_id.assert_not_called()
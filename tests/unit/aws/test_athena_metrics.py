@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+from qa_python_utils.aws.athena_metrics import MIN_BYTES_SCANNED, QueryMetrics, estimate_cost
+
+
+class QueryMetricsTest(TestCase):
+    def test_record_query_execution(self):
+        # mocks
+        recorded = []
+        metrics = QueryMetrics(hooks=[lambda query_execution_id, metric, value: recorded.append((metric, value))])
+        query_execution = {
+            'QueryExecutionId': '123',
+            'Query': 'SELECT 1',
+            'Status': {'State': 'SUCCEEDED'},
+            'Statistics': {'QueryQueueTimeInMillis': 100, 'EngineExecutionTimeInMillis': 900,
+                           'DataScannedInBytes': 2 * 1024 ** 4}
+        }
+
+        # calls
+        metrics.record_query_execution(query_execution)
+        metrics.record_query_execution(query_execution)
+        response = metrics.get('123')
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second={'state': 'SUCCEEDED', 'query': 'SELECT 1', 'queue_ms': 100, 'engine_ms': 900,
+                    'data_scanned_bytes': 2 * 1024 ** 4, 'cost_usd': 10.0}
+        )
+        self.assertEqual(
+            first=len(recorded),
+            second=4
+        )
+
+    def test_timer_and_summary(self):
+        # mocks
+        metrics = QueryMetrics(max_queries=2)
+
+        # calls
+        for query_execution_id, data_scanned_bytes in [('1', 10), ('2', 30), ('3', 20)]:
+            metrics.record(query_execution_id, 'data_scanned_bytes', data_scanned_bytes)
+            with metrics.timer(query_execution_id, 'parse'):
+                pass
+            with metrics.timer(query_execution_id, 'parse'):
+                pass
+        response = metrics.summary(top=1)
+
+        # assertions
+        self.assertEqual(
+            first=response['queries'],
+            second=3
+        )
+        self.assertEqual(
+            first=response['totals']['data_scanned_bytes'],
+            second=60
+        )
+        self.assertEqual(
+            first=[query_execution_id for query_execution_id, _ in response['most_expensive']],
+            second=['2']
+        )
+        self.assertIsNone(obj=metrics.get('1'))
+        self.assertGreaterEqual(metrics.get('3')['parse_seconds'], 0)
+
+    def test_estimate_cost(self):
+        # assertions
+        self.assertEqual(
+            first=estimate_cost(0),
+            second=estimate_cost(MIN_BYTES_SCANNED)
+        )
+        self.assertEqual(
+            first=estimate_cost(1024 ** 4),
+            second=5.0
+        )
@@ -0,0 +1,122 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import patch
+
+from qa_python_utils.aws.athena_queries import QueryRegistry, QueryTemplate
+
+
+class QueryTemplateTest(TestCase):
+    def test_render(self):
+        # mocks
+        template = QueryTemplate("SELECT CAST(json_parse('{\"a\": {\"b\": 1}}') AS MAP(VARCHAR, JSON)) FROM {table} "
+                                 "WHERE name = {:name} AND id > {:id} AND tag = '{x}'")
+
+        # calls
+        response = template.render({'table': 'db.users', 'name': "o'neil", 'id': 10})
+        bound_response = template.render({'table': 'db.users', 'name': "o'neil", 'id': 10}, bind=True)
+
+        # assertions
+        self.assertEqual(
+            first=template.params,
+            second=frozenset(['table', 'name', 'id', 'x'])
+        )
+        self.assertEqual(
+            first=response,
+            second=("SELECT CAST(json_parse('{\"a\": {\"b\": 1}}') AS MAP(VARCHAR, JSON)) FROM db.users "
+                    "WHERE name = 'o''neil' AND id > 10 AND tag = '{x}'", None)
+        )
+        self.assertEqual(
+            first=bound_response,
+            second=("SELECT CAST(json_parse('{\"a\": {\"b\": 1}}') AS MAP(VARCHAR, JSON)) FROM db.users "
+                    "WHERE name = ? AND id > ? AND tag = '{x}'", ["'o''neil'", '10'])
+        )
+
+    def test_render_literal_braces(self):
+        # mocks
+        template = QueryTemplate("SELECT json_extract_scalar(doc, '$.a') FROM {table} "
+                                 "WHERE regexp_like(code, '^[a-z]{2,3}$') AND doc LIKE '%{%' AND tag = '{{table}}'")
+
+        # calls
+        response = template.render({'table': 'users'})
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=("SELECT json_extract_scalar(doc, '$.a') FROM users "
+                    "WHERE regexp_like(code, '^[a-z]{2,3}$') AND doc LIKE '%{%' AND tag = '{{table}}'", None)
+        )
+
+    def test_render_format_fields(self):
+        # mocks
+        template = QueryTemplate("SELECT * FROM {table!s} WHERE dt = '{dt:%Y-%m-%d}'")
+
+        # calls
+        response = template.render({'table': 'users', 'dt': datetime.date(2019, 1, 2)})
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=("SELECT * FROM users WHERE dt = '2019-01-02'", None)
+        )
+
+    def test_render_without_params(self):
+        # mocks
+        sql = "SELECT json_parse('{\"a\": {{1}}}') FROM {table}"
+
+        # calls
+        response = QueryTemplate(sql).render()
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=(sql, None)
+        )
+
+    def test_render_missing_params(self):
+        # calls
+        with self.assertRaises(ValueError):
+            QueryTemplate('SELECT * FROM {table} WHERE id = {:id}').render({'table': 'users'})
+
+
+class QueryRegistryTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'daily'))
+        self.path = os.path.join(self.directory, 'daily', 'users.sql')
+        with open(self.path, 'w') as f:
+            f.write('SELECT * FROM {table}')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_cached_until_modified(self):
+        # mocks
+        registry = QueryRegistry(self.directory)
+
+        # calls
+        with patch('qa_python_utils.aws.athena_queries.open', create=True, side_effect=open) as mock_open:
+            first_response = registry.get('daily/users')
+            second_response = registry.get('daily/users')
+            with open(self.path, 'w') as f:
+                f.write('SELECT id FROM {table}')
+            os.utime(self.path, (0, 0))
+            third_response = registry.get('daily/users')
+
+        # assertions
+        self.assertEqual(
+            first=registry.names(),
+            second=['daily/users']
+        )
+        self.assertIs(expr1=first_response, expr2=second_response)
+        self.assertEqual(
+            first=third_response.render({'table': 'users'})[0],
+            second='SELECT id FROM users'
+        )
+        self.assertEqual(
+            first=mock_open.call_count,
+            second=2
+        )
@@ -0,0 +1,120 @@
+from unittest import TestCase
+
+import pandas as pd
+from mock import patch
+
+from qa_python_utils.aws.athena_types import apply_athena_types
+
+
+class AthenaTypesTest(TestCase):
+    def test_apply_athena_types(self):
+        # mocks
+        df = pd.DataFrame({
+            'id': ['1', '9007199254740993', ''],
+            'small': ['1', None, '3'],
+            'price': ['1.5', '', 'Infinity'],
+            'active': ['true', 'false', ''],
+            'created_at': ['2018-01-02 03:04:05.000', '', '2018-01-03 00:00:00.000'],
+            'city': ['sp', 'sp', 'rj'],
+            'name': ['a', 'b', 'c'],
+            'tags': ['[a]', '[]', '']
+        })
+        column_info = [
+            {'Name': 'id', 'Type': 'bigint'},
+            {'Name': 'small', 'Type': 'tinyint'},
+            {'Name': 'price', 'Type': 'decimal(10,2)'},
+            {'Name': 'active', 'Type': 'boolean'},
+            {'Name': 'created_at', 'Type': 'timestamp'},
+            {'Name': 'city', 'Type': 'varchar'},
+            {'Name': 'name', 'Type': 'varchar'},
+            {'Name': 'tags', 'Type': 'array'}
+        ]
+
+        # calls
+        response = apply_athena_types(df, column_info, categorical_threshold=0.7)
+
+        # assertions
+        self.assertEqual(
+            first=dict((col, str(response[col].dtype)) for col in response),
+            second={
+                'id': 'Int64',
+                'small': 'Int8',
+                'price': 'float64',
+                'active': 'object',
+                'created_at': 'datetime64[ns]',
+                'city': 'category',
+                'name': 'object',
+                'tags': 'object'
+            }
+        )
+        self.assertEqual(
+            first=response['id'][1],
+            second=9007199254740993
+        )
+        self.assertTrue(pd.isnull(response['id'][2]))
+        self.assertEqual(
+            first=list(response['active']),
+            second=[True, False, None]
+        )
+        self.assertTrue(pd.isnull(response['created_at'][1]))
+
+    def test_apply_athena_types_invalid_values(self):
+        # mocks
+        df = pd.DataFrame({'id': ['1', 'x']})
+
+        # calls
+        response = apply_athena_types(df, [{'Name': 'id', 'Type': 'integer'}])
+
+        # assertions
+        self.assertEqual(
+            first=list(response['id']),
+            second=['1', 'x']
+        )
+
+    def test_apply_athena_types_invalid_timestamps(self):
+        # mocks
+        df = pd.DataFrame({'created_at': ['2018-01-02 03:04:05.000', 'not a date']})
+
+        # calls
+        response = apply_athena_types(df, [{'Name': 'created_at', 'Type': 'timestamp'}])
+
+        # assertions
+        self.assertEqual(
+            first=list(response['created_at']),
+            second=['2018-01-02 03:04:05.000', 'not a date']
+        )
+
+    def test_apply_athena_types_without_integer_array(self):
+        # mocks
+        df = pd.DataFrame({'id': ['1', ''], 'small': ['1', '2']})
+        column_info = [{'Name': 'id', 'Type': 'bigint'}, {'Name': 'small', 'Type': 'tinyint'}]
+
+        # calls
+        with patch('qa_python_utils.aws.athena_types.HAS_INTEGER_ARRAY', False):
+            response = apply_athena_types(df, column_info)
+
+        # assertions
+        self.assertEqual(
+            first=dict((col, str(response[col].dtype)) for col in response),
+            second={'id': 'float64', 'small': 'int8'}
+        )
+        self.assertTrue(pd.isnull(response['id'][1]))
+
+    def test_apply_athena_types_in_chunks(self):
+        # mocks
+        chunks = [pd.DataFrame({'city': ['sp', 'sp', 'sp']}), pd.DataFrame({'city': ['rj', 'bh', 'poa']})]
+        column_info = [{'Name': 'city', 'Type': 'varchar'}]
+        categorical_columns = {}
+
+        # calls
+        responses = [apply_athena_types(df, column_info, 0.5, categorical_columns) for df in chunks]
+
+        # assertions
+        self.assertEqual(
+            first=[str(response['city'].dtype) for response in responses],
+            second=['category', 'category']
+        )
+        self.assertEqual(
+            first=categorical_columns,
+            second={0: True}
+        )
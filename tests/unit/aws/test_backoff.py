@@ -0,0 +1,71 @@
+from itertools import islice
+from unittest import TestCase
+
+from botocore.exceptions import ClientError, ConnectTimeoutError
+from mock import patch
+
+from qa_python_utils.aws.backoff import TokenBucket, is_retryable_error, poll_intervals, retry_delay
+
+
+class BackoffTest(TestCase):
+    def test_poll_intervals_grow_up_to_maximum(self):
+        # calls
+        response = list(islice(poll_intervals(initial=0.1, maximum=1, factor=2, jitter=0), 6))
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=[0.1, 0.2, 0.4, 0.8, 1, 1]
+        )
+
+    def test_poll_intervals_jitter(self):
+        # calls
+        response = list(islice(poll_intervals(initial=1, maximum=1, jitter=0.2), 100))
+
+        # assertions
+        self.assertTrue(all(0.8 <= interval <= 1.2 for interval in response))
+        self.assertGreater(len(set(response)), 1)
+
+    def test_retry_delay(self):
+        # calls
+        response = [retry_delay(attempt, base=1, maximum=8) for attempt in range(1, 7)]
+
+        # assertions
+        for delay, expected in zip(response, [1, 2, 4, 8, 8, 8]):
+            self.assertTrue(expected / 2.0 <= delay <= expected)
+
+    def test_is_retryable_error(self):
+        # mocks
+        def error(code, status):
+            return ClientError({'Error': {'Code': code, 'Message': ''}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+                               'StartQueryExecution')
+
+        # assertions
+        self.assertTrue(is_retryable_error(error('TooManyRequestsException', 400)))
+        self.assertTrue(is_retryable_error(error('Unknown', 503)))
+        self.assertFalse(is_retryable_error(error('InvalidRequestException', 400)))
+        self.assertTrue(is_retryable_error(ConnectTimeoutError(endpoint_url='https://athena.us-east-1.amazonaws.com')))
+
+    @patch('qa_python_utils.aws.backoff.time')
+    def test_token_bucket(self, time):
+        # mocks
+        now = [0.0]
+        time.time.side_effect = lambda: now[0]
+
+        def sleep(seconds):
+            now[0] += seconds
+        time.sleep.side_effect = sleep
+        bucket = TokenBucket(rate=2, capacity=2)
+
+        # calls
+        response = [bucket.acquire() for _ in range(4)]
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=[0, 0, 0.5, 0.5]
+        )
+        self.assertEqual(
+            first=now[0],
+            second=1.0
+        )
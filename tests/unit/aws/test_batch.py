@@ -1,7 +1,11 @@
+import threading
+import time
 from unittest import TestCase
 
 import botocore.session
+from botocore.exceptions import ReadTimeoutError
 from botocore.stub import Stubber
+from mock import Mock, patch
 
 from qa_python_utils.aws.batch import BatchClient
 
@@ -286,3 +290,275 @@ class AWSBatchTest(TestCase):
             first=response,
             second=stopped_at
         )
+
+    def test_get_queue_snapshot_paginates(self):
+        # mocks
+        self.batch_stubber.add_response(
+            method='list_jobs',
+            service_response={'jobSummaryList': [{'jobId': '1', 'jobName': 'a'}, {'jobId': '2', 'jobName': 'b'}],
+                              'nextToken': 'token'},
+            expected_params={'jobQueue': 'queue', 'jobStatus': 'RUNNING', 'maxResults': 1000}
+        )
+        self.batch_stubber.add_response(
+            method='list_jobs',
+            service_response={'jobSummaryList': [{'jobId': '3', 'jobName': 'a'}]},
+            expected_params={'jobQueue': 'queue', 'jobStatus': 'RUNNING', 'maxResults': 1000, 'nextToken': 'token'}
+        )
+
+        # calls
+        with self.batch_stubber:
+            self.batch_client._batch_client = self.batch_session
+            snapshot = self.batch_client.get_queue_snapshot(job_queue='queue')
+            cached_snapshot = self.batch_client.get_queue_snapshot(job_queue='queue')
+
+        # assertions
+        self.assertIs(expr1=snapshot, expr2=cached_snapshot)
+        self.assertEqual(
+            first=[job_summary['jobId'] for job_summary in snapshot.get_jobs(job_name='a', status='RUNNING')],
+            second=['1', '3']
+        )
+        self.assertEqual(
+            first=snapshot.count('b'),
+            second=1
+        )
+
+    def test_start_batch_job_lists_queue_once_per_ttl(self):
+        # mocks
+        self.batch_stubber.add_response(
+            method='list_jobs',
+            service_response={'jobSummaryList': [{'jobId': '1', 'jobName': 'job'}]},
+            expected_params={'jobQueue': 'queue', 'jobStatus': 'RUNNING', 'maxResults': 1000}
+        )
+        for job_id in ['2', '3']:
+            self.batch_stubber.add_response(
+                method='submit_job',
+                service_response={'jobId': job_id, 'jobName': 'job'}
+            )
+
+        # calls
+        with self.batch_stubber:
+            self.batch_client._batch_client = self.batch_session
+            responses = [
+                self.batch_client.start_batch_job(job_name='job', job_queue='queue', job_definition='definition',
+                                                  command=['run'], max_running_jobs=2)
+                for _ in range(2)
+            ]
+
+        # assertions
+        self.assertEqual(
+            first=[response['jobId'] for response in responses],
+            second=['2', '3']
+        )
+        self.batch_stubber.assert_no_pending_responses()
+
+    def test_get_queue_snapshot_lists_once_for_concurrent_callers(self):
+        # mocks
+        def list_jobs(**kwargs):
+            time.sleep(0.1)
+            return {'jobSummaryList': [{'jobId': '1', 'jobName': 'job'}]}
+
+        self.batch_client._batch_client = Mock()
+        self.batch_client._batch_client.list_jobs.side_effect = list_jobs
+        snapshots = []
+
+        # calls
+        threads = [threading.Thread(target=lambda: snapshots.append(self.batch_client.get_queue_snapshot('queue')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # assertions
+        self.assertEqual(
+            first=self.batch_client._batch_client.list_jobs.call_count,
+            second=1
+        )
+        self.assertEqual(
+            first=len(set(id(snapshot) for snapshot in snapshots)),
+            second=1
+        )
+
+    def test_describe_jobs_by_ids_batches_and_caches_terminal_jobs(self):
+        # mocks
+        job_ids = [str(job_id) for job_id in range(150)]
+        for start in [0, 100]:
+            self.batch_stubber.add_response(
+                method='describe_jobs',
+                service_response={'jobs': [
+                    {'jobId': job_id, 'jobName': 'job', 'jobQueue': 'queue', 'jobDefinition': 'definition',
+                     'startedAt': 1, 'status': 'SUCCEEDED' if int(job_id) % 2 == 0 else 'RUNNING'}
+                    for job_id in job_ids[start:start + 100]
+                ]},
+                expected_params={'jobs': job_ids[start:start + 100]}
+            )
+        self.batch_stubber.add_response(
+            method='describe_jobs',
+            service_response={'jobs': []},
+            expected_params={'jobs': [job_id for job_id in job_ids if int(job_id) % 2 == 1]}
+        )
+
+        # calls
+        with self.batch_stubber:
+            self.batch_client._batch_client = self.batch_session
+            jobs = self.batch_client.describe_jobs_by_ids(job_ids)
+            fields = self.batch_client.get_jobs_fields_by_ids(job_ids, ['status', 'stoppedAt'])
+
+        # assertions
+        self.assertEqual(
+            first=len(jobs),
+            second=150
+        )
+        self.assertEqual(
+            first=len(fields),
+            second=75
+        )
+        self.assertEqual(
+            first=fields['0'],
+            second={'status': 'SUCCEEDED', 'stoppedAt': None}
+        )
+        self.batch_stubber.assert_no_pending_responses()
+
+    def test_submit_jobs_chains_dependencies(self):
+        # mocks
+        jobs = [
+            {'job_name': 'extract', 'job_queue': 'queue', 'job_definition': 'definition', 'command': ['extract'],
+             'array_size': 10},
+            {'job_name': 'load', 'job_queue': 'queue', 'job_definition': 'definition', 'command': ['load'],
+             'depends_on': [0, 'external']}
+        ]
+        self.batch_stubber.add_response(
+            method='submit_job',
+            service_response={'jobId': '1', 'jobName': 'extract'},
+            expected_params={'jobName': 'extract', 'jobQueue': 'queue', 'jobDefinition': 'definition',
+                             'containerOverrides': {'vcpus': 4, 'memory': 4096, 'command': ['extract']},
+                             'retryStrategy': {'attempts': 1}, 'arrayProperties': {'size': 10}}
+        )
+        self.batch_stubber.add_client_error(
+            method='submit_job',
+            service_error_code='TooManyRequestsException'
+        )
+        self.batch_stubber.add_response(
+            method='submit_job',
+            service_response={'jobId': '2', 'jobName': 'load'},
+            expected_params={'jobName': 'load', 'jobQueue': 'queue', 'jobDefinition': 'definition',
+                             'containerOverrides': {'vcpus': 4, 'memory': 4096, 'command': ['load']},
+                             'retryStrategy': {'attempts': 1},
+                             'dependsOn': [{'jobId': '1'}, {'jobId': 'external'}]}
+        )
+
+        # calls
+        with self.batch_stubber, patch('qa_python_utils.aws.batch.time.sleep'):
+            self.batch_client._submit_client = self.batch_session
+            results = self.batch_client.submit_jobs(jobs)
+
+        # assertions
+        self.assertEqual(
+            first=[(result['jobId'], result['status']) for result in results],
+            second=[('1', 'SUBMITTED'), ('2', 'SUBMITTED')]
+        )
+
+    def test_submit_array_job_retries_connection_errors(self):
+        # mocks
+        self.batch_client._submit_client = Mock()
+        self.batch_client._submit_client.submit_job.side_effect = [
+            ReadTimeoutError(endpoint_url='https://batch.us-east-1.amazonaws.com'),
+            {'jobId': '1', 'jobName': 'job'}
+        ]
+
+        # calls
+        with patch('qa_python_utils.aws.batch.time.sleep') as sleep:
+            response = self.batch_client.submit_array_job(job_name='job', job_queue='queue', job_definition='definition',
+                                                          size=10, command=['run'])
+
+        # assertions
+        self.assertEqual(
+            first=response['jobId'],
+            second='1'
+        )
+        self.assertEqual(
+            first=self.batch_client._submit_client.submit_job.call_count,
+            second=2
+        )
+        sleep.assert_called_once()
+
+    def test_submit_jobs_fails_dependents_of_failed_jobs(self):
+        # mocks
+        jobs = [
+            {'job_name': 'extract', 'job_queue': 'queue', 'job_definition': 'definition', 'command': ['extract']},
+            {'job_name': 'load', 'job_queue': 'queue', 'job_definition': 'definition', 'command': ['load'],
+             'depends_on': [0]}
+        ]
+        self.batch_stubber.add_client_error(
+            method='submit_job',
+            service_error_code='ClientException'
+        )
+
+        # calls
+        with self.batch_stubber:
+            self.batch_client._submit_client = self.batch_session
+            results = self.batch_client.submit_jobs(jobs)
+
+        # assertions
+        self.assertEqual(
+            first=[result['status'] for result in results],
+            second=['FAILED', 'FAILED']
+        )
+        self.assertIsNone(obj=results[1]['jobId'])
+
+    def test_wait_for_many_jobs_drops_finished_jobs(self):
+        # mocks
+        self.batch_stubber.add_response(
+            method='describe_jobs',
+            service_response={'jobs': [
+                {'jobId': '1', 'jobName': 'job', 'jobQueue': 'queue', 'jobDefinition': 'definition', 'startedAt': 1,
+                 'status': 'SUCCEEDED'},
+                {'jobId': '2', 'jobName': 'job', 'jobQueue': 'queue', 'jobDefinition': 'definition', 'startedAt': 1,
+                 'status': 'RUNNING'}
+            ]},
+            expected_params={'jobs': ['1', '2']}
+        )
+        self.batch_stubber.add_response(
+            method='describe_jobs',
+            service_response={'jobs': [
+                {'jobId': '2', 'jobName': 'job', 'jobQueue': 'queue', 'jobDefinition': 'definition', 'startedAt': 1,
+                 'status': 'FAILED'}
+            ]},
+            expected_params={'jobs': ['2']}
+        )
+
+        # calls
+        with self.batch_stubber, patch('qa_python_utils.aws.batch.time.sleep') as sleep:
+            self.batch_client._batch_client = self.batch_session
+            jobs = list(self.batch_client.wait_for_many_jobs(['1', '2']))
+
+        # assertions
+        self.assertEqual(
+            first=[(job['jobId'], job['status']) for job in jobs],
+            second=[('1', 'SUCCEEDED'), ('2', 'FAILED')]
+        )
+        self.assertEqual(
+            first=sleep.call_count,
+            second=1
+        )
+
+    def test_wait_for_many_jobs_not_found(self):
+        # mocks
+        for _ in range(3):
+            self.batch_stubber.add_response(
+                method='describe_jobs',
+                service_response={'jobs': []},
+                expected_params={'jobs': ['1']}
+            )
+
+        # calls
+        with self.batch_stubber, patch('qa_python_utils.aws.batch.time.sleep'):
+            self.batch_client._batch_client = self.batch_session
+            jobs = list(self.batch_client.wait_for_many_jobs(['1']))
+
+        # assertions
+        self.assertEqual(
+            first=jobs,
+            second=[{'jobId': '1', 'status': 'NOT_FOUND'}]
+        )
+        self.batch_stubber.assert_no_pending_responses()
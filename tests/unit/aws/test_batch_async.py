@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from mock import Mock
+
+from qa_python_utils.aws.batch_async import AsyncBatchClient
+from tests.unit.aws.polling_fake import PollingFake
+
+
+class AsyncBatchClientTest(TestCase):
+    def setUp(self):
+        self.fake = PollingFake()
+        self.batch_client = Mock()
+        self.batch_client.describe_jobs_by_ids.side_effect = lambda job_ids: dict(
+            (job_id, {'jobId': job_id, 'status': status}) for job_id, status in self.fake.states(job_ids))
+        self.async_client = AsyncBatchClient(self.batch_client, check_sleep_time=0.01)
+
+    def tearDown(self):
+        self.async_client.close()
+
+    def test_wait_for_jobs(self):
+        # calls
+        futures = self.async_client.wait_for_jobs([str(i) for i in range(5)])
+        response = [future.result(timeout=5)['jobId'] for future in futures]
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=[str(i) for i in range(5)]
+        )
+        self.assertEqual(
+            first=self.fake.polls,
+            second=dict((str(i), 3) for i in range(5))
+        )
+
+    def test_wait_for_job_failed(self):
+        # calls
+        future = self.async_client.wait_for_job('fail')
+
+        # assertions
+        self.assertRaises(Exception, future.result, 5)
+
+    def test_wait_for_job_not_found(self):
+        # calls
+        future = self.async_client.wait_for_job('missing')
+
+        # assertions
+        self.assertRaises(Exception, future.result, 5)
+        self.assertEqual(
+            first=self.fake.polls['missing'],
+            second=3
+        )
+
+    def test_wait_for_job_timeout(self):
+        # calls
+        future = self.async_client.wait_for_job('slow', timeout=0.05)
+        other_future = self.async_client.wait_for_job('0')
+
+        # assertions
+        self.assertRaises(Exception, future.result, 5)
+        self.assertEqual(
+            first=other_future.result(timeout=5)['status'],
+            second='SUCCEEDED'
+        )
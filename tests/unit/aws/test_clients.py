@@ -0,0 +1,66 @@
+from threading import Thread
+from unittest import TestCase
+
+from botocore.config import Config
+
+from qa_python_utils.aws.clients import clear_pool, get_client, get_resource, get_session
+
+
+class ClientsTest(TestCase):
+    def setUp(self):
+        clear_pool()
+
+    def tearDown(self):
+        clear_pool()
+
+    def test_get_client_pooled(self):
+        # calls
+        clients = []
+        threads = [Thread(target=lambda: clients.append(get_client('athena', region_name='us-east-1')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other_credentials = get_client('athena', aws_access_key_id='key', aws_secret_access_key='secret',
+                                       region_name='us-east-1')
+        other_options = get_client('athena', region_name='us-east-1', max_pool_connections=5)
+
+        # assertions
+        self.assertEqual(
+            first=len(set(id(client) for client in clients)),
+            second=1
+        )
+        self.assertIsNot(expr1=clients[0], expr2=other_credentials)
+        self.assertIsNot(expr1=clients[0], expr2=other_options)
+        self.assertEqual(
+            first=other_options.meta.config.max_pool_connections,
+            second=5
+        )
+
+    def test_get_client_with_config(self):
+        # calls
+        client = get_client('sns', region_name='us-east-1', config=Config(connect_timeout=3, retries={'max_attempts': 0}))
+        same_client = get_client('sns', region_name='us-east-1',
+                                 config=Config(connect_timeout=3, retries={'max_attempts': 0}))
+        other_client = get_client('sns', region_name='us-east-1', config=Config(retries={'max_attempts': 1}))
+
+        # assertions
+        self.assertIs(expr1=client, expr2=same_client)
+        self.assertIsNot(expr1=client, expr2=other_client)
+        self.assertEqual(
+            first=(client.meta.config.max_pool_connections, client.meta.config.connect_timeout),
+            second=(50, 3)
+        )
+
+    def test_get_resource_and_session_pooled(self):
+        # calls
+        resource = get_resource('s3', region_name='us-east-1')
+        other_resource = get_resource('s3', region_name='us-east-1')
+
+        # assertions
+        self.assertIsNot(expr1=resource, expr2=other_resource)
+        self.assertIs(expr1=resource.meta.client, expr2=get_client('s3', region_name='us-east-1'))
+        self.assertIs(expr1=resource.meta.client, expr2=other_resource.meta.client)
+        self.assertIs(expr1=get_session(region_name='us-east-1'), expr2=get_session(region_name='us-east-1'))
+        self.assertIsNot(expr1=get_session(region_name='us-east-1'), expr2=get_session(region_name='sa-east-1'))
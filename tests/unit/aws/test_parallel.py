@@ -0,0 +1,45 @@
+import os
+from unittest import TestCase
+
+from qa_python_utils.aws.parallel import map_reduce
+
+
+def square_with_pid(value):
+    return value * value, os.getpid()
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError('three')
+    return value
+
+
+class ParallelTest(TestCase):
+    def test_map_reduce(self):
+        # calls
+        response = map_reduce(iter(range(20)), square_with_pid, lambda total, result: total + [result], initializer=[],
+                              processes=2, max_in_flight=3)
+
+        # assertions
+        self.assertEqual(
+            first=[value for value, _ in response],
+            second=[value * value for value in range(20)]
+        )
+        self.assertNotIn(member=os.getpid(), container=set(pid for _, pid in response))
+
+    def test_map_reduce_without_initializer(self):
+        # calls
+        response = map_reduce([1, 2, 3], abs, lambda total, value: total + value, processes=1)
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=6
+        )
+        with self.assertRaises(TypeError):
+            map_reduce([], abs, max, processes=1)
+
+    def test_map_reduce_error(self):
+        # calls
+        with self.assertRaises(ValueError):
+            map_reduce(range(5), fail_on_three, max, processes=2)
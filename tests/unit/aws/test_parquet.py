@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import fastparquet as fp
+import pandas as pd
+
+from qa_python_utils.aws.parquet import append_parquet_dataset, compact_parquet_dataset, write_parquet_row_groups
+
+
+class ParquetTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_parquet_row_groups(self):
+        # mocks
+        dfs = [
+            pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']}),
+            pd.DataFrame({'id': [], 'name': []}),
+            pd.DataFrame({'id': [3.0, None], 'name': [None, 'd']}, index=[5, 6])
+        ]
+
+        # calls
+        rows = write_parquet_row_groups(iter(dfs), self.path, open_with=open)
+
+        # assertions
+        pf = fp.ParquetFile(self.path)
+        self.assertEqual(
+            first=rows,
+            second=4
+        )
+        self.assertEqual(
+            first=len(pf.row_groups),
+            second=2
+        )
+        df = pf.to_pandas()
+        self.assertEqual(
+            first=df.where(df.notnull(), None).values.tolist(),
+            second=[[1, 'a'], [2, 'b'], [3, None], [None, 'd']]
+        )
+
+    def test_write_parquet_row_groups_empty(self):
+        # calls
+        rows = write_parquet_row_groups([pd.DataFrame({'id': []})], self.path, open_with=open)
+
+        # assertions
+        self.assertEqual(
+            first=rows,
+            second=0
+        )
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_append_parquet_dataset(self):
+        # mocks
+        os.mkdir(self.path)
+
+        # calls
+        for ids in [[1, 2], [3], [4, 5]]:
+            row_groups = append_parquet_dataset(pd.DataFrame({'id': ids, 'name': ['a'] * len(ids)}, index=ids),
+                                                self.path, open_with=open)
+
+        # assertions
+        self.assertEqual(
+            first=row_groups,
+            second=3
+        )
+        self.assertEqual(
+            first=fp.ParquetFile(self.path).to_pandas()['id'].tolist(),
+            second=[1, 2, 3, 4, 5]
+        )
+        with self.assertRaises(ValueError):
+            append_parquet_dataset(pd.DataFrame({'id': ['six'], 'name': ['a']}), self.path, open_with=open)
+        with self.assertRaises(ValueError):
+            append_parquet_dataset(pd.DataFrame({'id': [6]}), self.path, open_with=open)
+
+    def test_append_parquet_dataset_with_nulls(self):
+        # mocks
+        os.mkdir(self.path)
+        append_parquet_dataset(pd.DataFrame({'id': [1, 2], 'name': ['a', 'b'], 'score': [0.5, 1.5]}), self.path,
+                               open_with=open)
+
+        # calls
+        append_parquet_dataset(pd.DataFrame({'id': [3, None], 'name': [None, 'd'], 'score': [None, 2]}), self.path,
+                               open_with=open)
+        append_parquet_dataset(pd.DataFrame({'id': [None], 'name': [None], 'score': [None]}), self.path,
+                               open_with=open)
+
+        # assertions
+        df = fp.ParquetFile(self.path).to_pandas().astype(object)
+        self.assertEqual(
+            first=df.where(df.notnull(), None).values.tolist(),
+            second=[[1, 'a', 0.5], [2, 'b', 1.5], [3, None, None], [None, 'd', 2], [None, None, None]]
+        )
+
+    def test_compact_parquet_dataset(self):
+        # mocks
+        os.mkdir(self.path)
+        for ids in [list(range(10)), [10], [11, 12]]:
+            append_parquet_dataset(pd.DataFrame({'id': ids}), self.path, open_with=open)
+
+        # calls
+        merged = compact_parquet_dataset(self.path, open_with=open, remove_with=os.remove, small_row_group_rows=5)
+
+        # assertions
+        pf = fp.ParquetFile(self.path)
+        self.assertEqual(
+            first=merged,
+            second=2
+        )
+        self.assertEqual(
+            first=[row_group.num_rows for row_group in pf.row_groups],
+            second=[10, 3]
+        )
+        self.assertEqual(
+            first=sorted(pf.to_pandas()['id'].tolist()),
+            second=list(range(13))
+        )
+        self.assertEqual(
+            first=sorted(os.listdir(self.path)),
+            second=['_common_metadata', '_metadata', 'part.0.parquet', 'part.3.parquet']
+        )
@@ -0,0 +1,58 @@
+import threading
+from unittest import TestCase
+
+from qa_python_utils.aws.prefetch import prefetch
+
+
+class PrefetchTest(TestCase):
+    def test_prefetch(self):
+        # calls
+        response = list(prefetch(iter(range(10)), depth=3))
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=list(range(10))
+        )
+
+    def test_prefetch_runs_ahead_of_consumer(self):
+        # mocks
+        produced = []
+        ready = threading.Event()
+
+        def items():
+            for i in range(5):
+                produced.append(i)
+                if i == 2:
+                    ready.set()
+                yield i
+
+        # calls
+        iterator = prefetch(items(), depth=2)
+        first = next(iterator)
+        ready.wait(5)
+
+        # assertions
+        self.assertEqual(
+            first=first,
+            second=0
+        )
+        # depth items queued, plus at most one being handed over
+        self.assertIn(produced, [[0, 1, 2], [0, 1, 2, 3]])
+        iterator.close()
+
+    def test_prefetch_error(self):
+        # mocks
+        def items():
+            yield 1
+            raise ValueError('failed')
+
+        # calls
+        iterator = prefetch(items())
+
+        # assertions
+        self.assertEqual(
+            first=next(iterator),
+            second=1
+        )
+        self.assertRaises(ValueError, next, iterator)
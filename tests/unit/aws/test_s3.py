@@ -0,0 +1,170 @@
+from io import BytesIO
+from unittest import TestCase
+
+import os
+import tempfile
+
+import botocore.session
+import pandas as pd
+from botocore.stub import Stubber
+
+from qa_python_utils.aws.s3 import download_s3_object_in_parts, list_partition_prefixes, open_s3_object, \
+    parse_s3_url
+
+
+class S3Test(TestCase):
+    def setUp(self):
+        self.s3_session = botocore.session.get_session().create_client('s3', region_name='us-east-1')
+        self.s3_stubber = Stubber(self.s3_session)
+
+    def tearDown(self):
+        pass
+
+    def __stub_ranged_object(self, body, range_size):
+        self.s3_stubber.add_response(
+            method='head_object',
+            service_response={'ContentLength': len(body)},
+            expected_params={'Bucket': 'bucket', 'Key': 'key'}
+        )
+        for start in range(0, len(body), range_size):
+            end = min(start + range_size, len(body)) - 1
+            self.s3_stubber.add_response(
+                method='get_object',
+                service_response={'Body': BytesIO(body[start:end + 1])},
+                expected_params={'Bucket': 'bucket', 'Key': 'key', 'Range': 'bytes={}-{}'.format(start, end)}
+            )
+
+    def test_parse_s3_url(self):
+        # calls
+        response = parse_s3_url('s3://bucket/folder/file.csv')
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=('bucket', 'folder/file.csv')
+        )
+
+    def test_parse_s3_url_invalid(self):
+        # calls and assertions
+        with self.assertRaises(ValueError):
+            parse_s3_url('bucket/folder/file.csv')
+
+    def test_open_s3_object(self):
+        # mocks
+        body = b'0123456789abcdefghij'
+        self.__stub_ranged_object(body=body, range_size=8)
+
+        # calls
+        with self.s3_stubber:
+            with open_s3_object(self.s3_session, 'bucket', 'key', range_size=8) as f:
+                response = f.read()
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=body
+        )
+        self.s3_stubber.assert_no_pending_responses()
+
+    def test_open_s3_object_read_csv_across_ranges(self):
+        # mocks
+        body = b'id,text\n1,"multi\nline, quoted"\n2,plain\n3,"with ""quotes"""\n'
+        self.__stub_ranged_object(body=body, range_size=7)
+
+        # calls
+        with self.s3_stubber:
+            with open_s3_object(self.s3_session, 'bucket', 'key', range_size=7) as f:
+                chunks = list(pd.read_csv(f, chunksize=2, keep_default_na=False))
+
+        # assertions
+        self.assertEqual(
+            first=[len(chunk) for chunk in chunks],
+            second=[2, 1]
+        )
+        df = pd.concat(chunks)
+        self.assertEqual(
+            first=list(df['text']),
+            second=['multi\nline, quoted', 'plain', 'with "quotes"']
+        )
+
+    def test_download_s3_object_in_parts(self):
+        # mocks
+        body = b'0123456789abcdefghij'
+        self.__stub_ranged_object(body=body, range_size=6)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+
+        # calls
+        try:
+            with self.s3_stubber:
+                size = download_s3_object_in_parts(self.s3_session, 'bucket', 'key', path, part_size=6,
+                                                   max_concurrency=1)
+            with open(path, 'rb') as f:
+                response = f.read()
+        finally:
+            os.remove(path)
+
+        # assertions
+        self.assertEqual(
+            first=size,
+            second=len(body)
+        )
+        self.assertEqual(
+            first=response,
+            second=body
+        )
+
+    def test_list_partition_prefixes(self):
+        # mocks
+        listings = [
+            ('table/', ['table/dt=2019-01-01/', 'table/dt=2019-01-02/', 'table/_temporary/']),
+            ('table/dt=2019-01-01/', ['table/dt=2019-01-01/city=rj/', 'table/dt=2019-01-01/city=sp/']),
+            ('table/dt=2019-01-02/', ['table/dt=2019-01-02/city=sp/']),
+            ('table/dt=2019-01-01/city=rj/', []),
+            ('table/dt=2019-01-01/city=sp/', []),
+            ('table/dt=2019-01-02/city=sp/', [])
+        ]
+        for prefix, common_prefixes in listings:
+            self.s3_stubber.add_response(
+                method='list_objects_v2',
+                service_response={'CommonPrefixes': [{'Prefix': common_prefix} for common_prefix in common_prefixes]},
+                expected_params={'Bucket': 'bucket', 'Prefix': prefix, 'Delimiter': '/'}
+            )
+
+        # calls
+        with self.s3_stubber:
+            response = list_partition_prefixes(self.s3_session, 'bucket', 'table', max_concurrency=1)
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=['dt=2019-01-01/city=rj', 'dt=2019-01-01/city=sp', 'dt=2019-01-02/city=sp']
+        )
+
+    def test_list_partition_prefixes_known(self):
+        # mocks
+        listings = [
+            ('table/', ['table/dt=2019-01-01/', 'table/dt=2019-01-02/']),
+            ('table/dt=2019-01-01/', ['table/dt=2019-01-01/city=rj/', 'table/dt=2019-01-01/city=sp/']),
+            ('table/dt=2019-01-02/', ['table/dt=2019-01-02/city=sp/']),
+            ('table/dt=2019-01-02/city=sp/', [])
+        ]
+        for prefix, common_prefixes in listings:
+            self.s3_stubber.add_response(
+                method='list_objects_v2',
+                service_response={'CommonPrefixes': [{'Prefix': common_prefix} for common_prefix in common_prefixes]},
+                expected_params={'Bucket': 'bucket', 'Prefix': prefix, 'Delimiter': '/'}
+            )
+
+        # calls
+        with self.s3_stubber:
+            response = list_partition_prefixes(self.s3_session, 'bucket', 'table', max_concurrency=1,
+                                               known=['dt=2019-01-01/city=rj', 'dt=2019-01-01/city=sp',
+                                                      'dt=2018-12-31/city=sp'])
+
+        # assertions
+        self.assertEqual(
+            first=response,
+            second=['dt=2019-01-01/city=rj', 'dt=2019-01-01/city=sp', 'dt=2019-01-02/city=sp']
+        )
+        self.s3_stubber.assert_no_pending_responses()
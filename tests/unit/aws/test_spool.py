@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import time
+from threading import Thread
+from unittest import TestCase
+
+from qa_python_utils.aws.spool import ResultSpool
+
+
+def writer(content):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(content)
+    return write
+
+
+class ResultSpoolTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_or_create_reuses_files(self):
+        # mocks
+        spool = ResultSpool(self.directory, max_bytes=100)
+        calls = []
+
+        def write(path):
+            calls.append(path)
+            writer(b'abc')(path)
+
+        # calls
+        first_path = spool.get_or_create('1.csv', write)
+        second_path = spool.get_or_create('1.csv', write)
+
+        # assertions
+        self.assertEqual(first=first_path, second=second_path)
+        self.assertEqual(first=len(calls), second=1)
+        with open(first_path, 'rb') as f:
+            self.assertEqual(first=f.read(), second=b'abc')
+
+    def test_open_or_create_writes_once_across_threads(self):
+        # mocks
+        spool = ResultSpool(self.directory, max_bytes=100)
+        calls = []
+
+        def write(path):
+            calls.append(path)
+            time.sleep(0.05)
+            writer(b'abc')(path)
+
+        def read():
+            with spool.open_or_create('1.csv', write) as f:
+                contents.append(f.read())
+
+        contents = []
+        threads = [Thread(target=read) for _ in range(8)]
+
+        # calls
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # assertions
+        self.assertEqual(first=len(calls), second=1)
+        self.assertEqual(first=contents, second=[b'abc'] * 8)
+        self.assertEqual(first=os.listdir(self.directory), second=['1.csv'])
+        self.assertEqual(first=spool.size, second=3)
+
+    def test_open_file_survives_eviction(self):
+        # mocks
+        spool = ResultSpool(self.directory, max_bytes=4)
+
+        # calls
+        f = spool.open_or_create('1.csv', writer(b'1' * 4))
+        spool.get_or_create('2.csv', writer(b'2' * 4))
+
+        # assertions
+        with f:
+            self.assertEqual(first=f.read(), second=b'1' * 4)
+        self.assertIsNone(obj=spool.open('1.csv'))
+        self.assertEqual(first=os.listdir(self.directory), second=['2.csv'])
+
+    def test_evicts_least_recently_used(self):
+        # mocks
+        spool = ResultSpool(self.directory, max_bytes=10)
+
+        # calls
+        spool.get_or_create('1.csv', writer(b'1' * 4))
+        spool.get_or_create('2.csv', writer(b'2' * 4))
+        spool.get('1.csv')
+        spool.get_or_create('3.csv', writer(b'3' * 4))
+
+        # assertions
+        self.assertEqual(
+            first=sorted(os.listdir(self.directory)),
+            second=['1.csv', '3.csv']
+        )
+        self.assertEqual(first=spool.size, second=8)
+        self.assertIsNone(obj=spool.get('2.csv'))
+
+    def test_failed_write_leaves_nothing(self):
+        # mocks
+        spool = ResultSpool(self.directory)
+
+        def write(path):
+            writer(b'partial')(path)
+            raise IOError('connection reset')
+
+        # calls
+        with self.assertRaises(IOError):
+            spool.get_or_create('1.csv', write)
+
+        # assertions
+        self.assertEqual(first=os.listdir(self.directory), second=[])
+        self.assertIsNone(obj=spool.get('1.csv'))
+
+    def test_adopts_existing_files(self):
+        # mocks
+        ResultSpool(self.directory).get_or_create('1.csv', writer(b'abc'))
+
+        # calls
+        spool = ResultSpool(self.directory)
+
+        # assertions
+        self.assertEqual(first=spool.size, second=3)
+        self.assertIsNotNone(obj=spool.get('1.csv'))